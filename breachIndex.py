@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# breach_index.py
+"""
+On-disk index of breached passwords for the password validation server.
+
+The index file holds the first 8 bytes of the SHA-1 of every password,
+sorted and de-duplicated, after a 16-byte header. Lookups mmap the file and
+search it in place, so an index of hundreds of millions of hashes costs no
+Python memory and answers in microseconds: the hashes are uniformly
+spread, so an interpolation guess lands next to the right slot and a short
+binary search finishes the job. With 8-byte prefixes a false match is
+about n / 2**64 likely, i.e. never in practice.
+
+Build one from a plain wordlist (one password per line), or from a list of
+SHA-1 hashes in hex ("HASH" or "HASH:count" lines, as breach corpora ship):
+    python3 breachIndex.py build rockyou.txt breach.idx
+    python3 breachIndex.py build pwned-passwords-sha1.txt breach.idx --sha1
+    python3 breachIndex.py check breach.idx 'P@ssw0rd' 'Zq8_unlikely'
+
+Building sorts in chunks that fit in memory and merges the sorted runs from
+temporary files, so the input can be far larger than RAM.
+"""
+import argparse
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # optional: chunks are sorted with sorted() instead
+    np = None
+
+MAGIC = b'PWDIDX1\n'
+HEADER = struct.Struct('>8sQ')  # magic, number of entries
+KEY = struct.Struct('>Q')
+ENTRY = KEY.size
+INTERPOLATION_PROBES = 8
+CHUNK_ENTRIES = 8_000_000       # entries sorted in memory at a time: a 64 MiB array('Q'), and as much again to sort it
+READ_ENTRIES = 65536            # entries read at a time from each run while merging
+
+def password_key(password):
+    return hashlib.sha1(password.encode('utf-8')).digest()[:ENTRY]
+
+class BreachIndex:
+    """Read-only, mmap-backed sorted hash index. `password in index` does the lookup."""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError(f"{path}: not a breach index")
+            magic, self.count = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: not a breach index")
+            if os.fstat(f.fileno()).st_size != HEADER.size + self.count * ENTRY:
+                raise ValueError(f"{path}: truncated breach index")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.count else None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, password):
+        return self.contains_key(int.from_bytes(password_key(password), 'big'))
+
+    def entry(self, i):
+        return KEY.unpack_from(self.mm, HEADER.size + i * ENTRY)[0]
+
+    def contains_key(self, key):
+        """Look up a key (the index's 8-byte prefix as a big-endian int)."""
+        if not self.count:
+            return False
+        unpack, mm, base = KEY.unpack_from, self.mm, HEADER.size
+        lo, hi = 0, self.count - 1
+        lo_key, hi_key = 0, 1 << 64  # bounds on the keys in lo..hi
+        # Interpolation search: hashes are uniform, so the key's value says
+        # where it sits and a few probes find it. Bisect if that ever stalls.
+        for _ in range(INTERPOLATION_PROBES):
+            if lo > hi:
+                return False
+            mid = lo + (key - lo_key) * (hi - lo) // (hi_key - lo_key)
+            (found,) = unpack(mm, base + mid * ENTRY)
+            if found == key:
+                return True
+            if found < key:
+                lo, lo_key = mid + 1, found
+            else:
+                hi, hi_key = mid - 1, found
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            (found,) = unpack(mm, base + mid * ENTRY)
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid - 1
+            else:
+                return True
+        return False
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+
+def iter_keys(path, sha1_input):
+    """Yield the 8-byte key of every entry in a wordlist or SHA-1 hex list, as an int."""
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            if sha1_input:
+                digest = line.split(b':', 1)[0].strip()
+                if len(digest) != 40:
+                    continue
+                try:
+                    yield int(digest[:2 * ENTRY], 16)
+                except ValueError:
+                    continue
+            else:
+                yield int.from_bytes(hashlib.sha1(line).digest()[:ENTRY], 'big')
+
+def write_run(keys, tmpdir):
+    """Sort a chunk of keys (an array('Q')) and write it to a temporary run file."""
+    if np is not None:
+        # sort the chunk in place and keep each key's first copy: one more
+        # array the chunk's size (np.unique takes several)
+        data = np.frombuffer(keys, dtype=np.uint64)
+        data.sort()
+        first = np.empty(len(data), dtype=bool)
+        first[:1] = True
+        np.not_equal(data[1:], data[:-1], out=first[1:])
+        data = data[first]
+        if sys.byteorder == 'little':
+            data.byteswap(inplace=True)
+    else:
+        # without NumPy the sort goes through Python ints, several times the chunk's size
+        data = array('Q', sorted(set(keys)))
+        if sys.byteorder == 'little':
+            data.byteswap()
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(memoryview(data).cast('B'))
+    return path
+
+def read_run(path):
+    """Yield the big-endian keys of a run file as ints, reading in blocks."""
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_ENTRIES * ENTRY)
+            if not block:
+                return
+            keys = array('Q')
+            keys.frombytes(block)
+            if sys.byteorder == 'little':
+                keys.byteswap()
+            yield from keys
+
+def build(source, dest, sha1_input=False, chunk_entries=CHUNK_ENTRIES, tmpdir=None):
+    """Build an index at dest from a wordlist (or SHA-1 hex list). Returns the entry count."""
+    started = time.time()
+    tmpdir = tmpdir or os.path.dirname(os.path.abspath(dest))
+    runs = []
+    try:
+        chunk = array('Q')  # 8 bytes a key, where a list of ints would take about 44
+        for key in iter_keys(source, sha1_input):
+            chunk.append(key)
+            if len(chunk) >= chunk_entries:
+                runs.append(write_run(chunk, tmpdir))
+                del chunk[:]
+                print(f"  sorted run {len(runs)}")
+        if chunk or not runs:
+            runs.append(write_run(chunk, tmpdir))
+
+        count = 0
+        partial = dest + '.partial'
+        with open(partial, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, 0))
+            buf = array('Q')
+            last = None
+            for key in heapq.merge(*(read_run(r) for r in runs)):
+                if key == last:
+                    continue
+                last = key
+                buf.append(key)
+                if len(buf) >= READ_ENTRIES:
+                    count += flush(out, buf)
+            count += flush(out, buf)
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, count))
+        os.replace(partial, dest)  # a running server never sees a half-written index
+    finally:
+        for run in runs:
+            os.remove(run)
+    print(f"Wrote {count} hashes to {dest} in {time.time() - started:.1f}s")
+    return count
+
+def flush(out, buf):
+    n = len(buf)
+    if sys.byteorder == 'little':
+        buf.byteswap()
+    out.write(buf.tobytes())
+    del buf[:]
+    return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a breached-password index.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_build = sub.add_parser('build', help="build an index from a wordlist")
+    p_build.add_argument('source', help="wordlist, one password per line (or SHA-1 hex with --sha1)")
+    p_build.add_argument('dest', help="index file to write")
+    p_build.add_argument('--sha1', action='store_true', help="source lines are SHA-1 hashes in hex")
+    p_build.add_argument('--chunk', type=int, default=CHUNK_ENTRIES,
+                         help=f"entries sorted in memory at a time (default: {CHUNK_ENTRIES})")
+    p_check = sub.add_parser('check', help="look passwords up in an index")
+    p_check.add_argument('index')
+    p_check.add_argument('passwords', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.source, args.dest, args.sha1, args.chunk)
+    else:
+        index = BreachIndex(args.index)
+        for password in args.passwords:
+            print(f"{password}: {'BREACHED' if password in index else 'not found'}")
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,21 @@
 #!/usr/bin/env python3
 # calc_client.py
 
-import socket
 import sys
 
+from lineClient import LineClient
+
 def run_client(server_host='localhost', server_port=5000):
     name = None
     if len(sys.argv) >= 2:
         name = sys.argv[1]
     try:
-        with socket.create_connection((server_host, server_port)) as sock:
+        with LineClient(server_host, server_port, pool_size=1) as client:
+            client.connect()
             print(f"Connected to calculator server at {server_host}:{server_port}")
             print("Enter calculation in form: <operand1> <operator> <operand2>  (e.g. 12 + 5)")
+            print("or a full expression: EXPR (12 + 5) * 2 ^ 3, with variables: LET r = 2.5")
             print("Type 'quit' or 'exit' to close client.")
-            # file-like reader
-            f = sock.makefile('r')
             while True:
                 try:
                     line = input("Enter: ").strip()
@@ -22,10 +23,9 @@ def run_client(server_host='localhost', server_port=5000):
                     break
                 if not line:
                     continue
-                sock.sendall((line + '\n').encode('utf-8'))
-                # read one response line
-                resp = f.readline()
-                if not resp:
+                try:
+                    resp = client.request(line)
+                except ConnectionError:
                     print("Server closed connection.")
                     break
                 print(resp.strip())
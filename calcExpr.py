@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# calc_expr.py
+"""
+Expression engine for the calculator server.
+
+Accepts ordinary arithmetic with parentheses, precedence, unary signs,
+variables and a few math functions, e.g.  (a + 2) * sqrt(b) ^ 2 / 3
+'^' and '**' both mean power. All numbers are floats, like calculate().
+
+Each expression text is parsed and checked once, compiled to a code object
+and kept in an LRU cache, so repeated formulas skip parsing entirely.
+"""
+import ast
+import keyword
+import math
+from functools import lru_cache
+
+MAX_EXPR_LENGTH = 4096
+EXPR_CACHE_SIZE = 4096
+MAX_VARIABLES = 1000  # per connection
+
+# math.floor and math.ceil return ints, which would turn a later ^ into big-int arithmetic
+def floor(x):
+    return float(math.floor(x))
+
+def ceil(x):
+    return float(math.ceil(x))
+
+def round_to(x, digits=0):
+    # round(x, n) keeps a float x a float; digits arrive as floats like every number
+    return round(x, int(digits))
+
+FUNCTIONS = {
+    'abs': abs, 'min': min, 'max': max, 'round': round_to,
+    'sqrt': math.sqrt, 'exp': math.exp, 'log': math.log, 'log10': math.log10,
+    'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'floor': floor, 'ceil': ceil,
+}
+CONSTANTS = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+
+# Globals every compiled expression runs with; variables are passed as locals
+EVAL_GLOBALS = {'__builtins__': {}, **FUNCTIONS, **CONSTANTS}
+
+ALLOWED_BINOPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.Pow)
+ALLOWED_UNARYOPS = (ast.UAdd, ast.USub)
+
+class ExprError(ValueError):
+    pass
+
+def check_node(node):
+    """Reject anything that isn't plain arithmetic; make number literals floats."""
+    if isinstance(node, ast.Expression):
+        check_node(node.body)
+    elif isinstance(node, ast.BinOp):
+        if not isinstance(node.op, ALLOWED_BINOPS):
+            raise ExprError("unsupported operator. Supported: + - * / % ^")
+        check_node(node.left)
+        check_node(node.right)
+    elif isinstance(node, ast.UnaryOp):
+        if not isinstance(node.op, ALLOWED_UNARYOPS):
+            raise ExprError("unsupported operator. Supported: + - * / % ^")
+        check_node(node.operand)
+    elif isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ExprError("operands must be numbers.")
+        node.value = float(node.value)
+    elif isinstance(node, ast.Name):
+        if node.id in FUNCTIONS:
+            raise ExprError(f"'{node.id}' is a function, call it like {node.id}(x)")
+        if node.id in EVAL_GLOBALS and node.id not in CONSTANTS:
+            raise ExprError(f"unknown variable '{node.id}'.")
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ExprError("unknown function. Supported: " + ' '.join(FUNCTIONS))
+        if node.keywords or not node.args:
+            raise ExprError(f"{node.func.id}() takes plain arguments")
+        for arg in node.args:
+            if isinstance(arg, ast.Starred):
+                raise ExprError(f"{node.func.id}() takes plain arguments")
+            check_node(arg)
+    else:
+        raise ExprError("invalid expression.")
+
+@lru_cache(maxsize=EXPR_CACHE_SIZE)
+def compile_expr(text):
+    """Parse, check and compile an expression. Cached by text; raises ExprError."""
+    if len(text) > MAX_EXPR_LENGTH:
+        raise ExprError(f"expression longer than {MAX_EXPR_LENGTH} characters.")
+    try:
+        tree = ast.parse(text.replace('^', '**'), mode='eval')
+        check_node(tree)
+        return compile(tree, '<expr>', 'eval')
+    except ExprError:
+        raise
+    except (SyntaxError, ValueError):
+        raise ExprError("invalid expression.") from None
+    except (RecursionError, MemoryError):
+        # a long flat chain like 1+1+...+1 nests as deeply as parentheses do
+        raise ExprError("expression is nested too deeply.") from None
+
+def format_result(res):
+    # Return as float or integer nicely
+    if res.is_integer():
+        return f"Result: {int(res)}"
+    else:
+        return f"Result: {res}"
+
+def evaluate(text, variables):
+    """Evaluate one expression with the given variables. Returns (value, error)."""
+    try:
+        code = compile_expr(text.strip())
+        value = eval(code, EVAL_GLOBALS, variables)
+        if isinstance(value, complex):
+            return None, "Error: result is not a real number."
+        return float(value), None
+    except ExprError as e:
+        return None, f"Error: {e}"
+    except ZeroDivisionError:
+        return None, "Error: division by zero."
+    except OverflowError:
+        return None, "Error: result is too large."
+    except RecursionError:
+        return None, "Error: expression is nested too deeply."
+    except NameError as e:
+        return None, f"Error: unknown variable '{e.name}'."
+    except Exception as e:
+        return None, f"Error: {e}"
+
+def calculate_expr(text, variables):
+    """Evaluate an expression and format the response like calculate()."""
+    value, error = evaluate(text, variables)
+    return error or format_result(value)
+
+def assign(statement, variables):
+    """Handle "name = expression": store the value in variables and return the response."""
+    name, sep, text = statement.partition('=')
+    name = name.strip()
+    if not sep:
+        return "Error: send in format: LET <name> = <expression>"
+    if not name.isidentifier() or keyword.iskeyword(name) or name in EVAL_GLOBALS:
+        return f"Error: '{name}' can't be used as a variable name."
+    if name not in variables and len(variables) >= MAX_VARIABLES:
+        return f"Error: at most {MAX_VARIABLES} variables per connection."
+    value, error = evaluate(text, variables)
+    if error:
+        return error
+    variables[name] = value
+    return format_result(value)
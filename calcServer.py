@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 # calc_server.py
 
-import socket
-import threading
+import argparse
+
+from calcExpr import assign, calculate_expr, format_result
+from metrics import now, service_metrics
+import serverLog as log
+from serverCore import WorkerPoolServer, add_pool_arguments, serve
 
 HOST = '0.0.0.0'
 PORT = 5000
+RECV_SIZE = 65536
+MAX_BATCH = 100000
+METRICS = service_metrics('calc')
+
+FORMAT_ERROR = "Error: send in format: <operand1> <operator> <operand2>  (e.g. 12 + 5)"
 
 def calculate(op1_str, operator, op2_str):
     try:
@@ -26,6 +35,8 @@ def calculate(op1_str, operator, op2_str):
                 return "Error: division by zero."
             res = a / b
         elif operator == '%':
+            if b == 0:
+                return "Error: division by zero."  # as EXPR says, not float's "float modulo"
             res = a % b
         elif operator == '^' or operator == '**':
             res = a ** b
@@ -33,49 +44,126 @@ def calculate(op1_str, operator, op2_str):
             return f"Error: unsupported operator '{operator}'. Supported: + - * / % ^"
     except Exception as e:
         return f"Error: {e}"
+    if isinstance(res, complex):  # a negative number to a fractional power
+        return "Error: result is not a real number."
+
+    return format_result(res)
+
+def calculate_many(exprs):
+    """Evaluate a list of (op1, operator, op2) tuples. Returns the responses in order."""
+    return [calculate(op1, operator, op2) for op1, operator, op2 in exprs]
+
+class CalcSession:
+    """
+    Per-connection protocol state.
+    Besides one "<op1> <op> <op2>" per line, a client may send "BATCH n"
+    followed by n expression lines; the reply is "BATCH n" and n results.
+    "EXPR <expression>" evaluates a full expression (see calc_expr.py) and
+    "LET <name> = <expression>" stores a variable for this connection.
+    """
+    def __init__(self):
+        self.batch_left = 0
+        self.closed = False
+        self.variables = {}
 
-    # Return as float or integer nicely
-    if res.is_integer():
-        return f"Result: {int(res)}"
-    else:
-        return f"Result: {res}"
+    def evaluate_command(self, line, parts):
+        """Response for an EXPR or LET line, or None if line is neither."""
+        command = parts[0].upper() if parts else ''
+        if command == 'EXPR':
+            return calculate_expr(line[4:], self.variables)
+        if command == 'LET':
+            return assign(line[3:], self.variables)
+        return None
+
+    def feed(self, lines):
+        """Evaluate a run of complete request lines. Returns the response lines, in order."""
+        out = []
+        exprs = []
+        slots = []  # positions in out waiting for an expression result
+        for raw in lines:
+            line = raw.strip()
+            if self.batch_left:
+                # inside a BATCH block every line counts, even a blank one
+                self.batch_left -= 1
+                parts = line.split()
+                response = self.evaluate_command(line, parts)
+                if response is not None:
+                    out.append(response)
+                elif len(parts) == 3:
+                    slots.append(len(out))
+                    out.append(None)
+                    exprs.append(parts)
+                else:
+                    out.append(FORMAT_ERROR)
+                continue
+            if not line:
+                continue
+            # protocol: "operand1 operator operand2"
+            parts = line.split()
+            response = self.evaluate_command(line, parts)
+            if response is not None:
+                out.append(response)
+            elif len(parts) == 2 and parts[0].upper() == 'BATCH':
+                if parts[1].isdigit() and 0 < int(parts[1]) <= MAX_BATCH:
+                    self.batch_left = int(parts[1])
+                    out.append(f"BATCH {self.batch_left}")
+                else:
+                    out.append(f"Error: BATCH size must be between 1 and {MAX_BATCH}.")
+            elif len(parts) != 3:
+                out.append(FORMAT_ERROR)
+            else:
+                slots.append(len(out))
+                out.append(None)
+                exprs.append(parts)
+            # optionally close if client asked to exit
+            if line.lower() in ('exit', 'quit'):
+                self.closed = True
+                break
+        if exprs:
+            for slot, response in zip(slots, calculate_many(exprs)):
+                out[slot] = response
+        return out
 
 def handle_client(conn, addr):
-    print(f"[+] Connected by {addr}")
+    log.info("[+] Connected by %s", addr)
+    METRICS.opened()
     try:
         with conn:
-            # make a file-like wrapper for easy readline()
-            f = conn.makefile('r')
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                # protocol: "operand1 operator operand2"
-                parts = line.split()
-                if len(parts) != 3:
-                    response = "Error: send in format: <operand1> <operator> <operand2>  (e.g. 12 + 5)"
+            session = CalcSession()
+            pending = b''
+            while not session.closed:
+                data = conn.recv(RECV_SIZE)
+                if not data:
+                    # answer a last line the client didn't terminate
+                    lines = [pending] if pending.strip() else []
                 else:
-                    op1, operator, op2 = parts
-                    response = calculate(op1, operator, op2)
-                conn.sendall((response + '\n').encode('utf-8'))
-                # optionally close if client asked to exit
-                if line.lower() in ('exit', 'quit'):
+                    # evaluate every complete line already received, answer with one write
+                    lines = (pending + data).split(b'\n')
+                    pending = lines.pop()
+                started = now()
+                responses = session.feed([l.decode('utf-8', 'replace') for l in lines])
+                out = ('\n'.join(responses) + '\n').encode('utf-8') if responses else b''
+                if out:
+                    conn.sendall(out)
+                # one observation per read: its lines share the time it took to answer them
+                METRICS.observe(started, len(data), len(out), len(responses))
+                if not data:
                     break
     except Exception as e:
-        print(f"[!] Client {addr} error: {e}")
+        log.warning("[!] Client %s error: %s", addr, e)
     finally:
-        print(f"[-] Disconnected {addr}")
+        METRICS.closed()
+        log.info("[-] Disconnected %s", addr)
+
+def start_server(args):
+    server = WorkerPoolServer.from_args("Calculator Server", HOST, args.port, handle_client, args)
+    serve(server, args)
 
-def start_server():
-    print(f"Starting Calculator Server on {HOST}:{PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen()
-        while True:
-            conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-            t.start()
+def main():
+    parser = argparse.ArgumentParser(description="Calculator server.")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"listen port (default: {PORT})")
+    add_pool_arguments(parser)
+    start_server(parser.parse_args())
 
 if __name__ == '__main__':
-    start_server()
+    main()
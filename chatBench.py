@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+chat_bench.py
+Headless load generator and latency benchmark for the chat servers.
+
+Starts a pair of federated servers on localhost (server.py nodes or
+multiserver.py ChatServers), connects thousands of simulated TCP (and, for
+multiserver, UDP) clients spread over both nodes, has some of them send
+timestamped messages and reports:
+  - delivered messages/sec
+  - p50/p99/p999 broadcast latency, for local and cross-peer deliveries
+  - server memory per connection (RSS growth / clients, Linux only)
+
+Usage:
+    python3 chatBench.py [--target multiserver|server] [--engine threads|async]
+                         [--clients 1000] [--udp 0] [--senders 10]
+                         [--messages 200] [--rate 50] [--legacy]
+
+The servers run as child processes with their output discarded and are
+killed when the run ends.
+"""
+import argparse
+import asyncio
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+from framing import MAGIC, FrameDecoder, encode_frame
+from serverCore import raise_fd_limit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAMP_RE = re.compile(rb'BENCH (\d+) (\d+);')
+
+class Stats:
+    def __init__(self):
+        self.local = []   # latencies in ns, sender and receiver on the same node
+        self.cross = []   # latencies in ns, delivered through the peer node
+        self.first_send = None
+        self.last_delivery = None
+
+    def record(self, data, node):
+        now = time.perf_counter_ns()
+        for origin, sent in STAMP_RE.findall(data):
+            latency = now - int(sent)
+            (self.local if int(origin) == node else self.cross).append(latency)
+            self.last_delivery = now
+
+    @property
+    def delivered(self):
+        return len(self.local) + len(self.cross)
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+def rss_kib(pid):
+    """Resident set size of a process in KiB, or None where /proc isn't available."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def server_commands(args):
+    py = sys.executable
+    base = args.base_port
+    if args.target == 'server':
+        return [
+            [py, 'server.py', '1', '--port', str(base), '--inter-port', str(base + 100), '--peers', str(base + 101)],
+            [py, 'server.py', '2', '--port', str(base + 1), '--inter-port', str(base + 101), '--peers', str(base + 100)],
+        ]
+    extra = ['--async'] if args.engine == 'async' else []
+    return [
+        [py, 'multiserver.py', str(base), str(base + 1)] + extra,
+        [py, 'multiserver.py', str(base + 1), str(base)] + extra,
+    ]
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+class TcpClient:
+    def __init__(self, node, port, framed, username, stats):
+        self.node = node
+        self.port = port
+        self.framed = framed
+        self.username = username
+        self.stats = stats
+
+    async def connect(self, target):
+        self.reader, self.writer = await asyncio.open_connection('localhost', self.port)
+        self.decoder = FrameDecoder() if self.framed else None
+        if self.framed:
+            self.writer.write(MAGIC)
+            if await self.reader.readexactly(len(MAGIC)) != MAGIC:
+                raise RuntimeError("server refused framed mode")
+        if target == 'multiserver':
+            self.send(self.username.encode())
+            if self.framed:
+                frames = []
+                while not frames:
+                    data = await self.reader.read(1024)
+                    if not data:
+                        raise RuntimeError("server closed the connection")
+                    frames = self.decoder.feed(data)
+                reply = frames[0]
+            else:
+                reply = await self.reader.read(1024)
+            if not reply.startswith(b'USERNAME_ACCEPTED'):
+                raise RuntimeError(f"registration failed: {reply!r}")
+        self.task = asyncio.create_task(self.receive())
+
+    def send(self, payload):
+        self.writer.write(encode_frame(payload) if self.framed else payload)
+
+    async def receive(self):
+        decoder = self.decoder
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    return
+                if decoder is not None:
+                    for frame in decoder.feed(data):
+                        self.stats.record(frame, self.node)
+                else:
+                    self.stats.record(data, self.node)
+        except (OSError, asyncio.CancelledError):
+            pass
+
+    def close(self):
+        self.task.cancel()
+        self.writer.close()
+
+class UdpClient(asyncio.DatagramProtocol):
+    def __init__(self, node, port, username, stats):
+        self.node = node
+        self.port = port
+        self.username = username
+        self.stats = stats
+        self.registered = None
+
+    async def connect(self, target):
+        loop = asyncio.get_running_loop()
+        self.registered = loop.create_future()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: self, remote_addr=('127.0.0.1', self.port))
+        self.send(self.username.encode())
+        await asyncio.wait_for(self.registered, 5.0)
+
+    def datagram_received(self, data, addr):
+        if not self.registered.done():
+            self.registered.set_result(True)
+            return
+        self.stats.record(data, self.node)
+
+    def send(self, payload):
+        self.transport.sendto(payload)
+
+    def close(self):
+        self.transport.close()
+
+async def run_clients(args, ports, procs):
+    stats = Stats()
+    framed = not args.legacy
+    clients = []
+
+    # Connect in waves to stay under the servers' accept backlog
+    for start in range(0, args.clients, 200):
+        wave = []
+        for i in range(start, min(start + 200, args.clients)):
+            node = i % 2
+            wave.append(TcpClient(node, ports[node], framed, f"tcp{i}", stats))
+        await asyncio.gather(*(c.connect(args.target) for c in wave))
+        clients.extend(wave)
+    for i in range(args.udp):
+        node = i % 2
+        client = UdpClient(node, ports[node], f"udp{i}", stats)
+        await client.connect(args.target)
+        clients.append(client)
+
+    await asyncio.sleep(1.0)  # let join notices settle
+    rss_after = [rss_kib(p.pid) for p in procs]
+
+    # Senders alternate between the two nodes so both paths get traffic
+    senders = clients[:args.senders]
+    interval = 1.0 / args.rate if args.rate > 0 else 0
+
+    async def send_loop(client):
+        for _ in range(args.messages):
+            client.send(f"BENCH {client.node} {time.perf_counter_ns()};".encode())
+            await asyncio.sleep(interval)
+
+    stats.first_send = time.perf_counter_ns()
+    await asyncio.gather(*(send_loop(c) for c in senders))
+
+    # Drain: stop once nothing has arrived for a while
+    idle_since = time.time()
+    seen = stats.delivered
+    while time.time() - idle_since < args.drain:
+        await asyncio.sleep(0.2)
+        if stats.delivered != seen:
+            seen = stats.delivered
+            idle_since = time.time()
+
+    for client in clients:
+        client.close()
+    return stats, rss_after
+
+def report(args, stats, rss_before, rss_after):
+    recipients = args.clients + args.udp - 1  # senders don't get their own messages back on multiserver
+    if args.target == 'server':
+        recipients = args.clients
+    expected = args.senders * args.messages * recipients
+    elapsed = ((stats.last_delivery or stats.first_send) - stats.first_send) / 1e9
+
+    print(f"\n=== {args.target} ({args.engine}, {'legacy' if args.legacy else 'framed'}) ===")
+    print(f"clients        : {args.clients} TCP + {args.udp} UDP over 2 nodes")
+    print(f"sent           : {args.senders} senders x {args.messages} messages at {args.rate}/s each")
+    print(f"delivered      : {stats.delivered} of {expected} ({100.0 * stats.delivered / max(expected, 1):.1f}%)")
+    if elapsed > 0:
+        print(f"throughput     : {stats.delivered / elapsed:,.0f} messages/sec delivered")
+    for name, values in (('local', stats.local), ('cross-peer', stats.cross)):
+        values.sort()
+        print(f"latency {name:<10}: p50 {percentile(values, 50) / 1e6:.2f} ms  "
+              f"p99 {percentile(values, 99) / 1e6:.2f} ms  "
+              f"p999 {percentile(values, 99.9) / 1e6:.2f} ms  (n={len(values)})")
+    for node, (before, after) in enumerate(zip(rss_before, rss_after)):
+        if before is None or after is None:
+            print(f"memory node {node}  : unavailable")
+            continue
+        per_conn = (after - before) * 1024 / max(1, (args.clients + args.udp) // 2)
+        print(f"memory node {node}  : {before / 1024:.1f} MiB idle, {after / 1024:.1f} MiB loaded, "
+              f"~{per_conn / 1024:.1f} KiB per connection")
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat load generator and latency benchmark.")
+    parser.add_argument('--target', choices=('multiserver', 'server'), default='multiserver')
+    parser.add_argument('--engine', choices=('threads', 'async'), default='threads',
+                        help="multiserver engine to benchmark (default: threads)")
+    parser.add_argument('--clients', type=int, default=1000, help="simulated TCP clients (default: 1000)")
+    parser.add_argument('--udp', type=int, default=0, help="simulated UDP clients, multiserver only (default: 0)")
+    parser.add_argument('--senders', type=int, default=10, help="clients that send messages (default: 10)")
+    parser.add_argument('--messages', type=int, default=200, help="messages per sender (default: 200)")
+    parser.add_argument('--rate', type=float, default=50, help="messages/sec per sender, 0 = unpaced (default: 50)")
+    parser.add_argument('--legacy', action='store_true', help="use the raw protocol instead of framed mode")
+    parser.add_argument('--drain', type=float, default=2.0, help="idle seconds before the run ends (default: 2)")
+    parser.add_argument('--base-port', type=int, default=18000)
+    args = parser.parse_args()
+    if args.target == 'server' and args.udp:
+        parser.error("server.py has no UDP clients")
+    args.senders = min(args.senders, args.clients + args.udp)
+
+    raise_fd_limit()
+    ports = [args.base_port, args.base_port + 1]
+    procs = []
+    try:
+        for cmd in server_commands(args):
+            # multiserver keeps its main thread in input(), so give it a stdin that stays open
+            procs.append(subprocess.Popen(cmd, cwd=HERE, stdin=subprocess.PIPE,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for port in ports:
+            wait_for_port(port)
+        time.sleep(1.0)  # give the peer links time to come up
+        rss_before = [rss_kib(p.pid) for p in procs]
+
+        stats, rss_after = asyncio.run(run_clients(args, ports, procs))
+        report(args, stats, rss_before, rss_after)
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# city_catalog.py
+"""
+City catalog for the weather server.
+
+A catalog file is tab separated text, one city per line ('#' starts a
+comment line):
+
+    name <TAB> temp_c <TAB> humidity <TAB> conditions
+    London	12.0	70	Rain|Cloudy|Fog
+
+temp_c and humidity are the city's averages, conditions the '|' separated
+conditions it sees. Names are matched after normalizing: accents dropped,
+case folded and runs of spaces collapsed, so "SÃO  paulo" finds "São Paulo".
+When a normalized name appears twice the first line wins.
+
+The file is only read when the catalog is first used (or preload() is
+called, which the server does from a background thread), so startup stays
+fast however big it is. Cities are kept sorted by normalized name in
+parallel arrays, so a lookup is one binary search; 300,000 cities take
+about 45 MB, and the trigram index below about 17 MB more. Unknown names
+get "did you mean" suggestions: names starting with what was typed, then
+the closest names by shared trigrams. The trigram index is built on the
+first miss and suggestions are kept in an LRU, so a repeated miss costs a
+dict lookup. A new miss reads a bounded sample of the index (a few
+hundred microseconds on 300,000 cities), and all of them together get at
+most SUGGEST_BUDGET of a CPU: past that, misses go without suggestions,
+so a stream of made-up names costs no more than hits do.
+
+Make a synthetic catalog for load testing, and try lookups against one:
+    python3 cityCatalog.py generate cities.tsv --count 300000
+    python3 cityCatalog.py lookup cities.tsv 'london' 'londn' 'san ta'
+"""
+import argparse
+import random
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections import OrderedDict
+
+SUGGESTIONS = 5
+SUGGEST_CACHE_SIZE = 4096
+TRIGRAM_PROBES = 6        # rarest trigrams of a name used to find candidates
+TRIGRAM_POSTINGS = 128    # ids read from each probe's posting list, spread over it
+TRIGRAM_CANDIDATES = 20   # candidates ranked by full trigram similarity
+NEIGHBOURS = 8            # names either side of where the typed name would sort, also ranked
+SUGGEST_BUDGET = 0.05     # seconds of suggestion search allowed per second
+SUGGEST_BURST = 0.25      # seconds of it that can be saved up
+
+def normalize_name(name):
+    """The form names are matched in: no accents, case folded, single spaces."""
+    if not name.isascii():
+        name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    return ' '.join(name.casefold().split())
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class CityCatalog:
+    """
+    Sorted, array-backed city table loaded lazily from path, or from
+    cities, a dict of {name: {'temp_c', 'humidity', 'conditions'}} like
+    weatherServer.BASE_WEATHER. Thread-safe.
+    """
+    def __init__(self, path=None, cities=None):
+        self.path = path
+        self.source = cities or {}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.trigram_index = None
+        self.suggestions = OrderedDict()  # normalized name -> suggestions, least recently used first
+        self.suggest_lock = threading.Lock()
+        self.budget = SUGGEST_BURST        # seconds of search left
+        self.budget_at = time.monotonic()
+
+    def read_rows(self):
+        """Yield (name, temp_c, humidity, conditions) from the source dict or file."""
+        for name, base in self.source.items():
+            yield name.title(), base['temp_c'], base['humidity'], tuple(base['conditions'])
+        if not self.path:
+            return
+        skipped = 0
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip() or line.startswith('#'):
+                    continue
+                fields = line.rstrip('\r\n').split('\t')
+                try:
+                    name, temp_c, humidity, conditions = fields
+                    yield name.strip(), float(temp_c), int(humidity), tuple(conditions.split('|'))
+                except ValueError:
+                    skipped += 1
+        if skipped:
+            print(f"[!] {self.path}: skipped {skipped} malformed lines")
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            started = time.time()
+            rows = {}
+            for row in self.read_rows():
+                rows.setdefault(normalize_name(row[0]), row)
+            self.keys = sorted(rows)
+            self.names = []
+            self.temps = array('f')
+            self.humidity = array('B')
+            self.condition_ids = array('H')
+            self.condition_sets = []  # distinct condition tuples, shared between cities
+            condition_ids = {}
+            for key in self.keys:
+                name, temp_c, humidity, conditions = rows[key]
+                self.names.append(name)
+                self.temps.append(temp_c)
+                self.humidity.append(max(0, min(100, humidity)))
+                cid = condition_ids.get(conditions)
+                if cid is None:
+                    cid = condition_ids[conditions] = len(self.condition_sets)
+                    self.condition_sets.append(conditions)
+                self.condition_ids.append(cid)
+            self.loaded = True
+            if self.path:
+                print(f"[*] Loaded {len(self.keys)} cities from {self.path} in {time.time() - started:.2f}s")
+
+    def build_trigrams(self):
+        self.load()
+        with self.lock:
+            if self.trigram_index is not None:
+                return
+            postings = {}
+            for i, key in enumerate(self.keys):
+                for gram in trigrams(key):
+                    ids = postings.get(gram)
+                    if ids is None:
+                        ids = postings[gram] = array('I')
+                    ids.append(i)
+            self.trigram_index = postings
+
+    def preload(self):
+        """Load the cities and build the suggestion index now rather than on first use."""
+        self.build_trigrams()
+
+    def __len__(self):
+        self.load()
+        return len(self.keys)
+
+    def index(self, key):
+        """Row of a normalized name, or -1."""
+        if not self.loaded:
+            self.load()
+        keys = self.keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, name):
+        return self.index(normalize_name(name)) >= 0
+
+    def lookup(self, name):
+        """(display name, temp_c, humidity, conditions) for a city name, or None."""
+        i = self.index(normalize_name(name))
+        if i < 0:
+            return None
+        return (self.names[i], self.temps[i], self.humidity[i],
+                self.condition_sets[self.condition_ids[i]])
+
+    def suggest(self, key):
+        """
+        Suggestions for a normalized name, from the LRU or found afresh while
+        the search budget lasts; () once it is spent (and then not cached).
+        """
+        with self.suggest_lock:
+            found = self.suggestions.get(key)
+            if found is not None:
+                self.suggestions.move_to_end(key)
+                return found
+            now = time.monotonic()
+            self.budget = min(SUGGEST_BURST, self.budget + (now - self.budget_at) * SUGGEST_BUDGET)
+            self.budget_at = now
+            if self.budget <= 0:
+                return ()
+        self.build_trigrams()  # a one-off, not charged to the budget
+        started = time.perf_counter()
+        found = self.find_suggestions(key)
+        with self.suggest_lock:
+            self.budget -= time.perf_counter() - started
+            self.suggestions[key] = found
+            if len(self.suggestions) > SUGGEST_CACHE_SIZE:
+                self.suggestions.popitem(last=False)
+        return found
+
+    def find_suggestions(self, key, limit=SUGGESTIONS):
+        """Display names of up to limit cities close to a normalized name."""
+        if not key:
+            return ()
+        self.build_trigrams()
+        keys = self.keys
+        found = []
+        # names that start with what was typed come first
+        i = bisect_left(keys, key)
+        while i < len(keys) and len(found) < limit and keys[i].startswith(key):
+            found.append(i)
+            i += 1
+        if len(found) < limit:
+            grams = trigrams(key)
+            index = self.trigram_index
+            probes = sorted((index[g] for g in grams if g in index), key=len)[:TRIGRAM_PROBES]
+            shared = Counter()
+            for ids in probes:
+                # a common trigram is in a good share of all names; an evenly
+                # spread sample of it keeps a miss from costing a scan
+                shared.update(ids[::len(ids) // TRIGRAM_POSTINGS + 1])
+            # the sampling can miss names that only differ late on; those sort
+            # right next to the typed name
+            candidates = {i for i, _ in shared.most_common(TRIGRAM_CANDIDATES)}
+            candidates.update(range(max(0, i - NEIGHBOURS), min(len(keys), i + NEIGHBOURS)))
+            scored = []
+            for i in candidates.difference(found):
+                other = trigrams(keys[i])
+                scored.append((-2 * len(grams & other) / (len(grams) + len(other)), keys[i], i))
+            scored.sort()
+            found += [i for _, _, i in scored[:limit - len(found)]]
+        return tuple(self.names[i] for i in found)
+
+CONDITIONS = ['Sunny', 'Cloudy', 'Rain', 'Fog', 'Windy', 'Showers', 'Humid', 'Hazy', 'Hot', 'Snow', 'Storms']
+SYLLABLES = ['an', 'ber', 'ca', 'dor', 'el', 'fa', 'gra', 'ha', 'is', 'jo', 'ka', 'lin', 'mar', 'no',
+             'or', 'pa', 'quin', 'ro', 'san', 'ta', 'u', 'vel', 'wa', 'xi', 'ya', 'zen', 'burg', 'ton']
+SUFFIXES = ['', '', '', ' City', ' Springs', ' Heights', 'ville', 'ford', 'port']
+
+def generate(dest, count, seed=1, base_cities=None):
+    """Write a catalog of count made-up cities (plus base_cities, if given) to dest."""
+    rng = random.Random(seed)
+    seen = set()
+    with open(dest, 'w', encoding='utf-8') as out:
+        out.write("# name\ttemp_c\thumidity\tconditions\n")
+        for name, base in (base_cities or {}).items():
+            seen.add(normalize_name(name))
+            out.write(f"{name.title()}\t{base['temp_c']}\t{base['humidity']}\t{'|'.join(base['conditions'])}\n")
+        while len(seen) < count:
+            name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+            name = (name + rng.choice(SUFFIXES)).title()
+            if normalize_name(name) in seen:
+                continue
+            seen.add(normalize_name(name))
+            temp_c = round(rng.uniform(-10.0, 32.0), 1)
+            humidity = rng.randint(20, 95)
+            conditions = '|'.join(rng.sample(CONDITIONS, 3))
+            out.write(f"{name}\t{temp_c}\t{humidity}\t{conditions}\n")
+    print(f"Wrote {len(seen)} cities to {dest}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate or query a city catalog for the weather server.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_gen = sub.add_parser('generate', help="write a synthetic catalog")
+    p_gen.add_argument('dest')
+    p_gen.add_argument('--count', type=int, default=300000, help="number of cities (default: 300000)")
+    p_gen.add_argument('--seed', type=int, default=1)
+    p_lookup = sub.add_parser('lookup', help="look cities up in a catalog")
+    p_lookup.add_argument('catalog')
+    p_lookup.add_argument('names', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        from weatherServer import BASE_WEATHER
+        generate(args.dest, args.count, args.seed, BASE_WEATHER)
+    else:
+        catalog = CityCatalog(args.catalog)
+        for name in args.names:
+            city = catalog.lookup(name)
+            if city:
+                print(f"{name}: {city[0]} {city[1]:.1f} °C, {city[2]} %, {'/'.join(city[3])}")
+            else:
+                print(f"{name}: not found, did you mean {', '.join(catalog.suggest(normalize_name(name)))}?")
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,12 @@ import socket
 import threading
 import sys
 import time
+from framing import connect_framed, send_message, iter_messages
 
 # Client configuration
-client_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+framed = '--framed' in sys.argv[1:]  # length-prefixed frames instead of raw sends
+args = [arg for arg in sys.argv[1:] if arg != '--framed']
+client_id = int(args[0]) if args else 1
 username = f"User{client_id}"
 
 def select_server():
@@ -35,30 +38,32 @@ SERVER_PORT, server_name = select_server()
 
 def receive_messages(sock):
     """Receive and display messages from server"""
-    while True:
-        try:
-            message = sock.recv(1024).decode()
-            if not message:
-                break
-            print(f"\n{message}")
+    try:
+        for data in iter_messages(sock, framed):
+            print(f"\n{data.decode()}")
             print(f"{username}> ", end="", flush=True)
-        except:
-            print("\nDisconnected from server")
-            break
+    except:
+        print("\nDisconnected from server")
 
 def main():
+    global framed
     print(f"Client {client_id} ({username}) starting...")
     print(f"Connecting to {server_name} on port {SERVER_PORT}")
     
     # Connect to server
     try:
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect(('localhost', SERVER_PORT))
+        if framed:
+            client_socket, framed = connect_framed(('localhost', SERVER_PORT))
+            if not framed:
+                print("Server does not support framed mode, using raw messages")
+        else:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.connect(('localhost', SERVER_PORT))
         print(f"Connected to {server_name}!")
         
         # Send join message
         join_msg = f"{username} joined the chat"
-        client_socket.send(join_msg.encode())
+        send_message(client_socket, framed, join_msg.encode())
         
         # Start message receiver thread
         receiver_thread = threading.Thread(target=receive_messages, args=(client_socket,))
@@ -71,11 +76,11 @@ def main():
             message = input(f"{username}> ")
             
             if message.lower() == 'quit':
-                client_socket.send(f"{username} left the chat".encode())
+                send_message(client_socket, framed, f"{username} left the chat".encode())
                 break
                 
             if message.strip():
-                client_socket.send(f"{username}: {message}".encode())
+                send_message(client_socket, framed, f"{username}: {message}".encode())
         
         client_socket.close()
         print("Goodbye!")
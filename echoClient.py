@@ -6,9 +6,10 @@ Usage:
     python3 echo_client.py [host] [port]
 Defaults: host=localhost port=5000
 """
-import socket
 import sys
 
+from lineClient import LineClient
+
 HOST = 'localhost'
 PORT = 5000
 if len(sys.argv) >= 2:
@@ -18,9 +19,9 @@ if len(sys.argv) >= 3:
 
 def run_client(host, port):
     try:
-        with socket.create_connection((host, port)) as sock:
+        with LineClient(host, port, pool_size=1) as client:
+            client.connect()
             print(f"Connected to echo server at {host}:{port}")
-            reader = sock.makefile('r', encoding='utf-8', newline='\n')
             while True:
                 try:
                     text = input("You: ")
@@ -29,18 +30,13 @@ def run_client(host, port):
                     break
                 if not text:
                     continue
-                # send
+                # send, wait for echo
                 try:
-                    sock.sendall((text + '\n').encode('utf-8'))
-                except BrokenPipeError:
+                    resp = client.request(text)
+                except ConnectionError:
                     print("Connection to server lost.")
                     break
-                # wait for echo
-                resp = reader.readline()
-                if not resp:
-                    print("Server closed connection.")
-                    break
-                print("Echo:", resp.rstrip('\n'))
+                print("Echo:", resp)
                 if text.lower() in ('exit', 'quit', 'bye'):
                     break
     except ConnectionRefusedError:
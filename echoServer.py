@@ -3,61 +3,135 @@
 """
 Multi-client Echo Server.
 Usage:
-    python3 echo_server.py [port]
+    python3 echo_server.py [port] [--raw] [--quiet] [--engine threads|selector]
+                           [--workers N] [--queue-limit N] [--processes N]
 Default port: 5000
+
+--raw echoes bytes exactly as received, whole chunks at a time, with no
+decoding, line handling or close commands; meant for throughput and RTT
+probes. --quiet stops logging every message (otherwise sampled, see
+--log-rate in server_log.py). --engine selector serves all
+connections from one thread (see server_core.py).
 """
+import argparse
 import socket
-import threading
-import sys
+from functools import partial
+
+import serverLog as log
+from metrics import now, service_metrics
+from serverCore import (LineSession, SelectorServer, WorkerPoolServer, add_engine_arguments,
+                        add_pool_arguments, serve, serve_session)
 
 HOST = '0.0.0.0'
 PORT = 5000
-if len(sys.argv) >= 2:
-    PORT = int(sys.argv[1])
+RAW_BUFFER = 65536
+METRICS = service_metrics('echo')
 
-def handle_client(conn, addr):
-    """Handle a single client: read lines and echo them back."""
-    print(f"[+] Client connected: {addr}")
+class EchoSession(LineSession):
+    """Echo protocol for one connection; shared by both engines."""
+    metrics = METRICS
+
+    def __init__(self, addr, verbose=True):
+        super().__init__(addr)
+        self.verbose = verbose
+
+    def opened(self):
+        super().opened()
+        log.info("[+] Client connected: %s", self.addr)
+
+    def closed(self):
+        super().closed()
+        log.info("[-] Client disconnected: %s", self.addr)
+
+    def handle_line(self, message):
+        if message == '':
+            # ignore empty lines
+            return None, False
+        if self.verbose:
+            log.sampled('echo', "[%s] Received: %s", self.addr, message)
+        # echo back (add newline); optional close command
+        return message + '\n', message.lower() in ('exit', 'quit', 'bye')
+
+class RawEchoSession(LineSession):
+    """Raw mode on the selector engine: received bytes go straight back."""
+    metrics = METRICS
+
+    def __init__(self, addr, verbose=True):
+        super().__init__(addr)
+        self.verbose = verbose
+        self.total = 0
+
+    def opened(self):
+        super().opened()
+        log.info("[+] Client connected (raw): %s", self.addr)
+
+    def closed(self):
+        super().closed()
+        log.info("[-] Client disconnected: %s (%d bytes echoed)", self.addr, self.total)
+
+    def feed(self, data):
+        # a chunk counts as one request, timed like a line: from receipt to
+        # the reply being handed back (the engine sends it as soon as this returns)
+        started = now()
+        self.total += len(data)
+        if self.verbose:
+            log.sampled('echo', "[%s] Echoed %d bytes", self.addr, len(data))
+        METRICS.observe(started, len(data), len(data))
+        return data, False
+
+    def feed_eof(self):
+        return b'', True
+
+def handle_raw_client(conn, addr, verbose=True):
+    """Raw mode: write every received chunk straight back, without decoding or copying."""
+    log.info("[+] Client connected (raw): %s", addr)
+    METRICS.opened()
+    buf = bytearray(RAW_BUFFER)
+    view = memoryview(buf)
+    total = 0
     try:
-        # file-like object for convenient readline()
         with conn:
-            f = conn.makefile('r', encoding='utf-8', newline='\n')
-            for line in f:
-                message = line.rstrip('\n')
-                if message == '':
-                    # ignore empty lines
-                    continue
-                print(f"[{addr}] Received: {message}")
-                # echo back (add newline)
-                try:
-                    conn.sendall((message + '\n').encode('utf-8'))
-                except BrokenPipeError:
-                    break
-                # optional close command
-                if message.lower() in ('exit', 'quit', 'bye'):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            while True:
+                n = conn.recv_into(buf)
+                if n == 0:
                     break
-    except Exception as e:
-        print(f"[!] Error with {addr}: {e}")
+                started = now()
+                conn.sendall(view[:n])
+                METRICS.observe(started, n, n)
+                total += n
+                if verbose:
+                    log.sampled('echo', "[%s] Echoed %d bytes", addr, n)
+    except OSError as e:
+        log.warning("[!] Error with %s: %s", addr, e)
     finally:
-        try:
-            conn.close()
-        except:
-            pass
-        print(f"[-] Client disconnected: {addr}")
-
-def start_server(host, port):
-    print(f"Starting Echo Server on {host}:{port}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))
-        s.listen(8)
-        try:
-            while True:
-                conn, addr = s.accept()
-                t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-                t.start()
-        except KeyboardInterrupt:
-            print("\nServer shutting down...")
+        view.release()
+        METRICS.closed()
+        log.info("[-] Client disconnected: %s (%d bytes echoed)", addr, total)
+
+def handle_client(conn, addr, verbose=True):
+    """Handle a single client: read lines and echo them back."""
+    serve_session(conn, EchoSession(addr, verbose))
+
+def start_server(host, port, args):
+    verbose = not args.quiet
+    if args.engine == 'selector':
+        session = partial(RawEchoSession if args.raw else EchoSession, verbose=verbose)
+        server = SelectorServer.from_args("Echo Server", host, port, session, args)
+    else:
+        handler = partial(handle_raw_client if args.raw else handle_client, verbose=verbose)
+        server = WorkerPoolServer.from_args("Echo Server", host, port, handler, args)
+    serve(server, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-client echo server.")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"listen port (default: {PORT})")
+    parser.add_argument('--raw', action='store_true', help="echo raw bytes, whole chunks at a time")
+    parser.add_argument('--quiet', action='store_true', help="don't log every message")
+    add_engine_arguments(parser)
+    add_pool_arguments(parser)
+    args = parser.parse_args()
+    start_server(HOST, args.port, args)
 
 if __name__ == '__main__':
-    start_server(HOST, PORT)
+    main()
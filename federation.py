@@ -0,0 +1,218 @@
+"""
+federation.py
+Full-mesh federation between chat nodes.
+
+Each node keeps one persistent outbound link per configured peer.
+publish() stamps a message with a unique ID and queues it on every link at
+once. Each link sends from its own thread, so a broadcast reaches every
+node in one hop and fans out in parallel. A dropped link reconnects with
+exponential backoff and keeps queueing in the meantime.
+
+Receivers remember recently seen IDs and drop duplicates, so relayed
+messages (relay=True, for partial meshes) can never loop.
+
+A link starts with FED_MAGIC and then carries length-prefixed frames
+(see framing.py). Each frame is a JSON object:
+    {"id": "<node>/<boot>/<seq>", "origin": "<node>", "body": "<text>"}
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import count
+
+import serverLog as log
+from framing import FrameDecoder, FrameError, encode_frames
+
+FED_MAGIC = b'\x00CHAT-FEDERATION/1\n'
+RECONNECT_MIN = 0.5   # seconds
+RECONNECT_MAX = 30.0
+LINK_QUEUE_LIMIT = 10000  # messages kept per link while its peer is unreachable
+SEEN_LIMIT = 65536        # message IDs remembered for de-duplication
+
+def parse_peers(text, default_host='localhost'):
+    """Parse "9001,host:9002,..." into a list of (host, port) tuples."""
+    peers = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, sep, port = item.rpartition(':')
+        peers.append((host if sep else default_host, int(port)))
+    return peers
+
+class SeenIds:
+    """Bounded, thread-safe set of recently seen message IDs (oldest forgotten first)."""
+    def __init__(self, limit=SEEN_LIMIT):
+        self.limit = limit
+        self.ids = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, msg_id):
+        """Record msg_id. Returns False if it was already seen."""
+        with self.lock:
+            if msg_id in self.ids:
+                return False
+            self.ids[msg_id] = None
+            if len(self.ids) > self.limit:
+                self.ids.popitem(last=False)
+            return True
+
+class PeerLink:
+    """Outbound connection to one peer, with its own queue and sender thread."""
+    def __init__(self, host, port, label):
+        self.host = host
+        self.port = port
+        self.label = label
+        self.queue = deque(maxlen=LINK_QUEUE_LIMIT)
+        self.cond = threading.Condition()
+        self.connected = False
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, frame_payload):
+        with self.cond:
+            self.queue.append(frame_payload)
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def run(self):
+        delay = RECONNECT_MIN
+        while not self.closed:
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=5)
+            except OSError:
+                # Exponential backoff with jitter so restarted nodes don't stampede
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, RECONNECT_MAX)
+                continue
+            delay = RECONNECT_MIN
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connected = True
+            log.info("[%s] Connected to peer %s:%s", self.label, self.host, self.port)
+            pending = []
+            try:
+                sock.sendall(FED_MAGIC)
+                while True:
+                    with self.cond:
+                        while not self.queue and not self.closed:
+                            self.cond.wait()
+                        if self.closed:
+                            break
+                        pending = list(self.queue)
+                        self.queue.clear()
+                    sock.sendall(encode_frames(pending))
+                    pending = []
+            except OSError:
+                log.warning("[%s] Lost connection to peer %s:%s, reconnecting", self.label, self.host, self.port)
+                # Put back what didn't make it, ahead of anything newer
+                with self.cond:
+                    self.queue.extendleft(reversed(pending))
+            finally:
+                self.connected = False
+                sock.close()
+
+class Federation:
+    """
+    Mesh of chat nodes. on_message(body, origin) is called once for every
+    message published by another node, from whichever thread received it.
+    """
+    def __init__(self, node_id, peers, on_message, relay=False, label=None):
+        self.node_id = node_id
+        self.boot = os.urandom(4).hex()  # keeps IDs unique across restarts
+        self.seq = count()
+        self.on_message = on_message
+        self.relay = relay
+        self.label = label or node_id
+        self.seen = SeenIds()
+        self.links = {(host, port): PeerLink(host, port, self.label) for host, port in peers}
+
+    def start(self):
+        for link in self.links.values():
+            link.start()
+
+    def stop(self):
+        for link in self.links.values():
+            link.close()
+
+    def publish(self, body):
+        """Send body to every peer. Returns the message ID."""
+        msg_id = f"{self.node_id}/{self.boot}/{next(self.seq)}"
+        self.seen.add(msg_id)
+        payload = json.dumps({'id': msg_id, 'origin': self.node_id, 'body': body},
+                             separators=(',', ':')).encode()
+        for link in self.links.values():
+            link.send(payload)
+        return msg_id
+
+    def receive(self, payload):
+        """Handle one frame from a peer: de-duplicate, deliver, optionally relay."""
+        try:
+            msg = json.loads(payload)
+            msg_id, origin, body = msg['id'], msg['origin'], msg['body']
+        except (ValueError, KeyError, TypeError):
+            log.sampled('federation', "[%s] Dropping malformed federation message", self.label, lvl=log.WARNING)
+            return
+        # Our own messages come back only as already-seen IDs; origin alone
+        # can't tell, since nodes on different hosts may share a node_id
+        if not self.seen.add(msg_id):
+            return
+        if self.relay:
+            for link in self.links.values():
+                link.send(payload)
+        self.on_message(body, origin)
+
+    @staticmethod
+    def is_hello(data):
+        """True if data is (the start of) a federation link hello."""
+        return bool(data) and (data.startswith(FED_MAGIC) or FED_MAGIC.startswith(data))
+
+    def accept(self, sock, data=b''):
+        """Serve an inbound peer link until it closes. data is what was already read."""
+        try:
+            while len(data) < len(FED_MAGIC):
+                more = sock.recv(1024)
+                if not more:
+                    return
+                data += more
+            if not data.startswith(FED_MAGIC):
+                return
+            decoder = FrameDecoder()
+            for payload in decoder.feed(data[len(FED_MAGIC):]):
+                self.receive(payload)
+            while True:
+                frames = decoder.recv_frames(sock)
+                if frames is None:
+                    break
+                for payload in frames:
+                    self.receive(payload)
+        except (OSError, FrameError) as e:
+            log.warning("[%s] Peer link error: %s", self.label, e)
+        finally:
+            sock.close()
+
+    def serve(self, host, port):
+        """Listen for inbound peer links on a dedicated port (runs in a daemon thread)."""
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, port))
+        listener.listen(16)
+
+        def accept_loop():
+            while True:
+                conn, addr = listener.accept()
+                log.info("[%s] Peer server connected from %s", self.label, addr)
+                threading.Thread(target=self.accept, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=accept_loop, daemon=True).start()
+        return listener
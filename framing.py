@@ -0,0 +1,165 @@
+"""
+framing.py
+Length-prefixed message framing for the chat servers and clients.
+
+Every frame is a 4-byte big-endian payload length followed by the payload,
+so messages survive TCP coalescing and splitting intact.
+
+Framed mode is negotiated per connection: the connecting side sends MAGIC
+as its very first bytes and the server answers with MAGIC. A connection
+that starts with anything else keeps the legacy raw protocol, where each
+recv() is treated as one message.
+"""
+import socket
+import struct
+
+MAGIC = b'\x00CHAT-FRAMED/1\n'  # can't be typed as a legacy username or message
+HEADER = struct.Struct('!I')
+MAX_FRAME = 1 << 20
+RECV_SIZE = 65536
+
+class FrameError(ValueError):
+    pass
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+def encode_frames(payloads):
+    """Encode many payloads into one buffer, ready for a single sendall()."""
+    parts = []
+    for payload in payloads:
+        parts.append(HEADER.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+class FrameDecoder:
+    """
+    Incremental frame decoder.
+    Received bytes accumulate in one reusable bytearray; every call hands
+    back all frames completed so far, so a single recv() can yield many.
+    """
+    def __init__(self, max_frame=MAX_FRAME, recv_size=RECV_SIZE):
+        self.max_frame = max_frame
+        self.buffer = bytearray()
+        self.chunk = bytearray(recv_size)
+        self.view = memoryview(self.chunk)
+
+    def feed(self, data):
+        """Append data and return a list of complete payloads (possibly empty)."""
+        buf = self.buffer
+        buf += data
+        frames = []
+        pos = 0
+        end = len(buf)
+        size = HEADER.size
+        while end - pos >= size:
+            (length,) = HEADER.unpack_from(buf, pos)
+            if length > self.max_frame:
+                raise FrameError(f"frame of {length} bytes exceeds limit of {self.max_frame}")
+            start = pos + size
+            if end - start < length:
+                break
+            frames.append(bytes(buf[start:start + length]))
+            pos = start + length
+        if pos:
+            del buf[:pos]
+        return frames
+
+    def recv_frames(self, sock):
+        """Read once from sock into the preallocated chunk. Returns None on EOF."""
+        n = sock.recv_into(self.chunk)
+        if n == 0:
+            return None
+        return self.feed(self.view[:n])
+
+def read_hello(sock, bufsize=1024):
+    """
+    Server side of the negotiation: read the first bytes of a new connection.
+    Returns (framed, data) where data is whatever followed the hello.
+    """
+    data = sock.recv(bufsize)
+    while data and len(data) < len(MAGIC) and MAGIC.startswith(data):
+        more = sock.recv(bufsize)
+        if not more:
+            break
+        data += more
+    if data.startswith(MAGIC):
+        sock.sendall(MAGIC)
+        return True, data[len(MAGIC):]
+    return False, data
+
+async def read_hello_async(reader, writer, bufsize=1024):
+    """asyncio version of read_hello()."""
+    data = await reader.read(bufsize)
+    while data and len(data) < len(MAGIC) and MAGIC.startswith(data):
+        more = await reader.read(bufsize)
+        if not more:
+            break
+        data += more
+    if data.startswith(MAGIC):
+        writer.write(MAGIC)
+        return True, data[len(MAGIC):]
+    return False, data
+
+def request_framing(sock, timeout=5.0):
+    """
+    Client side of the negotiation. Returns True if the server switched to frames.
+    A legacy server takes the hello as the first message (e.g. a username),
+    so on False the connection must not be reused; see connect_framed().
+    """
+    sock.sendall(MAGIC)
+    previous = sock.gettimeout()
+    sock.settimeout(timeout)
+    reply = b''
+    try:
+        while len(reply) < len(MAGIC):
+            data = sock.recv(len(MAGIC) - len(reply))
+            if not data:
+                break
+            reply += data
+    except socket.timeout:
+        return False
+    finally:
+        sock.settimeout(previous)
+    return reply == MAGIC
+
+def connect_framed(address, timeout=5.0):
+    """
+    Connect and ask for framed mode. Returns (sock, framed).
+    If the server doesn't answer the hello it has already consumed it as a
+    legacy message, so that connection is closed and a fresh one is opened
+    without the hello, falling back to the raw protocol.
+    """
+    sock = socket.create_connection(address)
+    try:
+        if request_framing(sock, timeout):
+            return sock, True
+    except OSError:
+        pass
+    sock.close()
+    return socket.create_connection(address), False
+
+def send_message(sock, framed, payload):
+    sock.sendall(encode_frame(payload) if framed else payload)
+
+def iter_messages(sock, framed, data=None):
+    """
+    Yield every message received on sock as bytes, starting with data that
+    was already read (e.g. what followed the hello). Legacy connections
+    yield one message per recv(); framed ones yield one per frame.
+    """
+    if not framed:
+        if data is None:
+            data = sock.recv(1024)
+        while data:
+            yield data
+            data = sock.recv(1024)
+        return
+    decoder = FrameDecoder()
+    if data:
+        yield from decoder.feed(data)
+    while True:
+        frames = decoder.recv_frames(sock)
+        if frames is None:
+            return
+        yield from frames
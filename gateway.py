@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# gateway.py
+"""
+One port for every line-protocol service: calc, pwd, weather and echo.
+
+Usage:
+    python3 gateway.py [port] [--policy FILE] [--breach-index FILE]
+                       [--cities FILE] [--seed N] [--cache-ttl SECONDS]
+                       [--engine threads|selector] [--workers N] [--processes N]
+
+Default port: 7000
+
+Each line goes to a service, chosen either per line with a prefix, or for
+the rest of the connection with USE:
+    calc: 12 + 5            -> Result: 17
+    weather: london         -> {"city": "London", ...}
+    USE pwd                 -> OK pwd
+    Abcdefg1_               -> Valid password.
+    USE none                -> OK none
+The reply is exactly what the service's own server sends. A prefix is only
+recognised for a registered service name, so "pwd: calc: x" sends the
+password "calc: x", and only while no service is chosen with USE: after
+USE pwd, "echo:Secret_Pw1" is a password too. Only USE lines are
+the gateway's own then; "USE none" goes back to prefixes. Every service keeps its per-connection state (calc
+variables and BATCH blocks, the pwd TENANT, ...) for as long as the
+connection lasts. "quit" closes the connection whichever service gets it.
+Weather SUBSCRIBE needs a direct connection to weather_server.py.
+
+Services are registered by name with register_service(name, factory),
+where factory(addr) returns a serverCore.LineSession, whose handle(line)
+-> (response or None, close?) is called for each line. Requests are
+counted both under "gateway" and under the service's own name in
+--metrics-port metrics.
+"""
+import argparse
+import os
+import threading
+from functools import partial
+
+from calcServer import CalcSession
+from cityCatalog import CityCatalog
+from echoServer import EchoSession
+from metrics import service_metrics
+from pwdServer import PasswordSession
+from pwdPolicy import PolicyStore
+import serverLog as log
+from serverCore import (LineSession, SelectorServer, WorkerPoolServer, add_engine_arguments,
+                        add_pool_arguments, serve, serve_session)
+from weatherServer import CACHE_TTL, DEFAULT_CATALOG, ResponseCache, WeatherSession
+from weatherSim import WeatherSim
+
+HOST = '0.0.0.0'
+PORT = 7000
+
+SERVICES = {}  # name -> factory(addr) returning a session for one connection
+
+def register_service(name, factory):
+    SERVICES[name] = factory
+
+class CalcLineSession(LineSession):
+    """CalcSession takes runs of lines; this feeds it one at a time."""
+    metrics = service_metrics('calc')
+
+    def __init__(self, addr):
+        super().__init__(addr)
+        self.calc = CalcSession()
+
+    def handle_line(self, line):
+        responses = self.calc.feed([line])
+        return ''.join(r + '\n' for r in responses) or None, self.calc.closed
+
+def register_default_services(args):
+    """Register calc, pwd, weather and echo, configured from the command line."""
+    policies = None
+    if args.policy or args.breach_index:
+        defaults = {'breach_index': os.path.abspath(args.breach_index)} if args.breach_index else None
+        policies = PolicyStore(args.policy, defaults)
+    catalog = CityCatalog(args.cities) if args.cities else DEFAULT_CATALOG
+    sim = WeatherSim(catalog, args.seed)
+    if args.processes > 1:
+        sim.preload()  # before forking, so the workers share one copy
+    else:
+        threading.Thread(target=sim.preload, daemon=True).start()
+    cache = ResponseCache(args.cache_ttl)
+
+    register_service('calc', CalcLineSession)
+    register_service('pwd', partial(PasswordSession, policies=policies))
+    register_service('weather', partial(WeatherSession, cache=cache, sim=sim))
+    register_service('echo', partial(EchoSession, verbose=False))
+    return sim
+
+class GatewaySession(LineSession):
+    """Routes each line of one connection to a service session, started on first use."""
+    metrics = service_metrics('gateway')
+
+    def __init__(self, addr, services=None):
+        super().__init__(addr)
+        self.services = SERVICES if services is None else services
+        self.sessions = {}
+        self.current = None  # service chosen with USE
+
+    def opened(self):
+        super().opened()
+        log.info("[+] Client connected: %s", self.addr)
+
+    def closed(self):
+        super().closed()
+        log.info("[-] Client disconnected: %s", self.addr)
+
+    def session(self, name):
+        session = self.sessions.get(name)
+        if session is None:
+            session = self.sessions[name] = self.services[name](self.addr)
+        return session
+
+    def forward(self, name, line):
+        """Hand a line to a service; a service that fails answers with an error instead."""
+        try:
+            return self.session(name).handle(line)
+        except Exception as e:
+            # keep the connection, and every other service on it, going
+            log.error("[!] %s failed on a request from %s: %s", name, self.addr, e)
+            return f"Error: {name} failed to handle the request.\n", False
+
+    def handle_line(self, line):
+        if line[:4].upper() == 'USE ':
+            name = line[4:].strip()
+            if name == 'none':
+                self.current = None
+                return "OK none\n", False
+            if name not in self.services:
+                return f"Error: unknown service '{name}'. Services: {', '.join(self.services)}\n", False
+            self.current = name
+            return f"OK {name}\n", False
+        if self.current is not None:
+            # a chosen service gets the line as it is, colons and all
+            return self.forward(self.current, line)
+        name, sep, rest = line.partition(':')
+        if sep and name.strip() in self.services:
+            # "service: request"; the one space after the colon is part of the prefix
+            return self.forward(name.strip(), rest[1:] if rest[:1] == ' ' else rest)
+        if not line.strip():
+            return None, False
+        if line.strip().lower() in ('quit', 'exit'):
+            return "Goodbye.\n", True
+        return "Error: send 'USE <service>' or prefix the line with '<service>: '.\n", False
+
+def handle_client(conn, addr):
+    """Threads engine: the same GatewaySession, over a blocking connection."""
+    serve_session(conn, GatewaySession(addr))
+
+def start_server(args):
+    sim = register_default_services(args)
+    print(f"[*] Services: {', '.join(SERVICES)}; weather simulated with --seed {sim.seed}")
+    if args.engine == 'selector':
+        server = SelectorServer.from_args("Gateway", HOST, args.port, GatewaySession, args)
+    else:
+        server = WorkerPoolServer.from_args("Gateway", HOST, args.port, handle_client, args)
+    serve(server, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway serving calc, pwd, weather and echo on one port.")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"listen port (default: {PORT})")
+    parser.add_argument('--policy', help="pwd: JSON policy file (see pwd_policy.py)")
+    parser.add_argument('--breach-index', help="pwd: reject passwords found in this breach index")
+    parser.add_argument('--cities', metavar='FILE', help="weather: city catalog file (see city_catalog.py)")
+    parser.add_argument('--seed', type=int, default=0, help="weather: simulation seed (default: 0)")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL,
+                        help=f"weather: seconds a city's response is reused, 0 = no cache (default: {CACHE_TTL})")
+    add_engine_arguments(parser)
+    add_pool_arguments(parser)
+    start_server(parser.parse_args())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# line_client.py
+"""
+Client library for the line-protocol servers (calc, pwd, weather, echo,
+and the gateway in front of them).
+
+AsyncClient is the asyncio API, LineClient the same calls for ordinary
+threaded code (it runs an event loop in a background thread):
+
+    async with AsyncClient('localhost', 5000) as calc:
+        print(await calc.request('12 + 5'))              # Result: 17
+        print(await calc.calc_many(['1 + 1', '2 * 3']))  # ['Result: 2', 'Result: 6']
+
+    with LineClient('localhost', 5500) as weather:
+        for report in weather.weather_many(['london', 'tokyo']):
+            print(report['city'], report['temperature_c'])
+
+Each client keeps a pool of up to pool_size keep-alive connections to one
+host:port. Requests are pipelined: a request is written without waiting
+for earlier replies, many can be in flight on one connection, and replies
+are matched to requests in order. A request goes to the least busy
+connection, and a new connection is only opened when all are busy. The
+batch helpers (calc_many, validate_many, weather_many) send BATCH, BULK
+and MULTI requests in chunks, spread over the pool.
+
+With service='calc' (or pwd, weather, echo) every line gets the gateway's
+"calc: " prefix, so one gateway port serves all of them.
+
+Server-side per-connection state (calc LET variables, pwd TENANT, gateway
+USE) only makes sense on one connection: use pool_size=1 for that.
+"""
+import asyncio
+import concurrent.futures
+import json
+import socket
+import threading
+from collections import deque
+
+DEFAULT_POOL_SIZE = 4
+MAX_LINE = 1 << 24         # longest reply line accepted (a big MULTI or BULK reply)
+CALC_CHUNK = 10000         # expressions per BATCH request
+PWD_CHUNK = 10000          # passwords per BULK request
+WEATHER_CHUNK = 1000       # cities per MULTI request (the server's limit)
+
+class ServiceError(Exception):
+    """The server answered a batch request with an error."""
+
+class LineConnection:
+    """
+    One pipelined connection. call() writes its lines at once and queues
+    a future for the reply lines; a reader task hands each reply line to
+    the oldest waiting request.
+    """
+    def __init__(self, reader, writer, prefix=''):
+        self.reader = reader
+        self.writer = writer
+        self.prefix = prefix
+        self.waiting = deque()  # [future, reply lines expected, reply lines so far]
+        self.closed = False
+        self.read_task = asyncio.get_running_loop().create_task(self.read_replies())
+
+    @classmethod
+    async def open(cls, host, port, prefix=''):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer, prefix)
+
+    @property
+    def in_flight(self):
+        return len(self.waiting)
+
+    async def read_replies(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line.endswith(b'\n'):
+                    break  # closed, possibly mid-line
+                if not self.waiting:
+                    continue  # nothing asked for this one
+                entry = self.waiting[0]
+                entry[2].append(line[:-1].decode('utf-8', 'replace'))
+                if len(entry[2]) == entry[1]:
+                    self.waiting.popleft()
+                    if not entry[0].done():  # its caller may have given up
+                        entry[0].set_result(entry[2])
+        except (OSError, ValueError):  # ValueError: a line longer than MAX_LINE
+            pass
+        finally:
+            self.abort()
+
+    def abort(self):
+        """Close the connection and fail every request still waiting for replies."""
+        self.closed = True
+        while self.waiting:
+            future = self.waiting.popleft()[0]
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed by the server"))
+        self.writer.close()
+
+    async def call(self, lines, expect=1):
+        """Send request lines and return the next `expect` reply lines."""
+        if self.closed:
+            raise ConnectionError("connection is closed")
+        text = ''.join(f"{self.prefix}{line}\n" for line in lines)
+        if text.count('\n') != len(lines):
+            raise ValueError("request lines can't contain newlines")
+        future = asyncio.get_running_loop().create_future()
+        if expect:
+            self.waiting.append([future, expect, []])
+        else:
+            future.set_result([])
+        try:
+            self.writer.write(text.encode('utf-8'))
+            await self.writer.drain()
+            return await future
+        except asyncio.CancelledError:
+            # The caller gave up (e.g. a timeout), but its replies may still
+            # come and would be handed to the next request: drop the
+            # connection; the pool opens a fresh one for later calls.
+            self.abort()
+            raise
+
+    async def close(self):
+        self.abort()
+        self.read_task.cancel()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+class AsyncClient:
+    """Pooled, pipelined asyncio client for one host:port."""
+    def __init__(self, host, port, pool_size=DEFAULT_POOL_SIZE, service=None):
+        self.host = host
+        self.port = port
+        self.pool_size = max(1, pool_size)
+        self.prefix = f"{service}: " if service else ''
+        self.connections = []
+        self.connecting = None  # asyncio.Lock, made on first use inside the loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connection(self):
+        """The least busy open connection, or a new one if all are busy and the pool has room."""
+        if self.connecting is None:
+            self.connecting = asyncio.Lock()
+        async with self.connecting:
+            self.connections = [c for c in self.connections if not c.closed]
+            best = min(self.connections, key=lambda c: c.in_flight, default=None)
+            if best is not None and (best.in_flight == 0 or len(self.connections) >= self.pool_size):
+                return best
+            conn = await LineConnection.open(self.host, self.port, self.prefix)
+            self.connections.append(conn)
+            return conn
+
+    async def connect(self):
+        """Open a first connection now, so a server that's down is noticed straight away."""
+        await self.connection()
+
+    async def call(self, lines, expect=1):
+        """
+        Send request lines on one pooled connection; returns the `expect`
+        reply lines. Empty lines are refused, since the servers skip them;
+        whitespace is left to the caller (pwd and echo answer it, calc skips it).
+        """
+        if any(not line.rstrip('\r') for line in lines):
+            raise ValueError("request lines can't be empty: the servers don't answer them")
+        return await self.send(lines, expect)
+
+    async def send(self, lines, expect):
+        # call() without the blank line check, for BATCH and BULK blocks,
+        # where every line is an item and does get its answer
+        conn = await self.connection()
+        return await conn.call(lines, expect)
+
+    async def request(self, line):
+        """One request line, one reply line."""
+        return (await self.call([line]))[0]
+
+    async def calc_many(self, exprs):
+        """Calculator replies ("Result: ..." or "Error: ...") for many expressions, in order."""
+        async def batch(chunk):
+            replies = await self.send([f"BATCH {len(chunk)}", *chunk], len(chunk) + 1)
+            if replies[0] != f"BATCH {len(chunk)}":
+                raise ServiceError(replies[0])
+            return replies[1:]
+        return await self.chunked(batch, exprs, CALC_CHUNK)
+
+    async def validate_many(self, passwords):
+        """Failed-rule bitmasks (0 = valid, see pwd_policy.py) for many passwords, in order."""
+        async def bulk(chunk):
+            reply = (await self.send([f"BULK {len(chunk)}", *chunk], 1))[0]
+            fields = reply.split()
+            if fields[:2] != ['BULK', str(len(chunk))]:
+                raise ServiceError(reply)
+            return [int(code, 16) for code in fields[2:]]
+        return await self.chunked(bulk, passwords, PWD_CHUNK)
+
+    async def weather_many(self, cities):
+        """Weather report dicts for many cities, in order; unknown cities get an error dict."""
+        async def multi(chunk):
+            reply = json.loads(await self.request('MULTI ' + ','.join(chunk)))
+            if not isinstance(reply, list):
+                raise ServiceError(reply.get('message', reply))
+            return reply
+        return await self.chunked(multi, [c.strip() for c in cities], WEATHER_CHUNK)
+
+    async def chunked(self, send, items, size):
+        """Run send() on chunks of items concurrently and join the results in order."""
+        items = list(items)
+        if not items:
+            return []
+        results = await asyncio.gather(*(send(items[i:i + size]) for i in range(0, len(items), size)))
+        return [r for chunk in results for r in chunk]
+
+    async def subscribe(self, cities):
+        """
+        Async generator over the weather server's SUBSCRIBE pushes, each a
+        list of report dicts, on a connection of its own (closed, which
+        ends the subscription, when the generator is).
+        """
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_LINE)
+        try:
+            writer.write(('SUBSCRIBE ' + ','.join(cities) + '\n').encode('utf-8'))
+            ack = json.loads(await reader.readline() or b'null')
+            if not isinstance(ack, dict) or ack.get('status') != 'subscribed':
+                raise ServiceError(ack.get('message', ack) if isinstance(ack, dict) else "connection closed")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                yield json.loads(line)
+        finally:
+            writer.close()
+
+    async def close(self):
+        for conn in self.connections:
+            await conn.close()
+        self.connections = []
+
+class LineClient:
+    """
+    Blocking version of AsyncClient with the same methods; its event loop
+    runs in a background thread. Safe to share between threads.
+    timeout (seconds) bounds each call.
+    """
+    def __init__(self, host, port, pool_size=DEFAULT_POOL_SIZE, service=None, timeout=None):
+        self.client = AsyncClient(host, port, pool_size, service)
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()  # LineConnection.call() then drops the connection it was waiting on
+            raise
+
+    def connect(self):
+        self.run(self.client.connect())
+
+    def call(self, lines, expect=1):
+        return self.run(self.client.call(lines, expect))
+
+    def request(self, line):
+        return self.run(self.client.request(line))
+
+    def calc_many(self, exprs):
+        return self.run(self.client.calc_many(exprs))
+
+    def validate_many(self, passwords):
+        return self.run(self.client.validate_many(passwords))
+
+    def weather_many(self, cities):
+        return self.run(self.client.weather_many(cities))
+
+    def subscribe(self, cities):
+        """
+        Generator over SUBSCRIBE pushes, each a list of report dicts. It
+        reads a plain blocking connection of its own; stop iterating (or
+        close the generator) to unsubscribe.
+        """
+        with socket.create_connection((self.client.host, self.client.port)) as sock:
+            reader = sock.makefile('r', encoding='utf-8')
+            sock.sendall(('SUBSCRIBE ' + ','.join(cities) + '\n').encode('utf-8'))
+            ack = json.loads(reader.readline() or 'null')
+            if not isinstance(ack, dict) or ack.get('status') != 'subscribed':
+                raise ServiceError(ack.get('message', ack) if isinstance(ack, dict) else "connection closed")
+            for line in reader:
+                yield json.loads(line)
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
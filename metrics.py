@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# metrics.py
+"""
+Request metrics for every server, served in Prometheus text format on a
+side port (--metrics-port N, then GET http://host:N/metrics).
+
+Each service (calc, pwd, weather, echo, gateway, chat, ...) gets a
+ServiceMetrics from service_metrics(name) and records into it:
+
+    started = now()
+    ... handle one request ...
+    METRICS.observe(started, bytes_in, bytes_out)
+
+which counts the request and its bytes and adds its latency to an
+HDR-style histogram: log-linear buckets of 1 microsecond up to 16us, then
+SUB_BUCKETS per power of two (about 6% wide), up to a minute. Recording
+takes no lock: each thread writes to its own shard of counters, which a
+scrape adds up. A thread's shard is handed on to a new thread once the old
+one is gone, so thread-per-connection servers don't grow without bound.
+observe() costs about a microsecond, cheap enough to leave on.
+
+Exported per service (label service="..."):
+    requests_total, received_bytes_total, sent_bytes_total,
+    connections_total, connections_open,
+    request_duration_seconds (histogram, BOUNDS buckets) and
+    request_duration_quantile_seconds (p50/p90/p99/p999 from the fine buckets)
+and each server's stats() as server_<name>{server="..."}.
+
+Snapshots are plain dicts of numbers, so prefork workers can send theirs
+to the supervisor, which merges them (see serverCore.Prefork).
+"""
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+now = time.perf_counter_ns  # what observe() expects as its start time
+
+SUB_BITS = 3
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_MICROS = 60_000_000      # longer requests land in the last bucket
+
+def bucket_index(micros):
+    """Fine bucket of a latency in microseconds: exact below 16, then 8 per power of two."""
+    shift = micros.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return micros
+    return (shift << SUB_BITS) + (micros >> shift)
+
+def bucket_lower(index):
+    """Smallest latency, in microseconds, that falls in a fine bucket."""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BITS) - 1
+    return (index - (shift << SUB_BITS)) << shift
+
+BUCKETS = bucket_index(MAX_MICROS) + 1
+# Prometheus histogram buckets, in seconds; each counts the fine buckets that end at or below it
+BOUNDS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+          0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+FIELDS = ('requests', 'bytes_in', 'bytes_out', 'nanos', 'opened', 'closed')
+
+class Shard:
+    """One thread's counters. Only that thread writes to it."""
+    __slots__ = FIELDS + ('buckets',)
+
+    def __init__(self):
+        for field in FIELDS:
+            setattr(self, field, 0)
+        self.buckets = [0] * BUCKETS
+
+class ServiceMetrics:
+    """Counters and latency histogram for one service; see the module docstring."""
+    def __init__(self, name):
+        self.name = name
+        self.local = threading.local()
+        self.lock = threading.Lock()  # only for adding shards
+        self.shards = []
+        self.free = []                # shards of threads that have ended
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            pass
+        try:
+            shard = self.free.pop()
+        except IndexError:
+            shard = Shard()
+            with self.lock:
+                self.shards = self.shards + [shard]
+        self.local.shard = shard
+        # hand the shard on once this thread is gone (its counts stay in it)
+        weakref.finalize(threading.current_thread(), self.free.append, shard)
+        return shard
+
+    def observe(self, started, bytes_in=0, bytes_out=0, requests=1):
+        """
+        Record requests handled since started (a now() value). A batch of
+        several requests adds each with the batch's average latency.
+        """
+        elapsed = now() - started
+        try:
+            shard = self.local.shard
+        except AttributeError:
+            shard = self.shard()
+        shard.bytes_in += bytes_in
+        shard.bytes_out += bytes_out
+        if requests:
+            shard.requests += requests
+            shard.nanos += elapsed
+            index = bucket_index(elapsed // (1000 * requests))
+            shard.buckets[index if index < BUCKETS else BUCKETS - 1] += requests
+
+    def opened(self):
+        self.shard().opened += 1
+
+    def closed(self):
+        self.shard().closed += 1
+
+    def snapshot(self):
+        total = dict.fromkeys(FIELDS, 0)
+        buckets = [0] * BUCKETS
+        for shard in self.shards:
+            for field in FIELDS:
+                total[field] += getattr(shard, field)
+            buckets = [a + b for a, b in zip(buckets, shard.buckets)]
+        total['buckets'] = buckets
+        return total
+
+SERVICES = {}  # name -> ServiceMetrics
+SERVICES_LOCK = threading.Lock()
+
+def service_metrics(name):
+    """The ServiceMetrics for a service name, made on first use."""
+    metrics = SERVICES.get(name)
+    if metrics is None:
+        with SERVICES_LOCK:
+            metrics = SERVICES.setdefault(name, ServiceMetrics(name))
+    return metrics
+
+def snapshot():
+    """{service name: counters} for every service of this process."""
+    return {name: metrics.snapshot() for name, metrics in list(SERVICES.items())}
+
+def merge(snapshots):
+    """Add up snapshot() results, e.g. from several worker processes."""
+    total = {}
+    for snap in snapshots:
+        for name, counters in snap.items():
+            into = total.get(name)
+            if into is None:
+                total[name] = {**counters, 'buckets': list(counters['buckets'])}
+                continue
+            for field in FIELDS:
+                into[field] += counters[field]
+            into['buckets'] = [a + b for a, b in zip(into['buckets'], counters['buckets'])]
+    return total
+
+def quantile(buckets, count, q):
+    """Latency in seconds below which a fraction q of the requests fall (bucket midpoint)."""
+    rank = q * count
+    seen = 0
+    for index, n in enumerate(buckets):
+        seen += n
+        if n and seen >= rank:
+            return (bucket_lower(index) + bucket_lower(index + 1)) / 2e6
+    return 0.0
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def render(services, servers=None, counters=()):
+    """
+    Prometheus text for merged service snapshots, plus servers, a dict of
+    {server name: stats()} whose counters keys are exported as counters
+    and the rest as gauges.
+    """
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+
+    names = sorted(services)
+    simple = [('requests_total', 'requests', "Requests handled."),
+              ('received_bytes_total', 'bytes_in', "Request bytes received."),
+              ('sent_bytes_total', 'bytes_out', "Response bytes sent."),
+              ('connections_total', 'opened', "Connections opened.")]
+    for metric, field, help_text in simple:
+        family(metric, 'counter', help_text,
+               [f'{metric}{{service="{label(n)}"}} {services[n][field]}' for n in names])
+    family('connections_open', 'gauge', "Connections open now.",
+           [f'connections_open{{service="{label(n)}"}} {services[n]["opened"] - services[n]["closed"]}'
+            for n in names])
+
+    samples = []
+    for n in names:
+        counts = services[n]
+        buckets = counts['buckets']
+        cumulative = 0
+        index = 0
+        for bound in BOUNDS:
+            limit = bound * 1e6
+            while index < BUCKETS - 1 and bucket_lower(index + 1) <= limit:
+                cumulative += buckets[index]
+                index += 1
+            samples.append(f'request_duration_seconds_bucket{{service="{label(n)}",le="{bound}"}} {cumulative}')
+        samples.append(f'request_duration_seconds_bucket{{service="{label(n)}",le="+Inf"}} {counts["requests"]}')
+        samples.append(f'request_duration_seconds_sum{{service="{label(n)}"}} {counts["nanos"] / 1e9}')
+        samples.append(f'request_duration_seconds_count{{service="{label(n)}"}} {counts["requests"]}')
+    family('request_duration_seconds', 'histogram', "Time to handle a request.", samples)
+
+    family('request_duration_quantile_seconds', 'gauge',
+           "Request latency quantiles since start, from the fine histogram.",
+           [f'request_duration_quantile_seconds{{service="{label(n)}",quantile="{q}"}} '
+            f'{quantile(services[n]["buckets"], services[n]["requests"], q)}'
+            for n in names for q in QUANTILES])
+
+    by_key = {}
+    for server, stats in (servers or {}).items():
+        for key, value in stats.items():
+            by_key.setdefault(key, []).append((server, value))
+    for key, values in by_key.items():
+        kind = 'counter' if key in counters else 'gauge'
+        metric = f"server_{key}_total" if kind == 'counter' else f"server_{key}"
+        family(metric, kind, f"Server stats() '{key}'.",
+               [f'{metric}{{server="{label(server)}"}} {value}' for server, value in values])
+    return '\n'.join(lines) + '\n'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    collect = None  # set on the subclass serve_metrics() makes
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.collect().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the log
+
+def serve_metrics(port, collect=None, host='0.0.0.0'):
+    """
+    Serve collect() (default: this process's services) at /metrics on a
+    background thread. Returns the HTTP server.
+    """
+    if collect is None:
+        collect = lambda: render(snapshot())
+    handler = type('Handler', (MetricsHandler,), {'collect': staticmethod(collect)})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"[*] Metrics on http://{host}:{port}/metrics")
+    return httpd
+
+def add_metrics_arguments(parser):
+    """Add --metrics-port (serverCore.add_pool_arguments() includes it)."""
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve Prometheus metrics on this port (default: off)")
@@ -1,12 +1,251 @@
 import socket
 import threading
-import sys
+import asyncio
+import argparse
+from collections import deque
+from framing import (encode_frame, read_hello, read_hello_async, send_message,
+                     iter_messages, FrameDecoder, FrameError)
+from federation import FED_MAGIC, Federation, parse_peers
+from metrics import add_metrics_arguments, now, serve_metrics, service_metrics
+import serverLog as log
+from serverCore import raise_fd_limit
+
+OVERFLOW_POLICIES = ('drop-oldest', 'disconnect', 'coalesce')
+COALESCE_MAX_BYTES = 256 * 1024  # a coalesced backlog larger than this disconnects the client
+METRICS = service_metrics('chat')       # messages from our own clients; bytes out = fan-out
+PEER_METRICS = service_metrics('peer')  # messages relayed from peer servers
+
+class Outbox:
+    """
+    Bounded outbound queue for one TCP client, drained by its own writer thread.
+    broadcast() only enqueues here, so a slow reader never stalls the others.
+    When the queue is full the overflow policy decides what happens:
+      drop-oldest - discard the oldest queued message
+      disconnect  - drop the slow consumer
+      coalesce    - merge the backlog into a single pending write
+    Framed clients are handed ready-encoded frames, so their whole backlog
+    goes out in one sendall().
+    """
+    def __init__(self, sock, limit=256, policy='drop-oldest', framed=False):
+        self.sock = sock
+        self.limit = limit
+        self.policy = policy
+        self.framed = framed
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def put(self, data):
+        """Queue data for sending. Returns False if the client is (being) disconnected."""
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.queue) >= self.limit:
+                if self.policy == 'disconnect':
+                    self._abort()
+                    return False
+                elif self.policy == 'coalesce':
+                    merged = b''.join(self.queue) + data
+                    if len(merged) > COALESCE_MAX_BYTES:
+                        self._abort()
+                        return False
+                    self.queue.clear()
+                    self.queue.append(merged)
+                else:
+                    self.queue.popleft()
+                    self.queue.append(data)
+                    self.dropped += 1
+            else:
+                self.queue.append(data)
+            self.cond.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                pending = self.queue
+                self.queue = deque()
+            try:
+                if self.framed:
+                    self.sock.sendall(b''.join(pending))
+                else:
+                    for data in pending:
+                        self.sock.sendall(data)
+            except OSError:
+                with self.cond:
+                    self._abort()
+                return
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.queue.clear()
+            self.cond.notify()
+
+    def _abort(self):
+        # Caller holds self.cond. Shutting the socket down wakes the reader
+        # thread, which then runs the normal disconnect path.
+        self.closed = True
+        self.queue.clear()
+        self.cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class AsyncOutbox:
+    """
+    Outbox for the asyncio engine, with the same limit and overflow policies.
+    Data goes straight onto the transport while its write buffer is below
+    the high-water mark; past that, messages wait here (at most `limit`)
+    and a flush task writes them out as the transport drains.
+    """
+    def __init__(self, writer, limit=256, policy='drop-oldest'):
+        self.writer = writer
+        self.transport = writer.transport
+        self.limit = limit
+        self.policy = policy
+        self.queue = deque()
+        self.closed = False
+        self.dropped = 0
+        self.flushing = None
+
+    def put(self, data):
+        """Queue data for sending. Returns False if the client is (being) disconnected."""
+        if self.closed or self.transport.is_closing():
+            return False
+        if not self.queue and self.transport.get_write_buffer_size() < self.transport.get_write_buffer_limits()[1]:
+            self.writer.write(data)
+            return True
+        if len(self.queue) >= self.limit:
+            if self.policy == 'disconnect':
+                self._abort()
+                return False
+            elif self.policy == 'coalesce':
+                merged = b''.join(self.queue) + data
+                if len(merged) > COALESCE_MAX_BYTES:
+                    self._abort()
+                    return False
+                self.queue.clear()
+                self.queue.append(merged)
+            else:
+                self.queue.popleft()
+                self.queue.append(data)
+                self.dropped += 1
+        else:
+            self.queue.append(data)
+        if self.flushing is None:
+            self.flushing = asyncio.get_running_loop().create_task(self.flush())
+        return True
+
+    async def flush(self):
+        try:
+            while self.queue and not self.closed:
+                await self.writer.drain()
+                pending = b''.join(self.queue)
+                self.queue.clear()
+                self.writer.write(pending)
+        except OSError:
+            self._abort()
+        finally:
+            self.flushing = None
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+
+    def _abort(self):
+        # Aborting the transport ends the client's reader, and
+        # handle_tcp_client then runs the normal disconnect path.
+        self.close()
+        self.transport.abort()
+
+class Client:
+    """One registered chat client. sock is the TCP socket/StreamWriter or the shared UDP endpoint."""
+    __slots__ = ('protocol', 'sock', 'addr', 'username', 'outbox', 'framed')
+
+    def __init__(self, protocol, sock, addr, username, outbox=None, framed=False):
+        self.protocol = protocol
+        self.sock = sock
+        self.addr = addr
+        self.username = username
+        self.outbox = outbox
+        self.framed = framed
+
+class ClientRegistry:
+    """
+    Chat clients indexed by address, username and protocol.
+    Lookup, insert and removal are O(1). snapshot() hands out a tuple that
+    is only rebuilt after membership changes, so broadcasts don't copy the
+    client list every time. The registry does no locking of its own;
+    ChatServer guards it with clients_lock.
+    TCP and UDP port numbers are separate spaces, so clients are keyed by
+    (protocol, addr): a UDP client may share its address with a TCP one.
+    """
+    def __init__(self):
+        self.by_addr = {}      # (protocol, addr) -> Client
+        self.by_username = {}  # username -> {(protocol, addr): Client}; names aren't unique
+        self.by_protocol = {'TCP': {}, 'UDP': {}}  # protocol -> {addr: Client}
+        self._snapshot = ()
+        self._stale = False
+
+    def __len__(self):
+        return len(self.by_addr)
+
+    def get(self, protocol, addr):
+        return self.by_protocol[protocol].get(addr)
+
+    def with_username(self, username):
+        return list(self.by_username.get(username, {}).values())
+
+    def with_protocol(self, protocol):
+        return list(self.by_protocol[protocol].values())
+
+    def add(self, client):
+        key = (client.protocol, client.addr)
+        current = self.by_addr.get(key)
+        if current is not None:
+            self.remove(current)
+        self.by_addr[key] = client
+        self.by_username.setdefault(client.username, {})[key] = client
+        self.by_protocol[client.protocol][client.addr] = client
+        self._stale = True
+
+    def remove(self, client):
+        """Remove client if it is still registered. Returns True if it was."""
+        key = (client.protocol, client.addr)
+        if self.by_addr.get(key) is not client:
+            return False
+        del self.by_addr[key]
+        named = self.by_username[client.username]
+        del named[key]
+        if not named:
+            del self.by_username[client.username]
+        del self.by_protocol[client.protocol][client.addr]
+        self._stale = True
+        return True
+
+    def snapshot(self):
+        if self._stale:
+            self._snapshot = tuple(self.by_addr.values())
+            self._stale = False
+        return self._snapshot
 
 class ChatServer:
-    def __init__(self, port, peer_port):
+    def __init__(self, port, peers, queue_limit=256, overflow_policy='drop-oldest'):
         self.port = port
-        self.peer_port = peer_port
-        self.clients = []  # Now stores (protocol, socket, addr, username)
+        self.peers = peers  # [(host, client_port)] of every other node in the mesh
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self.clients = ClientRegistry()
         self.clients_lock = threading.Lock()
         
     def start(self):
@@ -22,10 +261,11 @@ class ChatServer:
         self.udp_socket.bind(('localhost', self.port))
         
         print(f"Server started on port {self.port}")
-        print(f"Peer server port: {self.peer_port}")
+        print(f"Peer servers: {format_peers(self.peers)}")
         
-        # Connect to peer server
-        self.connect_to_peer()
+        # Link up with the peer servers (links retry in the background)
+        self.federation = Federation(f"localhost:{self.port}", self.peers, self.receive_from_peer)
+        self.federation.start()
         
         # Start threads
         threading.Thread(target=self.accept_tcp, daemon=True).start()
@@ -37,19 +277,10 @@ class ChatServer:
         except KeyboardInterrupt:
             print("Shutting down server...")
     
-    def connect_to_peer(self):
-        self.peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.peer_socket.connect(('localhost', self.peer_port))
-            print(f"Connected to peer server on port {self.peer_port}")
-            threading.Thread(target=self.receive_from_peer, daemon=True).start()
-        except:
-            print(f"Failed to connect to peer server on port {self.peer_port}")
-    
     def accept_tcp(self):
         while True:
             client_socket, addr = self.tcp_socket.accept()
-            print(f"TCP client connected: {addr}, waiting for username...")
+            log.info("TCP client connected: %s, waiting for username...", addr)
             threading.Thread(target=self.handle_tcp_client, args=(client_socket, addr), daemon=True).start()
     
     def handle_udp(self):
@@ -62,139 +293,398 @@ class ChatServer:
                 message = data.decode()
                 
                 # Check if this is a new UDP client (username registration)
-                client_exists = False
                 with self.clients_lock:
-                    for protocol, sock, client_addr, username in self.clients:
-                        if addr == client_addr:
-                            client_exists = True
-                            break
+                    client = self.clients.get('UDP', addr)
                 
-                if not client_exists:
+                if client is None:
                     # First message from UDP client is their username
                     username = message
+                    client = Client('UDP', self.udp_socket, addr, username)
                     with self.clients_lock:
-                        self.clients.append(('UDP', self.udp_socket, addr, username))
-                    print(f"UDP client '{username}' connected: {addr}")
+                        self.clients.add(client)
+                    METRICS.opened()
+                    log.info("UDP client '%s' connected: %s", username, addr)
                     
                     # Send confirmation
                     self.udp_socket.sendto("USERNAME_ACCEPTED".encode(), addr)
                     
                     # Notify others
                     join_msg = f"*** {username} joined the chat ***"
-                    self.broadcast(join_msg, addr)
+                    self.broadcast(join_msg, client)
                     self.forward_to_peer(join_msg)
                     continue
                 
-                # Get username for this address
-                username = self.get_username(addr)
-                formatted_msg = f"{username}: {message}"
+                started = now()
+                formatted_msg = f"{client.username}: {message}"
                 
                 # Broadcast to other clients
-                self.broadcast(formatted_msg, addr)
+                sent = self.broadcast(formatted_msg, client)
                 
                 # Forward to peer server
                 self.forward_to_peer(formatted_msg)
+                METRICS.observe(started, len(data), sent)
                 
             except Exception as e:
                 # Ignore UDP connection errors as UDP is connectionless
                 if "10054" not in str(e):
-                    print(f"UDP error: {e}")
+                    log.sampled('udp error', "UDP error: %s", e, lvl=log.WARNING)
     
     def handle_tcp_client(self, client_socket, addr):
         username = None
+        client = None
+        outbox = Outbox(client_socket, self.queue_limit, self.overflow_policy)
         try:
+            # The first bytes are the framing hello, a peer link hello or the username
+            framed, data = read_hello(client_socket)
+            if not framed and Federation.is_hello(data):
+                log.info("Peer server linked from %s", addr)
+                self.federation.accept(client_socket, data)
+                return
+            outbox.framed = framed
+            messages = iter_messages(client_socket, framed, data)
+            
             # First, receive username
-            data = client_socket.recv(1024)
+            data = next(messages, None)
             if not data:
                 return
             username = data.decode().strip()
             
-            # Add client to list
-            with self.clients_lock:
-                self.clients.append(('TCP', client_socket, addr, username))
-            print(f"TCP client '{username}' registered: {addr}")
+            # Send confirmation before the client can receive any broadcast
+            send_message(client_socket, framed, "USERNAME_ACCEPTED".encode())
+            outbox.start()
             
-            # Send confirmation
-            client_socket.sendall("USERNAME_ACCEPTED".encode())
+            # Add client to the registry
+            client = Client('TCP', client_socket, addr, username, outbox, framed)
+            with self.clients_lock:
+                self.clients.add(client)
+            METRICS.opened()
+            log.info("TCP client '%s' registered: %s", username, addr)
             
             # Notify others
             join_msg = f"*** {username} joined the chat ***"
-            self.broadcast(join_msg, addr)
+            self.broadcast(join_msg, client)
             self.forward_to_peer(join_msg)
             
             # Handle messages
-            while True:
-                data = client_socket.recv(1024)
-                if not data:
-                    break
+            for data in messages:
+                started = now()
                 message = data.decode()
                 formatted_msg = f"{username}: {message}"
-                self.broadcast(formatted_msg, addr)
+                sent = self.broadcast(formatted_msg, client)
                 self.forward_to_peer(formatted_msg)
+                METRICS.observe(started, len(data), sent)
         except:
             pass
         finally:
-            if username:
+            outbox.close()
+            if client:
                 with self.clients_lock:
-                    self.clients = [c for c in self.clients if c[2] != addr]
+                    self.clients.remove(client)
+                METRICS.closed()
                 
                 # Notify others
                 leave_msg = f"*** {username} left the chat ***"
                 self.broadcast(leave_msg, None)
                 self.forward_to_peer(leave_msg)
-                print(f"TCP client '{username}' disconnected: {addr}")
+                log.info("TCP client '%s' disconnected: %s", username, addr)
             
             client_socket.close()
     
-    def receive_from_peer(self):
-        while True:
-            try:
-                data = self.peer_socket.recv(1024)
-                if not data:
-                    break
-                self.broadcast(f"[Peer] {data.decode()}", None)
-            except:
-                break
+    def receive_from_peer(self, message, origin):
+        started = now()
+        sent = self.broadcast(f"[Peer] {message}", None)
+        PEER_METRICS.observe(started, len(message), sent)
     
-    def get_username(self, addr):
+    def get_username(self, addr, protocol='UDP'):
         with self.clients_lock:
-            for protocol, sock, client_addr, username in self.clients:
-                if client_addr == addr:
-                    return username
-        return "Unknown"
+            client = self.clients.get(protocol, addr)
+        return client.username if client else "Unknown"
     
-    def broadcast(self, message, exclude_addr):
+    def broadcast(self, message, exclude):
+        """Send message to every client except `exclude` (a Client or None); returns the bytes queued."""
+        data = message.encode()
+        frame = None
+        sent = 0
+        # Hold the lock only long enough to grab the snapshot; TCP sends go
+        # through each client's outbox so nobody waits on a slow reader.
         with self.clients_lock:
-            for protocol, sock, addr, username in self.clients[:]:  # Use slice to avoid modification during iteration
-                if addr == exclude_addr:
-                    continue
-                try:
-                    if protocol == 'TCP':
-                        sock.sendall(message.encode())
-                    else:
-                        # For UDP, use the same UDP socket but send to specific address
-                        sock.sendto(message.encode(), addr)
-                except:
-                    # Remove client if sending fails
-                    try:
-                        self.clients.remove((protocol, sock, addr, username))
-                    except:
-                        pass
+            recipients = self.clients.snapshot()
+        for client in recipients:
+            if client is exclude:
+                continue
+            if client.protocol == 'TCP':
+                # A refused put means the outbox shut the socket down;
+                # handle_tcp_client cleans up and announces the departure.
+                if client.framed:
+                    if frame is None:
+                        frame = encode_frame(data)
+                    client.outbox.put(frame)
+                    sent += len(frame)
+                else:
+                    client.outbox.put(data)
+                    sent += len(data)
+                continue
+            try:
+                # For UDP, use the same UDP socket but send to specific address
+                client.sock.sendto(data, client.addr)
+                sent += len(data)
+            except:
+                # Remove client if sending fails
+                with self.clients_lock:
+                    self.clients.remove(client)
+        return sent
     
     def forward_to_peer(self, message):
+        self.federation.publish(message)
+
+class ChatDatagramProtocol(asyncio.DatagramProtocol):
+    """UDP side of AsyncChatServer: hands every datagram to the server."""
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data:
+            self.server.handle_udp(data, addr)
+
+    def error_received(self, exc):
+        # Ignore UDP connection errors as UDP is connectionless
+        if "10054" not in str(exc):
+            log.sampled('udp error', "UDP error: %s", exc, lvl=log.WARNING)
+
+class AsyncChatServer:
+    """
+    asyncio engine for the chat server.
+    Speaks the same wire protocol as ChatServer, but every TCP and UDP
+    client is served from a single event loop instead of a thread each.
+    """
+    def __init__(self, port, peers, queue_limit=256, overflow_policy='drop-oldest'):
+        self.port = port
+        self.peers = peers
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self.clients = ClientRegistry()  # sock is a StreamWriter or the UDP transport
+
+    def start(self):
+        raise_fd_limit()
         try:
-            self.peer_socket.sendall(message.encode())
-        except:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Shutting down server...")
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+
+        # TCP listener
+        self.tcp_server = await asyncio.start_server(
+            self.handle_tcp_client, 'localhost', self.port,
+            reuse_address=True, backlog=1024)
+
+        # UDP socket (bound by hand so SO_REUSEADDR matches the threaded server)
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udp_socket.bind(('localhost', self.port))
+        self.udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: ChatDatagramProtocol(self), sock=udp_socket)
+
+        print(f"Server started on port {self.port} (asyncio)")
+        print(f"Peer servers: {format_peers(self.peers)}")
+
+        # Peer links run on their own threads; deliveries are handed back to the loop
+        self.federation = Federation(
+            f"localhost:{self.port}", self.peers,
+            lambda message, origin: loop.call_soon_threadsafe(self.receive_from_peer, message, origin))
+        self.federation.start()
+
+        async with self.tcp_server:
+            await self.tcp_server.serve_forever()
+
+    def handle_udp(self, data, addr):
+        message = data.decode(errors='replace')
+
+        client = self.clients.get('UDP', addr)
+        if client is None:
+            # First message from UDP client is their username
+            username = message
+            client = Client('UDP', self.udp_transport, addr, username)
+            self.clients.add(client)
+            METRICS.opened()
+            log.info("UDP client '%s' connected: %s", username, addr)
+
+            # Send confirmation
+            self.udp_transport.sendto("USERNAME_ACCEPTED".encode(), addr)
+
+            # Notify others
+            join_msg = f"*** {username} joined the chat ***"
+            self.broadcast(join_msg, client)
+            self.forward_to_peer(join_msg)
+            return
+
+        started = now()
+        formatted_msg = f"{client.username}: {message}"
+        sent = self.broadcast(formatted_msg, client)
+        self.forward_to_peer(formatted_msg)
+        METRICS.observe(started, len(data), sent)
+
+    async def handle_tcp_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        log.info("TCP client connected: %s, waiting for username...", addr)
+        username = None
+        client = None
+        try:
+            # The first bytes are the framing hello, a peer link hello or the username
+            framed, data = await read_hello_async(reader, writer)
+            if not framed and Federation.is_hello(data):
+                log.info("Peer server linked from %s", addr)
+                await self.serve_peer_link(reader, data)
+                return
+            messages = self.read_messages(reader, framed, data)
+
+            # First, receive username
+            data = await anext(messages, None)
+            if not data:
+                return
+            username = data.decode().strip()
+
+            outbox = AsyncOutbox(writer, self.queue_limit, self.overflow_policy)
+            client = Client('TCP', writer, addr, username, outbox, framed)
+            self.clients.add(client)
+            METRICS.opened()
+            log.info("TCP client '%s' registered: %s", username, addr)
+
+            # Send confirmation
+            confirmation = "USERNAME_ACCEPTED".encode()
+            writer.write(encode_frame(confirmation) if framed else confirmation)
+
+            # Notify others
+            join_msg = f"*** {username} joined the chat ***"
+            self.broadcast(join_msg, client)
+            self.forward_to_peer(join_msg)
+
+            # Handle messages
+            async for data in messages:
+                started = now()
+                formatted_msg = f"{username}: {data.decode()}"
+                sent = self.broadcast(formatted_msg, client)
+                self.forward_to_peer(formatted_msg)
+                METRICS.observe(started, len(data), sent)
+        except (OSError, UnicodeDecodeError, FrameError):
             pass
+        finally:
+            if client:
+                self.clients.remove(client)
+                client.outbox.close()
+                METRICS.closed()
+
+                # Notify others
+                leave_msg = f"*** {username} left the chat ***"
+                self.broadcast(leave_msg, None)
+                self.forward_to_peer(leave_msg)
+                log.info("TCP client '%s' disconnected: %s", username, addr)
+
+            writer.close()
+
+    def receive_from_peer(self, message, origin):
+        started = now()
+        sent = self.broadcast(f"[Peer] {message}", None)
+        PEER_METRICS.observe(started, len(message), sent)
+
+    async def serve_peer_link(self, reader, data):
+        """Inbound federation link: feed its frames to the federation layer."""
+        while len(data) < len(FED_MAGIC):
+            more = await reader.read(1024)
+            if not more:
+                return
+            data += more
+        try:
+            async for payload in self.read_messages(reader, True, data[len(FED_MAGIC):]):
+                self.federation.receive(payload)
+        except (OSError, FrameError) as e:
+            log.warning("Peer link error: %s", e)
+
+    async def read_messages(self, reader, framed, data=None):
+        """Async counterpart of framing.iter_messages()."""
+        if not framed:
+            if data is None:
+                data = await reader.read(1024)
+            while data:
+                yield data
+                data = await reader.read(1024)
+            return
+        decoder = FrameDecoder()
+        if data:
+            for frame in decoder.feed(data):
+                yield frame
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                return
+            for frame in decoder.feed(data):
+                yield frame
+
+    def get_username(self, addr, protocol='UDP'):
+        client = self.clients.get(protocol, addr)
+        return client.username if client else "Unknown"
+
+    def broadcast(self, message, exclude):
+        # Writes only queue data on the transports, so nothing here blocks the loop
+        data = message.encode()
+        frame = None
+        sent = 0
+        for client in self.clients.snapshot():
+            if client is exclude:
+                continue
+            if client.protocol == 'TCP':
+                # A refused put means the outbox aborted the transport;
+                # handle_tcp_client cleans up and announces the departure.
+                if client.framed:
+                    if frame is None:
+                        frame = encode_frame(data)
+                    client.outbox.put(frame)
+                    sent += len(frame)
+                else:
+                    client.outbox.put(data)
+                    sent += len(data)
+                continue
+            try:
+                client.sock.sendto(data, client.addr)
+                sent += len(data)
+            except Exception:
+                # Remove client if sending fails
+                self.clients.remove(client)
+        return sent
+
+    def forward_to_peer(self, message):
+        self.federation.publish(message)
+
+def format_peers(peers):
+    return ', '.join(f"{host}:{port}" for host, port in peers) or "none"
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python server.py <port> <peer_port>")
-        print("Example: python server.py 9000 9001")
-        sys.exit(1)
-    
-    port = int(sys.argv[1])
-    peer_port = int(sys.argv[2])
-    
-    server = ChatServer(port, peer_port)
+    parser = argparse.ArgumentParser(
+        description="Chat server with TCP/UDP clients, federated with its peer servers.",
+        epilog="Example: python multiserver.py 9000 9001,9002")
+    parser.add_argument('port', type=int, help="port for TCP and UDP clients")
+    parser.add_argument('peers', type=parse_peers,
+                        help="comma-separated client ports (or host:port) of the peer servers")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="run the asyncio engine (one thread, 10k+ clients)")
+    parser.add_argument('--queue-limit', type=int, default=256,
+                        help="max queued outbound messages per TCP client (default: 256)")
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default='drop-oldest',
+                        help="what to do when a client's outbound queue is full (default: drop-oldest)")
+    add_metrics_arguments(parser)
+    log.add_log_arguments(parser)
+    args = parser.parse_args()
+    log.configure_from_args(args)
+
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    if args.use_async:
+        server = AsyncChatServer(args.port, args.peers, args.queue_limit, args.overflow)
+    else:
+        server = ChatServer(args.port, args.peers, args.queue_limit, args.overflow)
     server.start()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+pwd_bench.py
+Microbenchmark: the original four-regex validator vs. the single-pass
+classifier in pwdServer.
+
+Usage:
+    python3 pwdBench.py [count] [repeats]
+
+Defaults: count=100000 passwords, repeats=5 (best time is reported).
+Both validators are checked to give identical results before timing.
+"""
+import random
+import re
+import string
+import sys
+import time
+
+from pwdServer import classify, validate_password
+
+# The validator as it was before the classifier, kept here as the reference
+ALLOWED_RE = re.compile(r'^[A-Za-z0-9_@\$]+$')
+UPPER_RE = re.compile(r'[A-Z]')
+DIGIT_RE = re.compile(r'[0-9]')
+SPECIAL_RE = re.compile(r'[_@\$]')
+
+def validate_password_regex(pwd):
+    reasons = []
+    if not (8 <= len(pwd) <= 20):
+        reasons.append("Length must be between 8 and 20 characters.")
+    if not ALLOWED_RE.match(pwd):
+        reasons.append("Contains invalid characters. Allowed: A-Z a-z 0-9 and _ @ $ only.")
+    if not UPPER_RE.search(pwd):
+        reasons.append("Must contain at least one uppercase letter [A-Z].")
+    if not DIGIT_RE.search(pwd):
+        reasons.append("Must contain at least one digit [0-9].")
+    if not SPECIAL_RE.search(pwd):
+        reasons.append("Must contain at least one special character from: _ @ $.")
+    return (len(reasons) == 0, reasons)
+
+def make_passwords(count, seed=1):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + '_@$'
+    passwords = []
+    for _ in range(count):
+        chars = alphabet if rng.random() < 0.8 else alphabet + ' !#-é'
+        passwords.append(''.join(rng.choice(chars) for _ in range(rng.randint(4, 24))))
+    passwords += ['', 'Abcdefg1_', 'ABCDEFGH', '12345678', 'Pässwörd1_', 'x' * 100, 'Tab\there1$']
+    return passwords
+
+def best_time(func, passwords, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for pwd in passwords:
+            func(pwd)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) >= 2 else 100000
+    repeats = int(sys.argv[2]) if len(sys.argv) >= 3 else 5
+    passwords = make_passwords(count)
+
+    mismatches = [(p, validate_password_regex(p), validate_password(p)) for p in passwords
+                  if validate_password_regex(p) != validate_password(p)]
+    if mismatches:
+        for pwd, x, y in mismatches[:10]:
+            print(f"MISMATCH {pwd!r}: regex {x!r} vs classifier {y!r}")
+        sys.exit(1)
+
+    t_regex = best_time(validate_password_regex, passwords, repeats)
+    t_validate = best_time(validate_password, passwords, repeats)
+    t_classify = best_time(classify, passwords, repeats)
+    print(f"{len(passwords)} passwords, best of {repeats}")
+    for name, t in (('regex', t_regex), ('validate_password', t_validate), ('classify (BULK)', t_classify)):
+        print(f"  {name:<18}: {t * 1e3:8.1f} ms  ({len(passwords) / t:,.0f}/s, {t_regex / t:.2f}x)")
+
+if __name__ == '__main__':
+    main()
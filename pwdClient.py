@@ -8,15 +8,16 @@ You can pass host and port as optional args:
     python3 pwd_client.py localhost 6000
 """
 
-import socket
 import sys
 import getpass
 
+from lineClient import LineClient
+
 def run_client(host='localhost', port=6000):
     try:
-        with socket.create_connection((host, port)) as sock:
+        with LineClient(host, port, pool_size=1) as client:
+            client.connect()
             print(f"Connected to password server at {host}:{port}")
-            f = sock.makefile('r')  # for reading server responses
             while True:
                 try:
                     pwd = getpass.getpass("Enter password (or type 'quit' to exit): ")
@@ -28,12 +29,10 @@ def run_client(host='localhost', port=6000):
                     print("Empty input — try again.")
                     continue
 
-                # send password (one line)
-                sock.sendall((pwd + '\n').encode('utf-8'))
-
-                # read server response line
-                resp = f.readline()
-                if not resp:
+                # send password (one line), read the server's response line
+                try:
+                    resp = client.request(pwd)
+                except ConnectionError:
                     print("Server closed connection.")
                     break
                 print("Server:", resp.strip())
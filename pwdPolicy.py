@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# pwd_policy.py
+"""
+Password policies for the password validation server.
+
+A policy file is JSON with a default policy and optional per-tenant
+overrides (any key a tenant leaves out comes from "default"):
+
+    {
+      "default": {
+        "min_length": 8, "max_length": 20,
+        "upper": 1, "lower": 0, "digit": 1, "special": 1,
+        "special_chars": "_@$", "extra_chars": "",
+        "denylist": "common-passwords.txt", "denylist_type": "set"
+      },
+      "tenants": {
+        "acme": {"min_length": 12, "special": 2}
+      }
+    }
+
+upper/lower/digit/special are minimum counts (0 = not required). Allowed
+characters are A-Z a-z 0-9 plus special_chars and extra_chars; extra_chars
+are allowed but don't count as special. denylist is a wordlist with one
+password per line, compared case-insensitively unless denylist_ignore_case
+is false. denylist_type "bloom" keeps a Bloom filter instead of a set
+(bloom_error_rate, default 0.001) for lists too big to hold as strings.
+breach_index names an on-disk index of breached passwords built with
+breach_index.py, for corpora far too big for memory; it is searched in
+place through mmap.
+
+Each policy is compiled once into a Validator: a 256-byte character-class
+table plus the rule masks, so checking a password is one translate() pass
+and a few lookups. PolicyStore reloads the file when it (or a denylist
+or breach index) changes, compiling in a background thread and swapping the result in, so
+requests never wait for a reload.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+from breachIndex import BreachIndex
+import serverLog as log
+
+DEFAULT_TENANT = 'default'
+RELOAD_CHECK_INTERVAL = 2.0  # seconds between looking at the policy file's mtime
+INDEX_CLOSE_DELAY = 10.0     # seconds a replaced breach index stays open for lookups in progress
+
+# Rule bits, in the order their reasons are reported
+LENGTH = 1
+CHARSET = 2
+UPPER = 4
+DIGIT = 8
+SPECIAL = 16
+LOWER = 32
+DENYLIST = 64
+BREACHED = 128
+RULE_BITS = (LENGTH, CHARSET, UPPER, DIGIT, SPECIAL, LOWER, DENYLIST, BREACHED)
+
+# The rules pwd_server has always applied
+DEFAULT_POLICY = {
+    'min_length': 8,
+    'max_length': 20,
+    'upper': 1,
+    'lower': 0,
+    'digit': 1,
+    'special': 1,
+    'special_chars': '_@$',
+    'extra_chars': '',
+    'denylist': None,
+    'denylist_type': 'set',
+    'denylist_ignore_case': True,
+    'bloom_error_rate': 0.001,
+    'breach_index': None,
+}
+
+# What each setting must hold; None means the setting may also be null
+SETTING_TYPES = {
+    'min_length': int, 'max_length': int,
+    'upper': int, 'lower': int, 'digit': int, 'special': int,
+    'special_chars': str, 'extra_chars': str,
+    'denylist': (str, type(None)), 'denylist_type': str, 'denylist_ignore_case': bool,
+    'bloom_error_rate': (int, float), 'breach_index': (str, type(None)),
+}
+
+UPPERCASE = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+LOWERCASE = b'abcdefghijklmnopqrstuvwxyz'
+DIGITS = b'0123456789'
+
+class PolicyError(ValueError):
+    pass
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for n items at the given false positive rate."""
+    def __init__(self, n, error_rate=0.001):
+        n = max(1, n)
+        self.size = max(8, int(-n * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / n * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def hash_pair(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8', 'replace'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def add(self, item):
+        h1, h2 = self.hash_pair(item)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % size
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        # most lookups are misses, which usually stop at the first probe or two
+        h1, h2 = self.hash_pair(item)
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+def read_wordlist(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            word = line.rstrip('\r\n')
+            if word:
+                yield word
+
+def count_words(path):
+    """Number of words read_wordlist() yields, counted without keeping them."""
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.rstrip(b'\r\n'))
+
+def load_denylist(path, kind, ignore_case, error_rate):
+    """Load a wordlist into a set or a Bloom filter."""
+    words = read_wordlist(path)
+    if ignore_case:
+        words = (w.lower() for w in words)
+    if kind == 'set':
+        return frozenset(words)
+    if kind == 'bloom':
+        # one pass to size the filter, a second to fill it; the words are never all in memory
+        bloom = BloomFilter(count_words(path), error_rate)
+        for word in words:
+            bloom.add(word)
+        return bloom
+    raise PolicyError(f"unknown denylist_type '{kind}' (use set or bloom)")
+
+def describe_allowed(policy):
+    special = ' '.join(policy['special_chars'] + policy['extra_chars'])
+    return f"A-Z a-z 0-9 and {special}" if special else "A-Z a-z 0-9"
+
+def count_phrase(count, one, many):
+    return f"at least one {one}" if count == 1 else f"at least {count} {many}"
+
+class Validator:
+    """One compiled policy. classify() returns the failed rules as a bitmask (0 = valid)."""
+    def __init__(self, policy, denylist=None, breach_index=None):
+        self.policy = policy
+        self.min_length = policy['min_length']
+        self.max_length = policy['max_length']
+        self.ignore_case = policy['denylist_ignore_case']
+        self.denylist = denylist
+        self.breach_index = breach_index
+        if self.min_length > self.max_length:
+            raise PolicyError("min_length is larger than max_length")
+
+        # Byte -> character class: U(pper), L(ower), D(igit), S(pecial), O(ther allowed),
+        # anything else X. Passwords are UTF-8 encoded, so every non-ASCII byte is X.
+        table = bytearray(b'X' * 256)
+        for chars, cls in ((UPPERCASE, b'U'), (LOWERCASE, b'L'), (DIGITS, b'D'),
+                           (policy['extra_chars'].encode('ascii'), b'O'),
+                           (policy['special_chars'].encode('ascii'), b'S')):
+            for c in chars:
+                table[c] = cls[0]
+        self.table = bytes(table)
+
+        # (class, rule bit, minimum) for every required class
+        self.required = [(ord(cls), bit, policy[key]) for cls, bit, key in
+                         (('U', UPPER, 'upper'), ('D', DIGIT, 'digit'),
+                          ('S', SPECIAL, 'special'), ('L', LOWER, 'lower'))
+                         if policy[key] > 0]
+        # classes needed more than once have to be counted, not just seen
+        self.counted = [(bytes([cls]), bit, minimum) for cls, bit, minimum in self.required if minimum > 1]
+        self.class_masks = {}
+
+        reasons = {
+            LENGTH: f"Length must be between {self.min_length} and {self.max_length} characters.",
+            CHARSET: f"Contains invalid characters. Allowed: {describe_allowed(policy)} only.",
+            UPPER: f"Must contain {count_phrase(policy['upper'], 'uppercase letter', 'uppercase letters')} [A-Z].",
+            DIGIT: f"Must contain {count_phrase(policy['digit'], 'digit', 'digits')} [0-9].",
+            SPECIAL: f"Must contain {count_phrase(policy['special'], 'special character', 'special characters')} "
+                     f"from: {' '.join(policy['special_chars'])}.",
+            LOWER: f"Must contain {count_phrase(policy['lower'], 'lowercase letter', 'lowercase letters')} [a-z].",
+            DENYLIST: "Password is too common.",
+            BREACHED: "Password has appeared in a data breach.",
+        }
+        # Every possible mask -> its reasons, so reporting is a lookup too
+        self.reasons = [tuple(reasons[bit] for bit in RULE_BITS if mask & bit)
+                        for mask in range(1 << len(RULE_BITS))]
+
+    def class_mask(self, classes):
+        mask = 0
+        if not classes or ord('X') in classes:  # an empty password has no allowed characters either
+            mask |= CHARSET
+        for cls, bit, _ in self.required:
+            if cls not in classes:
+                mask |= bit
+        self.class_masks[classes] = mask
+        return mask
+
+    def classify(self, pwd):
+        """
+        Check every rule in one pass over the password: translate it to its
+        character classes and look the set of classes up.
+        """
+        translated = pwd.encode('utf-8', 'replace').translate(self.table)
+        classes = frozenset(translated)
+        mask = self.class_masks.get(classes)
+        if mask is None:
+            mask = self.class_mask(classes)
+        for cls, bit, minimum in self.counted:
+            if translated.count(cls) < minimum:
+                mask |= bit
+        if not (self.min_length <= len(pwd) <= self.max_length):
+            mask |= LENGTH
+        if self.denylist is not None and (pwd.lower() if self.ignore_case else pwd) in self.denylist:
+            mask |= DENYLIST
+        if self.breach_index is not None and pwd in self.breach_index:
+            mask |= BREACHED
+        return mask
+
+    def validate(self, pwd):
+        """Returns (is_valid:bool, reasons:list[str])."""
+        mask = self.classify(pwd)
+        return (mask == 0, list(self.reasons[mask]))
+
+def check_setting_types(name, policy):
+    for key, value in policy.items():
+        expected = SETTING_TYPES.get(key)
+        if expected is None:
+            continue  # unknown settings are reported by the caller
+        # JSON true/false are ints to isinstance(), but not a count or a rate
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            raise PolicyError(f"tenant '{name}': {key} has the wrong type ({json.dumps(value)})")
+
+def compile_policies(config, base_dir='.', defaults=None):
+    """
+    Compile a parsed policy file into {tenant: Validator}. defaults
+    override DEFAULT_POLICY underneath the file's own default policy.
+    """
+    if not isinstance(config, dict):
+        raise PolicyError("policy file must hold a JSON object")
+    file_default = config.get(DEFAULT_TENANT, {})
+    if not isinstance(file_default, dict):
+        raise PolicyError(f"'{DEFAULT_TENANT}' must be a JSON object")
+    overrides_by_tenant = config.get('tenants', {})
+    if not isinstance(overrides_by_tenant, dict):
+        raise PolicyError("'tenants' must be a JSON object")
+    default = {**DEFAULT_POLICY, **(defaults or {}), **file_default}
+    tenants = {DEFAULT_TENANT: default}
+    for name, overrides in overrides_by_tenant.items():
+        if not isinstance(overrides, dict):
+            raise PolicyError(f"tenant '{name}' must be a JSON object")
+        tenants[name] = dict(default, **overrides)
+
+    denylists = {}  # tenants sharing a wordlist share one copy of it
+    indexes = {}
+    validators = {}
+    for name, policy in tenants.items():
+        unknown = set(policy) - set(DEFAULT_POLICY)
+        if unknown:
+            raise PolicyError(f"tenant '{name}': unknown settings {', '.join(sorted(unknown))}")
+        check_setting_types(name, policy)
+        denylist = None
+        if policy['denylist']:
+            path = os.path.join(base_dir, policy['denylist'])
+            key = (path, policy['denylist_type'], policy['denylist_ignore_case'], policy['bloom_error_rate'])
+            if key not in denylists:
+                denylists[key] = load_denylist(*key)
+            denylist = denylists[key]
+        index = None
+        if policy['breach_index']:
+            path = os.path.join(base_dir, policy['breach_index'])
+            if path not in indexes:
+                try:
+                    indexes[path] = BreachIndex(path)
+                except ValueError as e:
+                    raise PolicyError(str(e)) from None
+            index = indexes[path]
+        try:
+            validators[name] = Validator(policy, denylist, index)
+        except (KeyError, TypeError, ValueError, UnicodeEncodeError) as e:
+            raise PolicyError(f"tenant '{name}': {e}") from None
+    return validators
+
+class PolicyStore:
+    """
+    The compiled policies currently in force: those in the file at path,
+    or just the defaults without one. The file and the denylists and
+    indexes it uses are watched: lookups notice a changed mtime (at most
+    every RELOAD_CHECK_INTERVAL seconds) and start a reload in a background
+    thread; until it finishes the old policies stay in use. A bad file is
+    reported and the old policies are kept.
+    """
+    def __init__(self, path=None, defaults=None):
+        self.path = path
+        self.defaults = defaults
+        self.base_dir = os.path.dirname(os.path.abspath(path)) if path else '.'
+        self.reloading = threading.Lock()
+        self.next_check = 0.0
+        self.mtimes = None
+        self.validators = None
+        self.load()
+
+    def watched_files(self, validators):
+        files = [self.path] if self.path else []
+        for v in validators.values():
+            for key in ('denylist', 'breach_index'):
+                if v.policy[key]:
+                    files.append(os.path.join(self.base_dir, v.policy[key]))
+        return files
+
+    def current_mtimes(self, validators):
+        mtimes = []
+        for path in self.watched_files(validators):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def load(self):
+        """Read and compile the policy file now. Raises on errors."""
+        config = {}
+        if self.path:
+            with open(self.path, encoding='utf-8') as f:
+                try:
+                    config = json.load(f)
+                except ValueError as e:
+                    raise PolicyError(f"{self.path}: {e}") from None
+        validators = compile_policies(config, self.base_dir, self.defaults)
+        self.mtimes = self.current_mtimes(validators)
+        old, self.validators = self.validators, validators  # one reference swap; readers see old or new, never a mix
+        if old:
+            # a reload opens its indexes afresh; unmap the old ones once lookups that
+            # picked up the old validators have surely finished
+            replaced = {id(v.breach_index): v.breach_index for v in old.values() if v.breach_index is not None}
+            for index in replaced.values():
+                timer = threading.Timer(INDEX_CLOSE_DELAY, index.close)
+                timer.daemon = True
+                timer.start()
+
+    def reload(self):
+        try:
+            self.load()
+            log.info("[*] Reloaded password policies from %s (%d tenants)", self.path or 'defaults', len(self.validators))
+        except Exception as e:  # whatever is wrong with the file, keep serving
+            log.warning("[!] Keeping current password policies, reload failed: %s", e)
+            self.mtimes = self.current_mtimes(self.validators)  # don't retry until it changes again
+        finally:
+            self.reloading.release()
+
+    def check_reload(self):
+        now = time.monotonic()
+        if now < self.next_check:
+            return
+        self.next_check = now + RELOAD_CHECK_INTERVAL
+        if self.current_mtimes(self.validators) != self.mtimes and self.reloading.acquire(blocking=False):
+            threading.Thread(target=self.reload, daemon=True).start()
+
+    def get(self, tenant=DEFAULT_TENANT):
+        """Validator for tenant, or None if there is no such tenant."""
+        self.check_reload()
+        return self.validators.get(tenant)
@@ -3,82 +3,136 @@
 """
 Password validation server.
 Run:
-    python3 pwd_server.py
+    python3 pwd_server.py [port] [--engine threads|selector]
+                          [--workers N] [--queue-limit N] [--processes N]
+
+    python3 pwd_server.py --policy policies.json
+    python3 pwd_server.py --breach-index breach.idx
+
+Send one password per line. For audits, send "BULK n" followed by n
+password lines; the reply is a single line "BULK n <code> <code> ..." with
+one hex code per password, in order: 0 means valid, otherwise the sum of
+the failed rules' bits (see pwd_policy.py).
+
+With --policy, rules come from a policy file (see pwd_policy.py) that is
+reloaded when it changes; "TENANT <name>" switches the connection to that
+tenant's policy. --breach-index rejects passwords found in an index built
+with breach_index.py, for every tenant whose policy doesn't name its own.
 """
 
-import socket
-import threading
-import re
+import argparse
+import os
+from functools import partial
+
+from metrics import service_metrics
+from pwdPolicy import DEFAULT_POLICY, DEFAULT_TENANT, PolicyStore, Validator
+
+import serverLog as log
+from serverCore import (LineSession, SelectorServer, WorkerPoolServer, add_engine_arguments,
+                        add_pool_arguments, serve, serve_session)
 
 HOST = '0.0.0.0'
 PORT = 6000
 
-# Precompiled regexes
-ALLOWED_RE = re.compile(r'^[A-Za-z0-9_@\$]+$')
-UPPER_RE = re.compile(r'[A-Z]')
-DIGIT_RE = re.compile(r'[0-9]')
-SPECIAL_RE = re.compile(r'[_@\$]')
+MAX_BULK = 100000
+
+# The built-in rules, used when no policy file is given
+DEFAULT_VALIDATOR = Validator(DEFAULT_POLICY)
+
+def classify(pwd):
+    """Failed rules of the built-in policy as a bitmask (0 = valid)."""
+    return DEFAULT_VALIDATOR.classify(pwd)
 
 def validate_password(pwd):
     """
     Returns (is_valid:bool, reasons:list[str])
     """
-    reasons = []
-
-    if not (8 <= len(pwd) <= 20):
-        reasons.append("Length must be between 8 and 20 characters.")
-
-    if not ALLOWED_RE.match(pwd):
-        reasons.append("Contains invalid characters. Allowed: A-Z a-z 0-9 and _ @ $ only.")
-
-    if not UPPER_RE.search(pwd):
-        reasons.append("Must contain at least one uppercase letter [A-Z].")
-
-    if not DIGIT_RE.search(pwd):
-        reasons.append("Must contain at least one digit [0-9].")
-
-    if not SPECIAL_RE.search(pwd):
-        reasons.append("Must contain at least one special character from: _ @ $.")
-
-    return (len(reasons) == 0, reasons)
-
-def handle_client(conn, addr):
-    print(f"[+] Client connected: {addr}")
-    try:
-        with conn:
-            f = conn.makefile('r')   # read lines conveniently
-            for line in f:
-                pwd = line.rstrip('\n')
-                if pwd == '':
-                    # ignore empty lines
-                    continue
-                # Allow clients to request close
-                if pwd.lower() in ('quit', 'exit'):
-                    conn.sendall(b"Goodbye.\n")
-                    break
-
-                valid, reasons = validate_password(pwd)
-                if valid:
-                    resp = "Valid password.\n"
-                else:
-                    resp = "Invalid password: " + "; ".join(reasons) + "\n"
-
-                conn.sendall(resp.encode('utf-8'))
-    except Exception as e:
-        print(f"[!] Error with client {addr}: {e}")
-    finally:
-        print(f"[-] Client disconnected: {addr}")
-
-def start_server():
-    print(f"Starting Password Validation Server on {HOST}:{PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen()
-        while True:
-            conn, addr = s.accept()
-            t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-            t.start()
+    return DEFAULT_VALIDATOR.validate(pwd)
+
+class PasswordSession(LineSession):
+    """Password protocol for one connection; shared by both engines."""
+    metrics = service_metrics('pwd')
+
+    def __init__(self, addr, policies=None):
+        super().__init__(addr)
+        self.policies = policies
+        self.tenant = DEFAULT_TENANT
+        self.bulk_left = 0
+        self.bulk_codes = []
+
+    def validator(self):
+        if self.policies is None:
+            return DEFAULT_VALIDATOR
+        # looked up per request so a reloaded policy applies straight away
+        return self.policies.get(self.tenant) or self.policies.get(DEFAULT_TENANT)
+
+    def opened(self):
+        super().opened()
+        log.info("[+] Client connected: %s", self.addr)
+
+    def closed(self):
+        super().closed()
+        log.info("[-] Client disconnected: %s", self.addr)
+
+    def handle_line(self, line):
+        pwd = line.rstrip('\r')  # the '\r' of a '\r\n' line ending
+        if self.bulk_left:
+            # inside a BULK block every line is a password, even a blank one
+            self.bulk_codes.append(format(self.validator().classify(pwd), 'x'))
+            self.bulk_left -= 1
+            if self.bulk_left:
+                return None, False
+            resp = f"BULK {len(self.bulk_codes)} {' '.join(self.bulk_codes)}\n"
+            self.bulk_codes = []
+            return resp, False
+        if pwd == '':
+            # ignore empty lines
+            return None, False
+        if pwd[:5].upper() == 'BULK ':
+            count = pwd[5:].strip()
+            if not (count.isdigit() and 0 < int(count) <= MAX_BULK):
+                return f"Error: BULK size must be between 1 and {MAX_BULK}.\n", False
+            self.bulk_left = int(count)
+            return None, False
+        if pwd[:7].upper() == 'TENANT ':
+            tenant = pwd[7:].strip()
+            if self.policies is None or self.policies.get(tenant) is None:
+                return f"Error: unknown tenant '{tenant}'.\n", False
+            self.tenant = tenant
+            return f"Tenant set to '{tenant}'.\n", False
+        # Allow clients to request close
+        if pwd.lower() in ('quit', 'exit'):
+            return "Goodbye.\n", True
+
+        valid, reasons = self.validator().validate(pwd)
+        if valid:
+            return "Valid password.\n", False
+        return "Invalid password: " + "; ".join(reasons) + "\n", False
+
+def handle_client(conn, addr, policies=None):
+    serve_session(conn, PasswordSession(addr, policies))
+
+def start_server(args):
+    policies = None
+    if args.policy or args.breach_index:
+        defaults = {'breach_index': os.path.abspath(args.breach_index)} if args.breach_index else None
+        policies = PolicyStore(args.policy, defaults)
+    if args.engine == 'selector':
+        server = SelectorServer.from_args("Password Validation Server", HOST, args.port,
+                                          partial(PasswordSession, policies=policies), args)
+    else:
+        server = WorkerPoolServer.from_args("Password Validation Server", HOST, args.port,
+                                            partial(handle_client, policies=policies), args)
+    serve(server, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Password validation server.")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"listen port (default: {PORT})")
+    parser.add_argument('--policy', help="JSON policy file, reloaded when it changes (default: built-in rules)")
+    parser.add_argument('--breach-index', help="reject passwords found in this breach index (see breach_index.py)")
+    add_engine_arguments(parser)
+    add_pool_arguments(parser)
+    start_server(parser.parse_args())
 
 if __name__ == '__main__':
-    start_server()
+    main()
@@ -1,126 +1,116 @@
 import socket
 import threading
-import sys
+import argparse
+from framing import read_hello, iter_messages, encode_frame
+from federation import Federation, parse_peers
+from metrics import add_metrics_arguments, now, serve_metrics, service_metrics
+import serverLog as log
 
 # Global variables
 clients = []
-peer_socket = None
-server_id = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+framed_clients = set()  # clients that negotiated length-prefixed frames
+federation = None
+server_id = 1
 
-# Port configuration
-CLIENT_PORT = 8001 if server_id == 1 else 8002
-INTER_SERVER_PORT = 9001 if server_id == 1 else 9002
-PEER_PORT = 9002 if server_id == 1 else 9001
+# Port configuration (set from the command line in main())
+CLIENT_PORT = 8001
+INTER_SERVER_PORT = 9001
+PEERS = [('localhost', 9002)]  # inter-server addresses of every other node
+
+chat_metrics = service_metrics('chat')  # messages from local clients
+peer_metrics = service_metrics('peer')  # messages relayed from other nodes
 
 def broadcast_to_clients(message):
-    """Send message to all connected clients"""
+    """Send message to all connected clients; returns the bytes sent"""
+    data = message.encode()
+    frame = encode_frame(data)
+    sent = 0
     for client in clients[:]:
         try:
-            client.send(message.encode())
+            out = frame if client in framed_clients else data
+            client.sendall(out)
+            sent += len(out)
         except:
-            clients.remove(client)
+            try:
+                clients.remove(client)
+            except ValueError:
+                pass
+    return sent
 
 def handle_client(client_socket):
     """Handle individual client messages"""
-    while True:
-        try:
-            message = client_socket.recv(1024).decode()
-            if not message:
-                break
+    chat_metrics.opened()
+    try:
+        # Framed clients open with the framing hello; legacy ones start chatting
+        framed, data = read_hello(client_socket)
+        if framed:
+            framed_clients.add(client_socket)
+        # only now may broadcasts reach it, in the format it negotiated
+        clients.append(client_socket)
+        for data in iter_messages(client_socket, framed, data):
+            started = now()
+            message = data.decode()
                 
-            print(f"[SERVER {server_id}] Received: {message}")
+            log.sampled('received', "[SERVER %d] Received: %s", server_id, message)
             
             # Broadcast to local clients
-            broadcast_to_clients(f"[SERVER {server_id}] {message}")
+            sent = broadcast_to_clients(f"[SERVER {server_id}] {message}")
             
-            # Forward to peer server
-            if peer_socket:
-                try:
-                    peer_socket.send(f"[SERVER {server_id}] {message}".encode())
-                except:
-                    print(f"[SERVER {server_id}] Failed to forward to peer")
-                    
-        except:
-            break
+            # Forward to every peer server
+            federation.publish(f"[SERVER {server_id}] {message}")
+            chat_metrics.observe(started, len(data), sent)
+    except:
+        pass
     
-    clients.remove(client_socket)
+    chat_metrics.closed()
+    if client_socket in clients:
+        clients.remove(client_socket)
+    framed_clients.discard(client_socket)
     client_socket.close()
 
-def handle_peer_messages():
-    """Handle messages from peer server"""
-    global peer_socket
-    while True:
-        try:
-            message = peer_socket.recv(1024).decode()
-            if not message:
-                break
-            print(f"[SERVER {server_id}] From peer: {message}")
-            broadcast_to_clients(message)
-        except:
-            print(f"[SERVER {server_id}] Peer connection lost")
-            break
-
-def connect_to_peer():
-    """Connect to peer server"""
-    global peer_socket
-    while True:
-        try:
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect(('localhost', PEER_PORT))
-            print(f"[SERVER {server_id}] Connected to peer server")
-            
-            # Start listening for peer messages
-            peer_thread = threading.Thread(target=handle_peer_messages)
-            peer_thread.daemon = True
-            peer_thread.start()
-            break
-        except:
-            peer_socket = None
-            threading.Event().wait(2)  # Wait 2 seconds before retry
-
-def start_inter_server():
-    """Start inter-server communication listener"""
-    inter_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    inter_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    inter_socket.bind(('localhost', INTER_SERVER_PORT))
-    inter_socket.listen(1)
-    print(f"[SERVER {server_id}] Inter-server listening on port {INTER_SERVER_PORT}")
-    
-    while True:
-        try:
-            peer_conn, addr = inter_socket.accept()
-            print(f"[SERVER {server_id}] Peer server connected from {addr}")
-            
-            # Handle incoming peer messages
-            def handle_incoming_peer():
-                global peer_socket
-                peer_socket = peer_conn
-                handle_peer_messages()
-            
-            peer_thread = threading.Thread(target=handle_incoming_peer)
-            peer_thread.daemon = True
-            peer_thread.start()
-            
-        except Exception as e:
-            print(f"[SERVER {server_id}] Inter-server error: {e}")
+def handle_peer_message(message, origin):
+    """Deliver a message published by another node"""
+    started = now()
+    log.sampled('from peer', "[SERVER %d] From peer: %s", server_id, message)
+    sent = broadcast_to_clients(message)
+    peer_metrics.observe(started, len(message), sent)
 
 def main():
+    global server_id, CLIENT_PORT, INTER_SERVER_PORT, PEERS, federation
+    parser = argparse.ArgumentParser(description="Chat server node in a mesh of peer servers.")
+    parser.add_argument('server_id', type=int, nargs='?', default=1)
+    parser.add_argument('--port', type=int, help="client port (default: 8000 + server_id)")
+    parser.add_argument('--inter-port', type=int, help="inter-server port (default: 9000 + server_id)")
+    parser.add_argument('--peers', help="comma-separated inter-server addresses of the other nodes, "
+                                        "e.g. 9002,otherhost:9003 (default: servers 1 and 2 pair up)")
+    parser.add_argument('--relay', action='store_true',
+                        help="re-send peer messages to the other peers (only needed for a partial mesh)")
+    add_metrics_arguments(parser)
+    log.add_log_arguments(parser)
+    args = parser.parse_args()
+    log.configure_from_args(args)
+    
+    server_id = args.server_id
+    CLIENT_PORT = args.port or 8000 + server_id
+    INTER_SERVER_PORT = args.inter_port or 9000 + server_id
+    if args.peers is not None:
+        PEERS = parse_peers(args.peers)
+    else:
+        PEERS = [('localhost', 9002 if server_id == 1 else 9001)]
+    
     print(f"Starting Server {server_id}")
     print(f"Client port: {CLIENT_PORT}")
     print(f"Inter-server port: {INTER_SERVER_PORT}")
+    print(f"Peers: {', '.join(f'{host}:{port}' for host, port in PEERS) or 'none'}")
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
     
-    # Start inter-server listener
-    inter_thread = threading.Thread(target=start_inter_server)
-    inter_thread.daemon = True
-    inter_thread.start()
-    
-    # Connect to peer server (with delay for server 2)
-    if server_id == 2:
-        threading.Event().wait(1)  # Wait for server 1 to start
-    
-    peer_thread = threading.Thread(target=connect_to_peer)
-    peer_thread.daemon = True
-    peer_thread.start()
+    # Start inter-server listener and the links to every peer (they retry until peers are up)
+    federation = Federation(f"server-{server_id}", PEERS, handle_peer_message,
+                            relay=args.relay, label=f"SERVER {server_id}")
+    federation.serve('localhost', INTER_SERVER_PORT)
+    print(f"[SERVER {server_id}] Inter-server listening on port {INTER_SERVER_PORT}")
+    federation.start()
     
     # Start client server
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -132,8 +122,7 @@ def main():
     while True:
         try:
             client_socket, addr = server_socket.accept()
-            clients.append(client_socket)
-            print(f"[SERVER {server_id}] Client connected from {addr}")
+            log.info("[SERVER %d] Client connected from %s", server_id, addr)
             
             # Start client handler thread
             client_thread = threading.Thread(target=handle_client, args=(client_socket,))
@@ -141,10 +130,11 @@ def main():
             client_thread.start()
             
         except KeyboardInterrupt:
+            log.flush()
             print(f"\n[SERVER {server_id}] Shutting down...")
             break
         except Exception as e:
-            print(f"[SERVER {server_id}] Error: {e}")
+            log.error("[SERVER %d] Error: %s", server_id, e)
 
 if __name__ == "__main__":
     main()
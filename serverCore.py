@@ -0,0 +1,712 @@
+#!/usr/bin/env python3
+# server_core.py
+"""
+Shared TCP server core for the line-protocol servers
+(calc, pwd, weather and echo).
+
+Instead of one unbounded daemon thread per accept(), connections are handed
+to a fixed pool of worker threads through a bounded queue:
+  - at most `workers` connections are served at once
+  - up to `queue_limit` more wait for a free worker
+  - beyond that (or after waiting longer than `max_wait` seconds) a
+    connection gets `busy_message` and is closed straight away
+  - a connection that sends nothing for `idle_timeout` seconds is closed,
+    so idle keep-alive clients can't hold every worker
+stats() reports queue depth, utilization and accept/reject counters.
+
+SelectorServer is the alternative single-threaded engine (--engine selector):
+one thread multiplexes every non-blocking connection with the selectors
+module, so thousands of mostly idle connections cost no threads. It drives
+the same protocol through per-connection session objects (see LineSession).
+
+Either engine can be run as a prefork group (--processes N, see Prefork):
+N worker processes accept on the same port, so CPU-bound request handling
+isn't held to one core by the GIL.
+
+--metrics-port serves request counts, bytes and latency histograms for
+Prometheus (see metrics.py), along with stats(). Connection and error
+logs go through serverLog, which writes them from a background thread
+(--log-level, --log-file, --log-rate).
+"""
+import json
+import os
+import queue
+import select
+import selectors
+import signal
+import socket
+import threading
+import time
+
+import serverLog as log
+from metrics import add_metrics_arguments, merge, now, render, serve_metrics, snapshot
+
+DEFAULT_WORKERS = 64
+DEFAULT_QUEUE_LIMIT = 256
+DEFAULT_BACKLOG = 128
+DEFAULT_MAX_WAIT = 10.0      # seconds a connection may wait for a worker
+DEFAULT_IDLE_TIMEOUT = 60.0  # seconds a worker waits on a silent client
+DEFAULT_MAX_CONNECTIONS = 10000
+RECV_SIZE = 65536
+MAX_PENDING_OUTPUT = 1 << 20  # stop reading from a client this far behind on replies
+
+def raise_fd_limit():
+    """Lift the soft open-file limit to the hard limit so one process can hold 10k+ sockets."""
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+def make_listener(host, port, backlog, reuse_port=False):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((host, port))
+    s.listen(backlog)
+    return s
+
+def add_pool_arguments(parser):
+    """Add the worker pool options shared by every server's command line."""
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"connections served at once (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--queue-limit', type=int, default=DEFAULT_QUEUE_LIMIT,
+                        help=f"connections waiting for a worker before new ones are turned away (default: {DEFAULT_QUEUE_LIMIT})")
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT,
+                        help=f"turn away connections that waited this many seconds for a worker, "
+                             f"0 = no limit (default: {DEFAULT_MAX_WAIT:g})")
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f"threads engine: close connections idle this many seconds, "
+                             f"0 = never (default: {DEFAULT_IDLE_TIMEOUT:g})")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help=f"listen() backlog (default: {DEFAULT_BACKLOG})")
+    parser.add_argument('--stats-interval', type=float, default=0,
+                        help="print pool stats every N seconds, 0 = never (default: 0)")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="worker processes sharing the port, restarted if they crash (default: 1)")
+    add_metrics_arguments(parser)
+    log.add_log_arguments(parser)
+
+def add_engine_arguments(parser):
+    """Add the --engine choice, for servers that also run on SelectorServer."""
+    parser.add_argument('--engine', choices=('threads', 'selector'), default='threads',
+                        help="threads: worker pool, one thread per connection; "
+                             "selector: one thread for all connections (default: threads)")
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help=f"selector engine: open connections before new ones are turned away (default: {DEFAULT_MAX_CONNECTIONS})")
+
+class StatsSources:
+    """Lets a service add its own counters (e.g. cache hits) to a server's stats()."""
+    stats_sources = ()
+
+    def add_stats_source(self, source):
+        """source() returns a dict of numbers to merge into stats()."""
+        self.stats_sources = list(self.stats_sources) + [source]
+
+    def extra_stats(self):
+        extra = {}
+        for source in self.stats_sources:
+            extra.update(source())
+        return extra
+
+    def format_extra(self):
+        return ''.join(f", {key} {value}" for key, value in self.extra_stats().items())
+
+class WorkerPoolServer(StatsSources):
+    """
+    Accepts connections on host:port and runs handler(conn, addr) for each
+    on a bounded pool of worker threads. The handler owns the connection;
+    it is closed after the handler returns in any case.
+    """
+    def __init__(self, name, host, port, handler, workers=DEFAULT_WORKERS,
+                 queue_limit=DEFAULT_QUEUE_LIMIT, max_wait=DEFAULT_MAX_WAIT, backlog=DEFAULT_BACKLOG,
+                 busy_message=b"Error: server busy, try again later.\n", stats_interval=0,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_limit))
+        self.max_wait = max_wait or None       # 0 means no limit
+        self.idle_timeout = idle_timeout or None
+        self.backlog = backlog
+        self.busy_message = busy_message
+        self.stats_interval = stats_interval
+        self.lock = threading.Lock()
+        self.active = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.busy_time = 0.0  # worker-seconds spent serving connections
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_args(cls, name, host, port, handler, args, **kwargs):
+        """Build a server from the options added by add_pool_arguments()."""
+        return cls(name, host, port, handler, workers=args.workers, queue_limit=args.queue_limit,
+                   max_wait=args.max_wait, backlog=args.backlog,
+                   stats_interval=args.stats_interval, idle_timeout=args.idle_timeout, **kwargs)
+
+    def stats(self):
+        """Snapshot of the pool counters."""
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            stats = {
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self.queue.qsize(),
+                'queue_limit': self.queue.maxsize,
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'utilization': self.active / self.workers,
+                'avg_utilization': self.busy_time / (self.workers * uptime) if uptime > 0 else 0.0,
+            }
+        stats.update(self.extra_stats())
+        return stats
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"[{self.name}] active {s['active']}/{s['workers']} ({100 * s['utilization']:.0f}%), "
+                f"queued {s['queued']}/{s['queue_limit']}, accepted {s['accepted']}, "
+                f"rejected {s['rejected']}, completed {s['completed']}, "
+                f"avg utilization {100 * s['avg_utilization']:.1f}%{self.format_extra()}")
+
+    def reject(self, conn):
+        with self.lock:
+            self.rejected += 1
+        try:
+            conn.setblocking(False)  # never let a slow client stall the accept loop
+            conn.send(self.busy_message)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def worker(self):
+        while True:
+            conn, addr, queued_at = self.queue.get()
+            if self.max_wait is not None and time.monotonic() - queued_at > self.max_wait:
+                self.reject(conn)
+                continue
+            start = time.monotonic()
+            with self.lock:
+                self.active += 1
+            try:
+                conn.settimeout(self.idle_timeout)  # a silent client times out instead of keeping the worker
+                self.handler(conn, addr)
+            except Exception as e:
+                log.error("[!] Unhandled error with %s: %s", addr, e)
+            finally:
+                conn.close()
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+                    self.busy_time += time.monotonic() - start
+
+    def expire_waiting(self):
+        """Turn away connections queued longer than max_wait, even while every worker is busy."""
+        q = self.queue
+        while True:
+            time.sleep(min(1.0, self.max_wait))
+            expired = []
+            with q.mutex:
+                while q.queue and time.monotonic() - q.queue[0][2] > self.max_wait:
+                    expired.append(q.queue.popleft())
+                if expired:
+                    q.not_full.notify(len(expired))
+            for conn, _, _ in expired:
+                self.reject(conn)
+
+    def report_stats(self):
+        while True:
+            time.sleep(self.stats_interval)
+            print(self.format_stats())
+
+    def serve_forever(self, listener=None):
+        print(f"Starting {self.name} on {self.host}:{self.port} "
+              f"({self.workers} workers, queue limit {self.queue.maxsize})")
+        for _ in range(self.workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+        if self.max_wait is not None:
+            threading.Thread(target=self.expire_waiting, daemon=True).start()
+        if self.stats_interval > 0:
+            threading.Thread(target=self.report_stats, daemon=True).start()
+        with listener or make_listener(self.host, self.port, self.backlog) as s:
+            try:
+                while True:
+                    conn, addr = s.accept()
+                    try:
+                        self.queue.put_nowait((conn, addr, time.monotonic()))
+                    except queue.Full:
+                        self.reject(conn)
+                        continue
+                    with self.lock:
+                        self.accepted += 1
+            except KeyboardInterrupt:
+                log.flush()
+                print("\nServer shutting down...")
+                print(self.format_stats())
+
+class LineSession:
+    """
+    Per-connection protocol state for SelectorServer.
+    Splits the incoming byte stream into lines across partial reads and
+    passes each one to handle_line(), which subclasses implement:
+        handle_line(line) -> (response str or None, close after it?)
+    The line has its '\n' removed and nothing else.
+    Subclasses that set metrics (a metrics.ServiceMetrics) have each line
+    handled through handle() timed and counted in it, and opened()/closed()
+    counted as connections.
+    """
+    encoding = 'utf-8'
+    metrics = None
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.pending = b''
+
+    def handle_line(self, line):
+        raise NotImplementedError
+
+    def handle(self, line):
+        """handle_line(), recorded in metrics. Bytes are counted as characters."""
+        if self.metrics is None:
+            return self.handle_line(line)
+        started = now()
+        response, close = self.handle_line(line)
+        self.metrics.observe(started, len(line) + 1, len(response) if response else 0)
+        return response, close
+
+    def run_lines(self, lines):
+        out = []
+        for raw in lines:
+            response, close = self.handle(raw.decode(self.encoding, 'replace'))
+            if response is not None:
+                out.append(response)
+            if close:
+                return ''.join(out).encode(self.encoding), True
+        return ''.join(out).encode(self.encoding), False
+
+    def feed(self, data):
+        """Handle received bytes. Returns (bytes to send, close after sending?)."""
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        return self.run_lines(lines)
+
+    def feed_eof(self):
+        """The client closed its side: handle a last line it didn't terminate."""
+        lines = [self.pending] if self.pending else []
+        self.pending = b''
+        return self.run_lines(lines)
+
+    def opened(self):
+        if self.metrics is not None:
+            self.metrics.opened()
+
+    def closed(self):
+        if self.metrics is not None:
+            self.metrics.closed()
+
+def serve_session(conn, session):
+    """
+    Threads engine: run a LineSession over one blocking connection, one
+    write per read. Lines are split and decoded by the session itself, so a
+    protocol behaves the same here as on SelectorServer.
+    """
+    session.opened()
+    try:
+        with conn:
+            while True:
+                data = conn.recv(RECV_SIZE)
+                out, close = session.feed(data) if data else session.feed_eof()
+                if out:
+                    conn.sendall(out)
+                if close or not data:
+                    break
+    except Exception as e:
+        log.warning("[!] Error with client %s: %s", session.addr, e)
+    finally:
+        session.closed()
+
+class Connection:
+    __slots__ = ('sock', 'addr', 'session', 'outbuf', 'closing', 'events')
+
+    def __init__(self, sock, addr, session):
+        self.sock = sock
+        self.addr = addr
+        self.session = session
+        self.outbuf = bytearray()
+        self.closing = False
+        self.events = selectors.EVENT_READ
+
+class SelectorServer(StatsSources):
+    """
+    Single-threaded engine: accepts on host:port and serves every connection
+    from one selectors loop. session_factory(addr) returns a session with
+    feed(data), feed_eof(), opened() and closed() (see LineSession).
+    Replies that can't be sent at once are buffered and flushed when the
+    socket becomes writable.
+    """
+    def __init__(self, name, host, port, session_factory, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 backlog=DEFAULT_BACKLOG, busy_message=b"Error: server busy, try again later.\n",
+                 stats_interval=0):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.session_factory = session_factory
+        self.max_connections = max_connections
+        self.backlog = backlog
+        self.busy_message = busy_message
+        self.stats_interval = stats_interval
+        self.selector = selectors.DefaultSelector()
+        self.connections = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+
+    @classmethod
+    def from_args(cls, name, host, port, session_factory, args, **kwargs):
+        """Build a server from the options added by add_pool_arguments() and add_engine_arguments()."""
+        return cls(name, host, port, session_factory, max_connections=args.max_connections,
+                   backlog=args.backlog, stats_interval=args.stats_interval, **kwargs)
+
+    def stats(self):
+        return {
+            'connections': self.connections,
+            'max_connections': self.max_connections,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'utilization': self.connections / self.max_connections,
+            **self.extra_stats(),
+        }
+
+    def format_stats(self):
+        s = self.stats()
+        return (f"[{self.name}] connections {s['connections']}/{s['max_connections']}, "
+                f"accepted {s['accepted']}, rejected {s['rejected']}, completed {s['completed']}"
+                f"{self.format_extra()}")
+
+    def accept(self, listener):
+        # drain the accept queue; the listener is non-blocking
+        while True:
+            try:
+                sock, addr = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:  # e.g. out of file descriptors; try again on the next event
+                log.sampled('accept', "[!] accept() failed: %s", e, lvl=log.WARNING)
+                return
+            sock.setblocking(False)
+            if self.connections >= self.max_connections:
+                self.rejected += 1
+                try:
+                    sock.send(self.busy_message)
+                except OSError:
+                    pass
+                sock.close()
+                continue
+            self.accepted += 1
+            self.connections += 1
+            conn = Connection(sock, addr, self.session_factory(addr))
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            conn.session.opened()
+
+    def close(self, conn):
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        self.connections -= 1
+        self.completed += 1
+        conn.session.closed()
+
+    def update_events(self, conn):
+        events = 0
+        if not conn.closing and len(conn.outbuf) < MAX_PENDING_OUTPUT:
+            events |= selectors.EVENT_READ
+        if conn.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+
+    def flush(self, conn):
+        """Send as much buffered output as the socket takes. Returns False if conn was closed."""
+        if conn.outbuf:
+            try:
+                sent = conn.sock.send(conn.outbuf)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError:
+                self.close(conn)
+                return False
+            del conn.outbuf[:sent]
+        if conn.closing and not conn.outbuf:
+            self.close(conn)
+            return False
+        self.update_events(conn)
+        return True
+
+    def read(self, conn):
+        try:
+            data = conn.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        try:
+            if data:
+                out, close = conn.session.feed(data)
+            else:
+                out, close = conn.session.feed_eof()
+                close = True
+        except Exception as e:
+            # one broken session must not take the other connections down with it
+            log.error("[!] Unhandled error with %s: %s", conn.addr, e)
+            self.close(conn)
+            return
+        conn.outbuf += out
+        conn.closing = conn.closing or close
+        self.flush(conn)
+
+    def serve_forever(self, listener=None):
+        raise_fd_limit()
+        print(f"Starting {self.name} on {self.host}:{self.port} (selector engine, "
+              f"max {self.max_connections} connections)")
+        with listener or make_listener(self.host, self.port, self.backlog) as s:
+            s.setblocking(False)
+            self.selector.register(s, selectors.EVENT_READ, None)
+            next_report = time.monotonic() + self.stats_interval
+            timeout = self.stats_interval if self.stats_interval > 0 else None
+            try:
+                while True:
+                    for key, events in self.selector.select(timeout):
+                        conn = key.data
+                        if conn is None:
+                            self.accept(s)
+                            continue
+                        if events & selectors.EVENT_WRITE and not self.flush(conn):
+                            continue
+                        if events & selectors.EVENT_READ:
+                            self.read(conn)
+                    if timeout and time.monotonic() >= next_report:
+                        print(self.format_stats())
+                        next_report = time.monotonic() + self.stats_interval
+            except KeyboardInterrupt:
+                log.flush()
+                print("\nServer shutting down...")
+                print(self.format_stats())
+
+STATS_REPORT_INTERVAL = 1.0  # seconds between a prefork worker's stats reports
+RESTART_MIN = 0.5            # backoff for workers that keep crashing straight away
+RESTART_MAX = 30.0
+COUNTERS = ('accepted', 'rejected', 'completed')  # kept from workers that exit
+
+class Prefork:
+    """
+    Supervisor for N forked copies of a server. Workers bind the same port
+    with SO_REUSEPORT where the OS has it (the kernel spreads connections
+    across them) and otherwise share a listening socket inherited from the
+    supervisor. A worker that dies is restarted, with backoff if it keeps
+    dying at once. Each worker sends its stats() to the supervisor over a
+    pipe once a second; the supervisor prints the totals. With metrics_port
+    the workers send their metrics too, and the supervisor serves the sum.
+    """
+    def __init__(self, server, processes, metrics_port=None):
+        self.server = server
+        self.processes = processes
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.stats_interval = server.stats_interval
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        self.shared = None
+        self.workers = {}    # pid -> (slot, stats pipe fd, start time)
+        self.buffers = {}    # stats pipe fd -> partial line
+        self.latest = {}     # slot -> last stats received
+        self.retired = dict.fromkeys(COUNTERS, 0)
+        self.metrics = {}    # slot -> last metrics snapshot received
+        self.retired_metrics = {}
+        self.delays = [RESTART_MIN] * processes
+        self.restarts = {}   # slot -> time it's due to be started again
+        self.stopping = False
+
+    def spawn(self, slot):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self.run_worker(slot, write_fd)  # never returns
+        os.close(write_fd)
+        self.workers[pid] = (slot, read_fd, time.monotonic())
+        self.buffers[read_fd] = b''
+
+    def run_worker(self, slot, stats_fd):
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            for _, fd, _ in self.workers.values():
+                os.close(fd)
+            if self.metrics_server is not None:
+                self.metrics_server.socket.close()
+            server = self.server
+            server.name = f"{server.name} #{slot}"
+            server.stats_interval = 0  # the supervisor reports for everyone
+            out = os.fdopen(stats_fd, 'w', buffering=1)
+
+            def report():
+                while True:
+                    time.sleep(STATS_REPORT_INTERVAL)
+                    report = {'stats': server.stats()}
+                    if self.metrics_port:
+                        report['metrics'] = snapshot()
+                    out.write(json.dumps(report) + '\n')
+
+            threading.Thread(target=report, daemon=True).start()
+            if self.shared is not None:
+                listener = self.shared
+            else:
+                listener = make_listener(server.host, server.port, server.backlog, reuse_port=True)
+            server.serve_forever(listener)
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            log.error("[!] Worker #%d failed: %s", slot, e)
+            code = 1
+        finally:
+            log.flush()  # os._exit() skips the atexit flush
+            os._exit(code)
+
+    def read_stats(self, timeout):
+        fds = list(self.buffers)
+        if not fds:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select(fds, [], [], timeout)
+        slots = {fd: slot for slot, fd, _ in self.workers.values()}
+        for fd in readable:
+            data = os.read(fd, 65536)
+            lines = (self.buffers[fd] + data).split(b'\n')
+            self.buffers[fd] = lines.pop()
+            if lines and fd in slots:
+                try:
+                    report = json.loads(lines[-1])
+                except ValueError:
+                    continue
+                self.latest[slots[fd]] = report['stats']
+                if 'metrics' in report:
+                    self.metrics[slots[fd]] = report['metrics']
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot, fd, started = self.workers.pop(pid)
+            os.close(fd)
+            del self.buffers[fd]
+            last = self.latest.pop(slot, None)
+            if last:
+                for key in COUNTERS:
+                    self.retired[key] += last.get(key, 0)
+            last = self.metrics.pop(slot, None)
+            if last:
+                self.retired_metrics = merge([self.retired_metrics, last])
+            if self.stopping:
+                continue
+            # back off if it died right after starting, e.g. the port is taken
+            if time.monotonic() - started < 1.0:
+                delay = self.delays[slot]
+                self.delays[slot] = min(delay * 2, RESTART_MAX)
+            else:
+                delay = self.delays[slot] = RESTART_MIN
+            code = os.waitstatus_to_exitcode(status)
+            reason = f"was killed by signal {-code}" if code < 0 else f"exited with code {code}"
+            log.warning("[!] Worker #%d (pid %d) %s, restarting in %.1fs", slot, pid, reason, delay)
+            self.restarts[slot] = time.monotonic() + delay
+
+    def stats(self):
+        """Totals over all workers (utilization is averaged)."""
+        total = dict(self.retired)
+        for stats in list(self.latest.values()):  # also called from the metrics thread
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        alive = max(1, len(self.latest))
+        for key in ('utilization', 'avg_utilization'):
+            if key in total:
+                total[key] /= alive
+        total['processes'] = len(self.workers)
+        return total
+
+    def format_stats(self):
+        s = self.stats()
+        return f"[{self.server.name}] {s['processes']} processes, " + ', '.join(
+            f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+            for key, value in s.items() if key != 'processes')
+
+    def collect_metrics(self):
+        services = merge([self.retired_metrics, *list(self.metrics.values())])
+        return render(services, {self.server.name: self.stats()}, COUNTERS)
+
+    def terminate(self, signum, frame):
+        raise SystemExit(0)
+
+    def run(self):
+        server = self.server
+        if not self.reuse_port:
+            self.shared = make_listener(server.host, server.port, server.backlog)
+        print(f"Starting {self.processes} worker processes for {server.name} on {server.host}:{server.port} "
+              f"({'SO_REUSEPORT' if self.reuse_port else 'shared listening socket'})")
+        if self.metrics_port:
+            self.metrics_server = serve_metrics(self.metrics_port, self.collect_metrics)
+        signal.signal(signal.SIGTERM, self.terminate)
+        next_report = time.monotonic() + self.stats_interval
+        try:
+            for slot in range(self.processes):
+                self.spawn(slot)
+            while True:
+                self.read_stats(0.5)
+                self.reap()
+                now = time.monotonic()
+                for slot, due in list(self.restarts.items()):
+                    if now >= due:
+                        del self.restarts[slot]
+                        self.spawn(slot)
+                if self.stats_interval > 0 and now >= next_report:
+                    print(self.format_stats())
+                    next_report = now + self.stats_interval
+        except (KeyboardInterrupt, SystemExit):
+            print("\nStopping worker processes...")
+        finally:
+            self.stopping = True
+            for pid in self.workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            deadline = time.monotonic() + 5
+            while self.workers and time.monotonic() < deadline:
+                self.read_stats(0.1)
+                self.reap()
+            print(self.format_stats())
+
+def serve(server, args):
+    """Run server in this process, or as a prefork group if --processes asks for one."""
+    log.configure_from_args(args)
+    if args.processes > 1 and hasattr(os, 'fork'):
+        Prefork(server, args.processes, args.metrics_port).run()
+    else:
+        if args.processes > 1:
+            print("[!] --processes needs os.fork(); running a single process")
+        if args.metrics_port:
+            serve_metrics(args.metrics_port, lambda: render(snapshot(), {server.name: server.stats()}, COUNTERS))
+        server.serve_forever()
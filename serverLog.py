@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# server_log.py
+"""
+Asynchronous logging for the servers' per-connection and per-message logs.
+
+    import serverLog as log
+    log.info("[+] Client connected: %s", addr)
+    log.sampled('echo', "[%s] Received: %s", addr, message)
+
+A call checks the level and appends (time, level, format, args) to a queue;
+that's all a request handler pays. A background writer wakes every
+FLUSH_INTERVAL seconds, formats everything queued and writes it with one
+write() and one flush(), so threads never serialize on stdout or a file.
+If the writer falls MAX_PENDING records behind, new records are dropped and
+counted rather than letting memory grow; the count is logged.
+
+sampled() is for logs that can fire on every message: each kind (its first
+argument) gets at most --log-rate lines per second, and the writer notes
+how many it left out.
+
+Startup banners and stats reports still print() directly; they are rare,
+and they keep their place before the first log line.
+
+Command line (see add_log_arguments):
+    --log-level debug|info|warning|error   (default: info)
+    --log-file FILE                        append here instead of stdout
+    --log-rate N                           sampled() lines per second per kind,
+                                           0 = none (default: 20)
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARN', ERROR: 'ERROR'}
+
+FLUSH_INTERVAL = 0.1   # seconds between the writer's batches
+MAX_PENDING = 100000   # records queued before new ones are dropped
+DEFAULT_RATE = 20      # sampled() lines per second per kind
+
+level = INFO
+rate = DEFAULT_RATE
+pending = deque()      # (time, level, format, args); appended from any thread
+dropped = 0            # records lost to a full queue (counted without a lock; close enough)
+limits = {}            # kind -> [second, lines logged in it, lines left out]
+
+class LogWriter:
+    """Drains the queue in batches, on its own thread, into a file or stdout."""
+    def __init__(self):
+        self.path = None
+        self.file = None
+        self.lock = threading.Lock()  # the writer thread and flush() callers
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def set_path(self, path):
+        """Write to path (appending), or to stdout if it's None."""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            self.path = path
+            self.file = open(path, 'ab', buffering=0) if path else None
+
+    def run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.write_pending()
+
+    def write_pending(self):
+        global dropped
+        with self.lock:
+            lines = []
+            while pending:
+                when, lvl, fmt, args = pending.popleft()
+                lines.append(format_record(when, lvl, fmt, args))
+            if dropped:
+                lost, dropped = dropped, 0
+                lines.append(format_record(time.time(), WARNING, "[!] Log queue full, dropped %d records", (lost,)))
+            lines += report_suppressed(int(time.monotonic()))
+            if not lines:
+                return
+            text = ''.join(lines)
+            try:
+                if self.file is not None:
+                    # one write() per batch keeps lines whole when prefork workers share the file
+                    self.file.write(text.encode('utf-8', 'replace'))
+                else:
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+            except (OSError, ValueError):
+                pass  # nowhere left to report it
+
+def format_record(when, lvl, fmt, args):
+    try:
+        message = fmt % args if args else fmt
+    except (TypeError, ValueError):
+        message = f"{fmt} {args!r}"
+    stamp = time.strftime('%H:%M:%S', time.localtime(when))
+    return f"{stamp}.{int(when % 1 * 1000):03d} {LEVEL_NAMES[lvl]:5} {message}\n"
+
+def report_suppressed(second):
+    """Notes for the sampled() kinds that left lines out in a second that is over."""
+    lines = []
+    for kind, limit in list(limits.items()):
+        if limit[2] and limit[0] < second:
+            lines.append(format_record(time.time(), INFO, "[*] %s: %d more lines not logged (--log-rate %d)",
+                                       (kind, limit[2], rate)))
+            limit[2] = 0
+    return lines
+
+writer = LogWriter()
+
+def emit(lvl, fmt, args):
+    global dropped
+    if len(pending) >= MAX_PENDING:
+        dropped += 1
+        return
+    pending.append((time.time(), lvl, fmt, args))
+
+def debug(fmt, *args):
+    if level <= DEBUG:
+        emit(DEBUG, fmt, args)
+
+def info(fmt, *args):
+    if level <= INFO:
+        emit(INFO, fmt, args)
+
+def warning(fmt, *args):
+    if level <= WARNING:
+        emit(WARNING, fmt, args)
+
+def error(fmt, *args):
+    if level <= ERROR:
+        emit(ERROR, fmt, args)
+
+def sampled(kind, fmt, *args, lvl=INFO):
+    """Log at most --log-rate lines per second of one kind of per-message log."""
+    if level > lvl or not rate:
+        return
+    second = int(time.monotonic())
+    limit = limits.get(kind)
+    if limit is None or limit[0] != second:
+        if limit is None:
+            limit = limits[kind] = [second, 0, 0]
+        limit[0] = second
+        limit[1] = 0
+    if limit[1] < rate:
+        limit[1] += 1
+        emit(lvl, fmt, args)
+    else:
+        limit[2] += 1
+
+def flush():
+    """Write out everything queued so far, from the calling thread."""
+    writer.write_pending()
+
+def configure(log_level='info', path=None, log_rate=DEFAULT_RATE):
+    """Set the level, destination and sampling rate. Call once, at startup."""
+    global level, rate
+    level = LEVELS[log_level]
+    rate = max(0, log_rate)
+    if path != writer.path:
+        flush()
+        writer.set_path(path)
+
+def add_log_arguments(parser):
+    parser.add_argument('--log-level', choices=list(LEVELS), default='info',
+                        help="least important log lines written (default: info)")
+    parser.add_argument('--log-file', help="append log lines to this file (default: stdout)")
+    parser.add_argument('--log-rate', type=int, default=DEFAULT_RATE,
+                        help=f"per-message log lines per second of each kind, 0 = none (default: {DEFAULT_RATE})")
+
+def configure_from_args(args):
+    configure(args.log_level, args.log_file, args.log_rate)
+
+def restart_in_child():
+    # a forked process has the queue but not the writer thread; records
+    # queued before the fork are the parent's to write
+    pending.clear()
+    writer.lock = threading.Lock()
+    writer.start()
+
+writer.start()
+atexit.register(flush)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_in_child)
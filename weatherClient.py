@@ -5,19 +5,22 @@ Interactive client for the weather server.
 
 Usage:
     python3 weather_client.py [host] [port]
+    python3 weather_client.py [host] [port] --cities london,tokyo,...
+    python3 weather_client.py [host] [port] --subscribe london,tokyo,...
 
 Defaults: host=localhost port=5500
+
+At the prompt, several cities separated by commas are fetched with one
+MULTI request, and "subscribe city,city,..." streams the server's updates
+until Ctrl-C.
 """
-import socket
-import sys
+import argparse
 import json
 
+from lineClient import LineClient, ServiceError
+
 HOST = 'localhost'
 PORT = 5500
-if len(sys.argv) >= 2:
-    HOST = sys.argv[1]
-if len(sys.argv) >= 3:
-    PORT = int(sys.argv[2])
 
 def format_report(resp):
     """Pretty print the JSON response from server."""
@@ -37,26 +40,58 @@ def format_report(resp):
         return '\n'.join(lines)
     elif status == 'bye':
         return resp.get('message', 'Goodbye from server.')
+    elif status == 'subscribed':
+        return f"Subscribed to {', '.join(resp.get('cities', []))}, updates every {resp.get('interval')} s."
+    elif status == 'unsubscribed':
+        return "Unsubscribed."
     else:
         return "Error from server: " + resp.get('message', 'Unknown error')
 
+def format_response(resp):
+    """Pretty print a response line: one report, or a MULTI/SUBSCRIBE array of them."""
+    if isinstance(resp, list):
+        return '\n'.join(format_report(r) for r in resp)
+    return format_report(resp)
+
+def stream_updates(client, cities):
+    """SUBSCRIBE to cities and print every update until Ctrl-C."""
+    updates = client.subscribe(cities)
+    try:
+        print(f"Subscribed to {', '.join(cities)}; Ctrl-C to stop.")
+        for update in updates:
+            print(format_response(update))
+            print()
+    except KeyboardInterrupt:
+        pass
+    except ServiceError as e:
+        print("Error from server:", e)
+    finally:
+        updates.close()  # closing its connection ends the subscription
+    print("Unsubscribed.")
+
 def run_client(host, port):
     try:
-        with socket.create_connection((host, port)) as sock:
+        with LineClient(host, port, pool_size=1) as client:
+            client.connect()
             print(f"Connected to weather server at {host}:{port}")
-            reader = sock.makefile('r')
             while True:
                 try:
-                    city = input("Enter city (or 'quit' to exit): ").strip()
+                    city = input("Enter city, city,city,... or 'subscribe city,...' ('quit' to exit): ").strip()
                 except (KeyboardInterrupt, EOFError):
                     print("\nExiting client.")
                     break
                 if not city:
                     continue
-                sock.sendall((city + '\n').encode('utf-8'))
+                command, _, rest = city.partition(' ')
+                if command.lower() == 'subscribe':
+                    stream_updates(client, parse_cities(rest))
+                    continue
+                if ',' in city:
+                    city = 'MULTI ' + city
                 # read one JSON response line
-                line = reader.readline()
-                if not line:
+                try:
+                    line = client.request(city)
+                except ConnectionError:
                     print("Server closed connection.")
                     break
                 try:
@@ -64,7 +99,7 @@ def run_client(host, port):
                 except Exception:
                     print("Received malformed response:", line)
                     continue
-                print(format_report(resp))
+                print(format_response(resp))
                 if city.lower() in ('quit', 'exit'):
                     break
     except ConnectionRefusedError:
@@ -72,5 +107,34 @@ def run_client(host, port):
     except Exception as e:
         print("Client error:", e)
 
+def run_once(host, port, cities, subscribe):
+    """Non-interactive: fetch (or subscribe to) a list of cities and print the reports."""
+    try:
+        with LineClient(host, port) as client:
+            if subscribe:
+                stream_updates(client, cities)
+            else:
+                print(format_response(client.weather_many(cities)))
+    except ConnectionRefusedError:
+        print("Could not connect to server. Make sure the server is running.")
+    except Exception as e:
+        print("Client error:", e)
+
+def parse_cities(text):
+    return [c.strip() for c in text.split(',') if c.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Client for the weather server.")
+    parser.add_argument('host', nargs='?', default=HOST, help=f"server host (default: {HOST})")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"server port (default: {PORT})")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--cities', help="comma separated cities to fetch in one request, then exit")
+    group.add_argument('--subscribe', help="comma separated cities to stream updates for until Ctrl-C")
+    args = parser.parse_args()
+    if args.cities or args.subscribe:
+        run_once(args.host, args.port, parse_cities(args.cities or args.subscribe), bool(args.subscribe))
+    else:
+        run_client(args.host, args.port)
+
 if __name__ == '__main__':
-    run_client(HOST, PORT)
+    main()
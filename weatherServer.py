@@ -4,21 +4,82 @@ weather_server.py
 A simple multithreaded TCP server that simulates weather data for cities.
 
 Usage:
-    python3 weather_server.py [port]
+    python3 weather_server.py [port] [--cache-ttl SECONDS] [--cache-size N]
+                              [--push-interval SECONDS] [--max-subscribers N]
+                              [--cities FILE]
+                              [--encoder template|orjson|json] [--seed N]
+                              [--workers N] [--queue-limit N] [--processes N]
 
 Default port: 5500
+
+Protocol (one request per line, one JSON line back):
+    <city>                      -> {"city": ..., "status": "ok", ...}
+    MULTI <city>,<city>,...     -> [{...}, {...}, ...]  one object per city
+    SUBSCRIBE <city>,<city>,... -> {"status": "subscribed", ...}, then a
+                                   MULTI-style array every --push-interval
+                                   seconds (default 5) until
+    UNSUBSCRIBE                 -> {"status": "unsubscribed"}
+    quit | exit                 -> {"status": "bye", ...}
+A MULTI or SUBSCRIBE line takes up to 1000 cities. Unknown cities get an
+error object in their slot instead of failing the whole request.
+
+A subscribed connection leaves the worker pool: one SubscriptionHub thread
+serves and pushes to every subscriber, up to --max-subscribers of them, so
+subscribers never lock out one-shot requests.
+
+The cities known are the handful in BASE_WEATHER, or a catalog file given
+with --cities (see city_catalog.py), loaded in the background at startup.
+An unknown city's error suggests close matches ("Did you mean ...").
+
+The weather itself comes from weather_sim.py: a city's weather is fixed
+for each 5-minute bucket and reproducible from --seed (a random seed is
+picked and printed if none is given), so load test runs can be replayed.
+
+Weather responses are encoded by filling a bytes template for their fixed
+schema, which gives exactly the bytes json.dumps() would at about a
+quarter of the cost. --encoder orjson uses orjson instead, if installed
+(compact JSON without spaces; it has to build a dict first, so it is
+slower than the template here), and --encoder json the plain
+json.dumps() path.
+
+Responses are cached per city as ready-to-send bytes for --cache-ttl
+seconds (default 1, 0 disables the cache), so a city polled many times a
+second is simulated and encoded once per TTL. Every response carries the
+'timestamp' it was generated at, which is never more than the TTL old.
 """
+import argparse
+import heapq
+import json
+import selectors
 import socket
 import threading
-import json
 import time
 import random
-import sys
+from collections import OrderedDict
+from functools import lru_cache, partial
+from itertools import count
+
+from cityCatalog import CityCatalog, normalize_name
+from metrics import service_metrics
+import serverLog as log
+from serverCore import Connection, LineSession, SelectorServer, WorkerPoolServer, add_pool_arguments, serve
+from weatherSim import WeatherSim
+
+try:
+    import orjson
+except ImportError:  # optional: the template encoder is used instead
+    orjson = None
 
 HOST = '0.0.0.0'
 PORT = 5500
-if len(sys.argv) >= 2:
-    PORT = int(sys.argv[1])
+CACHE_TTL = 1.0
+CACHE_SIZE = 1024
+PUSH_INTERVAL = 5.0
+MIN_PUSH_INTERVAL = 0.1
+MAX_SUBSCRIBERS = 10000
+SUBSCRIBER_WRITE_TIMEOUT = 30.0  # seconds a subscriber may leave a push unread
+RECV_SIZE = 65536
+MAX_CITIES = 1000  # per MULTI / SUBSCRIBE line
 
 # Hardcoded base weather data for some cities (values are averages)
 BASE_WEATHER = {
@@ -30,91 +91,401 @@ BASE_WEATHER = {
     'delhi':      {'temp_c': 28.0, 'humidity': 50, 'conditions': ['Hot', 'Hazy', 'Sunny']},
 }
 
-def simulate_weather(city_lower):
+DEFAULT_CATALOG = CityCatalog(cities=BASE_WEATHER)
+DEFAULT_SIM = WeatherSim(DEFAULT_CATALOG)
+
+# Keys of a weather response, in order; WeatherSim.weather() returns all but 'status'
+WEATHER_FIELDS = ('city', 'temperature_c', 'feels_like_c', 'humidity_pct',
+                  'condition', 'wind_kph', 'timestamp', 'status')
+
+def simulate_weather(city, sim=DEFAULT_SIM, timestamp=None):
     """
-    Return a dict with simulated weather data for the city.
-    If city is known in BASE_WEATHER, use base values + small randomness.
+    Return a dict with simulated weather data for the city, or None if
+    it isn't in the simulation's catalog.
     """
-    base = BASE_WEATHER.get(city_lower)
-    if not base:
+    weather = sim.weather(city, timestamp)
+    if weather is None:
         return None
+    return dict(zip(WEATHER_FIELDS, weather + ('ok',)))
+
+class ResponseCache:
+    """
+    Encoded response lines by key, each kept for ttl seconds; when full,
+    the least recently used entry goes first. Thread-safe.
+    """
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.entries = OrderedDict()  # key -> (expires at, bytes)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        """Cached bytes for key, calling build() to make them on a miss or once expired."""
+        if self.ttl <= 0:
+            return build()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        data = build()
+        with self.lock:
+            self.entries[key] = (now + self.ttl, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return data
+
+    def stats(self):
+        with self.lock:
+            return {
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_evictions': self.evictions,
+                'cache_entries': len(self.entries),
+            }
+
+NO_CACHE = ResponseCache(ttl=0)
+
+def encode(resp):
+    # send response as single-line JSON
+    return (json.dumps(resp) + '\n').encode('utf-8')
+
+# json.dumps() of a weather dict with the values filled in by %-formatting:
+# float reprs are what json writes for floats, strings come from json_string()
+WEATHER_TEMPLATE = (b'{"city": %s, "temperature_c": %a, "feels_like_c": %a, "humidity_pct": %d, '
+                    b'"condition": %s, "wind_kph": %a, "timestamp": %d, "status": "ok"}\n')
+
+@lru_cache(maxsize=65536)
+def json_string(text):
+    return json.dumps(text).encode('utf-8')
+
+def encode_weather_template(weather):
+    name, temp, feels_like, humidity, condition, wind_kph, timestamp = weather
+    return WEATHER_TEMPLATE % (json_string(name), temp, feels_like, humidity,
+                               json_string(condition), wind_kph, timestamp)
+
+def encode_weather_json(weather):
+    return encode(dict(zip(WEATHER_FIELDS, weather + ('ok',))))
+
+def encode_weather_orjson(weather):
+    return orjson.dumps(dict(zip(WEATHER_FIELDS, weather + ('ok',))), option=orjson.OPT_APPEND_NEWLINE)
+
+ENCODERS = {
+    'template': encode_weather_template,
+    'orjson': encode_weather_orjson,
+    'json': encode_weather_json,
+}
+encode_weather = encode_weather_template
+
+def use_encoder(name):
+    """Pick the weather response encoder by its ENCODERS key. Returns the name used."""
+    global encode_weather
+    if name == 'orjson' and orjson is None:
+        print("[!] orjson is not installed; using the template encoder")
+        name = 'template'
+    encode_weather = ENCODERS[name]
+    return name
+
+def build_response(city, sim=DEFAULT_SIM):
+    """Encoded response line for one city request."""
+    weather = sim.weather(city)
+    if weather is not None:
+        return encode_weather(weather)
+    # Not found — respond with error plus the closest city names, if any
+    suggestions = sim.catalog.suggest(normalize_name(city))
+    message = f"No data for city '{city}'."
+    if suggestions:
+        message += f" Did you mean: {', '.join(suggestions)}?"
+    return encode({'status': 'error', 'message': message})
+
+def get_response(city, cache, sim=DEFAULT_SIM):
+    city_key = normalize_name(city)
+    if sim.catalog.index(city_key) >= 0:
+        return cache.get(city_key, lambda: build_response(city, sim))
+    # Unknown cities aren't cached: every misspelling would evict a real
+    # city, and the expensive part, suggest(), has an LRU and a CPU budget of its own
+    return build_response(city, sim)
+
+def parse_cities(text):
+    """Cities from a comma separated list, e.g. "london, new york,tokyo"."""
+    return [c.strip() for c in text.split(',') if c.strip()]
+
+def multi_response(cities, cache, sim=DEFAULT_SIM):
+    """One JSON array line holding every city's response, joined from the per-city cache."""
+    return b'[' + b', '.join(get_response(city, cache, sim)[:-1] for city in cities) + b']\n'
+
+BYE = encode({'status': 'bye', 'message': 'Goodbye'})
+
+def error_line(message):
+    return encode({'status': 'error', 'message': message})
 
-    # add small random variation to make each request slightly different
-    temp = round(base['temp_c'] + random.uniform(-3.0, 3.0), 1)
-    humidity = max(10, min(100, int(base['humidity'] + random.uniform(-8, 8))))
-    condition = random.choice(base['conditions'])
-
-    # Compute a simple "feels like" (very rough)
-    feels_like = temp
-    if temp >= 30:
-        feels_like = round(temp + (humidity - 50) * 0.05, 1)
-    elif temp < 10:
-        feels_like = round(temp - (50 - humidity) * 0.02, 1)
-
-    # wind simulated
-    wind_kph = round(abs(random.gauss(10, 4)), 1)
-
-    return {
-        'city': city_lower.title(),
-        'temperature_c': temp,
-        'feels_like_c': feels_like,
-        'humidity_pct': humidity,
-        'condition': condition,
-        'wind_kph': wind_kph,
-        'timestamp': int(time.time()),
-        'status': 'ok'
-    }
-
-def handle_client(conn, addr):
-    print(f"[+] Client connected: {addr}")
+def check_cities(command, cities):
+    """An error line if a MULTI/SUBSCRIBE city list is unusable, else None."""
+    if not cities:
+        return error_line(f"Send in format: {command} city,city,...")
+    if len(cities) > MAX_CITIES:
+        return error_line(f"At most {MAX_CITIES} cities per {command}.")
+    return None
+
+class Subscriber(Connection):
+    """A subscribed connection on the SubscriptionHub."""
+    __slots__ = ('generation', 'behind_since')
+
+    def __init__(self, sock, addr, session):
+        super().__init__(sock, addr, session)
+        self.generation = 0        # the session's SUBSCRIBE/UNSUBSCRIBE count last acted on
+        self.behind_since = None   # when a push was first held back by unsent output
+
+class SubscriptionHub(SelectorServer):
+    """
+    Serves every subscribed connection of this process from one thread, so
+    subscribers hold no worker and no thread each. A worker hands a
+    connection over with adopt() once its client subscribes; from then on
+    the hub reads its requests (through the same WeatherSession) and pushes
+    its cities every interval seconds from one timer heap. At most
+    max_subscribers connections are taken (a soft cap, checked at SUBSCRIBE);
+    a client that leaves a push unread for write_timeout seconds is dropped.
+    The thread, selector and wake-up pipe are made on first use, so each
+    prefork worker process gets its own.
+    """
+    def __init__(self, cache, sim, interval=PUSH_INTERVAL, max_subscribers=MAX_SUBSCRIBERS,
+                 write_timeout=SUBSCRIBER_WRITE_TIMEOUT):
+        super().__init__("Weather subscriptions", None, None, None, max_connections=max_subscribers)
+        self.cache = cache
+        self.sim = sim
+        self.interval = interval
+        self.write_timeout = write_timeout
+        self.lock = threading.Lock()
+        self.adopted = []      # (sock, addr, session) handed over, not yet registered
+        self.timers = []       # heap of (due, seq, generation, Subscriber)
+        self.seq = count()
+        self.waker = None
+
+    def has_room(self):
+        return self.connections + len(self.adopted) < self.max_connections
+
+    def adopt(self, conn, addr, session):
+        """Take over conn (and session) from a worker thread; the worker must not use it again."""
+        session.adopted = True
+        sock = socket.socket(fileno=conn.detach())
+        sock.setblocking(False)
+        with self.lock:
+            if self.waker is None:
+                self.start()
+            self.adopted.append((sock, addr, session))
+        try:
+            self.waker[1].send(b'\0')
+        except OSError:
+            pass  # the pipe is full, so the hub is awake anyway
+
+    def start(self):
+        self.selector = selectors.DefaultSelector()
+        self.waker = socket.socketpair()
+        for end in self.waker:
+            end.setblocking(False)
+        self.selector.register(self.waker[0], selectors.EVENT_READ, None)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def take_adopted(self):
+        try:
+            while self.waker[0].recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        with self.lock:
+            adopted, self.adopted = self.adopted, []
+        for sock, addr, session in adopted:
+            conn = Subscriber(sock, addr, session)
+            self.connections += 1
+            self.accepted += 1
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            self.resync(conn)
+
+    def close(self, conn):
+        super().close(conn)
+        log.info("[-] Client disconnected: %s", conn.addr)
+
+    def read(self, conn):
+        super().read(conn)
+        if conn.sock.fileno() >= 0:
+            self.resync(conn)
+
+    def resync(self, conn):
+        """Act on a SUBSCRIBE or UNSUBSCRIBE: push straight away, or stop the timer."""
+        session = conn.session
+        if conn.generation == session.generation:
+            return
+        conn.generation = session.generation
+        if session.cities is not None:
+            self.push(conn)
+
+    def push(self, conn):
+        now = time.monotonic()
+        if conn.outbuf:
+            # the last push hasn't gone out yet; skip this one rather than pile up
+            if conn.behind_since is None:
+                conn.behind_since = now
+            elif now - conn.behind_since > self.write_timeout:
+                log.warning("[!] Dropping subscriber %s: not reading its updates", conn.addr)
+                self.close(conn)
+                return
+        else:
+            conn.behind_since = None
+            conn.outbuf += multi_response(conn.session.cities, self.cache, self.sim)
+            if not self.flush(conn):
+                return
+        heapq.heappush(self.timers, (now + self.interval, next(self.seq), conn.generation, conn))
+
+    def push_due(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, generation, conn = heapq.heappop(self.timers)
+            # closed, or re-subscribed/unsubscribed since: that timer is stale
+            if conn.sock.fileno() >= 0 and generation == conn.session.generation:
+                self.push(conn)
+
+    def run(self):
+        while True:
+            timeout = max(0.0, self.timers[0][0] - time.monotonic()) if self.timers else None
+            for key, events in self.selector.select(timeout):
+                conn = key.data
+                if conn is None:
+                    self.take_adopted()
+                    continue
+                if conn.sock.fileno() < 0:
+                    continue  # closed by an earlier event in this batch
+                if events & selectors.EVENT_WRITE and not self.flush(conn):
+                    continue
+                if events & selectors.EVENT_READ:
+                    self.read(conn)
+            self.push_due()
+
+    def stats(self):
+        return {'subscribers': self.connections}
+
+class WeatherSession(LineSession):
+    """
+    Weather requests from one connection. SUBSCRIBE needs a SubscriptionHub
+    to hand the connection to (handle_client() does that); without one (the
+    gateway) it is refused.
+    """
+    metrics = service_metrics('weather')
+
+    def __init__(self, addr, cache=NO_CACHE, sim=DEFAULT_SIM, hub=None):
+        super().__init__(addr)
+        self.cache = cache
+        self.sim = sim
+        self.hub = hub
+        self.cities = None      # subscribed cities, read by the hub at each push
+        self.generation = 0     # SUBSCRIBE/UNSUBSCRIBE count, so the hub notices changes
+        self.adopted = False    # on the hub already, so counted among its subscribers
+
+    def respond(self, line):
+        """(response bytes or None, close after it?) for one request line."""
+        city = line.strip()
+        if not city:
+            # ignore empty lines
+            return None, False
+        if city.lower() in ('quit', 'exit'):
+            # allow client to close politely
+            return BYE, True
+        command, _, rest = city.partition(' ')
+        command = command.upper()
+        if command == 'MULTI':
+            cities = parse_cities(rest)
+            return check_cities(command, cities) or multi_response(cities, self.cache, self.sim), False
+        if command in ('SUBSCRIBE', 'UNSUBSCRIBE') and self.hub is None:
+            return error_line(f"{command} needs a direct connection to the weather server."), False
+        if command == 'SUBSCRIBE':
+            cities = parse_cities(rest)
+            error = check_cities(command, cities)
+            if error:
+                return error, False
+            if not self.adopted and not self.hub.has_room():
+                return error_line("Too many subscribers, try again later."), False
+            self.cities = cities
+            self.generation += 1
+            return encode({'status': 'subscribed', 'cities': cities, 'interval': self.hub.interval}), False
+        if command == 'UNSUBSCRIBE':
+            self.cities = None
+            self.generation += 1
+            return encode({'status': 'unsubscribed'}), False
+        return get_response(city, self.cache, self.sim), False
+
+    def handle_line(self, line):
+        response, close = self.respond(line)
+        return (response.decode('utf-8') if response is not None else None), close
+
+def handle_client(conn, addr, cache=NO_CACHE, sim=DEFAULT_SIM, hub=None):
+    """Serve one connection on a worker until it subscribes; then hand it to the hub."""
+    log.info("[+] Client connected: %s", addr)
+    session = WeatherSession(addr, cache, sim, hub)
+    session.opened()
     try:
         with conn:
-            f = conn.makefile('r')  # read lines
             while True:
-                line = f.readline()
-                if not line:
-                    break  # client closed
-                city = line.strip()
-                if not city:
-                    # ignore empty lines
-                    continue
-                if city.lower() in ('quit', 'exit'):
-                    # allow client to close politely
-                    conn.sendall((json.dumps({'status':'bye', 'message':'Goodbye'}) + '\n').encode('utf-8'))
+                data = conn.recv(RECV_SIZE)
+                out, close = session.feed(data) if data else session.feed_eof()
+                if out:
+                    conn.sendall(out)
+                if close or not data:
                     break
-
-                # Simulate lookup
-                city_key = city.lower()
-                data = simulate_weather(city_key)
-                if data is None:
-                    # Not found — respond with error plus a small simulated fallback (optional)
-                    resp = {
-                        'status': 'error',
-                        'message': f"No hardcoded data for city '{city}'. Try one of: {', '.join(k.title() for k in BASE_WEATHER.keys())}"
-                    }
-                else:
-                    resp = data
-
-                # send response as single-line JSON
-                conn.sendall((json.dumps(resp) + '\n').encode('utf-8'))
+                if session.cities is not None:
+                    hub.adopt(conn, addr, session)
+                    return  # the hub owns the connection and the session now
     except Exception as e:
-        print(f"[!] Error with client {addr}: {e}")
-    finally:
-        print(f"[-] Client disconnected: {addr}")
-
-def start_server(host, port):
-    print(f"Starting Weather Server on {host}:{port}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((host, port))
-        s.listen(8)
-        try:
-            while True:
-                conn, addr = s.accept()
-                t = threading.Thread(target=handle_client, args=(conn, addr), daemon=True)
-                t.start()
-        except KeyboardInterrupt:
-            print("\nServer shutting down...")
+        log.warning("[!] Error with client %s: %s", addr, e)
+    session.closed()
+    log.info("[-] Client disconnected: %s", addr)
+
+def start_server(host, port, args):
+    print(f"[*] Encoding responses with the {use_encoder(args.encoder)} encoder")
+    cache = ResponseCache(args.cache_ttl, args.cache_size)
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+    print(f"[*] Simulating weather with --seed {seed}")
+    catalog = CityCatalog(args.cities) if args.cities else DEFAULT_CATALOG
+    sim = WeatherSim(catalog, seed)
+    if args.processes > 1:
+        sim.preload()  # before forking, so the workers share one copy
+    else:
+        threading.Thread(target=sim.preload, daemon=True).start()
+    busy = json.dumps({'status': 'error', 'message': 'Server busy, try again later.'}) + '\n'
+    hub = SubscriptionHub(cache, sim, max(MIN_PUSH_INTERVAL, args.push_interval), args.max_subscribers)
+    handler = partial(handle_client, cache=cache, sim=sim, hub=hub)
+    server = WorkerPoolServer.from_args("Weather Server", host, port, handler, args,
+                                        busy_message=busy.encode('utf-8'))
+    server.add_stats_source(cache.stats)
+    server.add_stats_source(hub.stats)
+    serve(server, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated weather server.")
+    parser.add_argument('port', type=int, nargs='?', default=PORT, help=f"listen port (default: {PORT})")
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL,
+                        help=f"seconds a city's response is reused, 0 = no cache (default: {CACHE_TTL})")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help=f"cities kept in the response cache (default: {CACHE_SIZE})")
+    parser.add_argument('--push-interval', type=float, default=PUSH_INTERVAL,
+                        help=f"seconds between SUBSCRIBE updates (default: {PUSH_INTERVAL})")
+    parser.add_argument('--max-subscribers', type=int, default=MAX_SUBSCRIBERS,
+                        help=f"subscribed connections kept at once (default: {MAX_SUBSCRIBERS})")
+    parser.add_argument('--cities', metavar='FILE',
+                        help="city catalog file (see city_catalog.py); default: the built-in cities")
+    parser.add_argument('--encoder', choices=list(ENCODERS), default='template',
+                        help="weather response encoder (default: template)")
+    parser.add_argument('--seed', type=int,
+                        help="weather simulation seed, for reproducible runs (default: random)")
+    add_pool_arguments(parser)
+    args = parser.parse_args()
+    start_server(HOST, args.port, args)
 
 if __name__ == '__main__':
-    start_server(HOST, PORT)
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# weather_sim.py
+"""
+Deterministic weather simulation for the weather server.
+
+Time is cut into BUCKET_SECONDS buckets. A city's weather in a bucket is a
+pure function of (seed, city name, bucket): four 64-bit hashes (splitmix64
+of the city's name hash, the bucket number and the seed) pick the
+temperature and humidity offsets around the city's averages, one of its
+conditions and a wind speed. The same seed and timestamp always give the
+same weather, in every process, whatever else is in the catalog.
+
+Buckets are grouped in windows of WINDOW_BUCKETS. With NumPy the whole
+catalog's table for a window is generated in one vectorized batch (values
+kept as int16 tenths, about 100 bytes per city per window), and a request
+is a lookup in it; the next window is generated in the background while
+the last bucket of the current one is being served. Without NumPy each
+request computes its city's values on the spot from the same integer
+formulas, so the results are identical either way.
+
+Try it against a catalog (see city_catalog.py):
+    python3 weatherSim.py london tokyo --seed 42 --at 1700000000
+"""
+import argparse
+import hashlib
+import threading
+import time
+
+from cityCatalog import CityCatalog, normalize_name
+
+try:
+    import numpy as np
+except ImportError:  # optional: values are computed per request instead
+    np = None
+
+BUCKET_SECONDS = 300
+WINDOW_BUCKETS = 12          # one window = one hour
+WINDOW_SECONDS = BUCKET_SECONDS * WINDOW_BUCKETS
+WINDOWS_KEPT = 2             # tables kept: the current window and the next
+
+MASK = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+BUCKET_MULTIPLIER = 0xD1B54A32D192ED03
+SEED_MULTIPLIER = 0xAEF17502108EF2D9
+STREAMS = (0x243F6A8885A308D3, 0x13198A2E03707344, 0xA4093822299F31D0, 0x082EFA98EC4E6C89)
+# wind: the sum of the four 16-bit slices of a hash is roughly normal
+# (Irwin-Hall); it is scaled to a mean of 10 kph and a deviation of 4
+WIND_MEAN = 4 * 0xFFFF // 2
+WIND_SCALE = 37837           # standard deviation of that sum
+
+def city_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def splitmix64(z):
+    z = (z + GOLDEN) & MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+    return z ^ (z >> 31)
+
+def splitmix64_array(z):
+    """splitmix64 over a uint64 array; the multiplications wrap like the & MASK above."""
+    z = z + np.uint64(GOLDEN)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class WeatherSim:
+    """
+    Seeded weather for the cities of a catalog. weather(city, timestamp)
+    returns the weather tuple weatherServer encodes. Thread-safe.
+    """
+    def __init__(self, catalog, seed=0):
+        self.catalog = catalog
+        self.seed = seed
+        self.seed_term = seed * SEED_MULTIPLIER & MASK
+        self.lock = threading.Lock()
+        self.bases = None
+        self.tables = {}         # window -> (temp10, feels10, humidity, wind10, condition) arrays
+        self.generating = set()  # windows being generated
+
+    def load_bases(self):
+        """Per-city averages and name hashes, as NumPy arrays when available."""
+        if self.bases is not None:
+            return self.bases
+        catalog = self.catalog
+        catalog.load()
+        with self.lock:
+            if self.bases is None:
+                temp10 = [round(t * 10) for t in catalog.temps]
+                humidity = list(catalog.humidity)
+                counts = [len(catalog.condition_sets[c]) for c in catalog.condition_ids]
+                hashes = [city_hash(key) for key in catalog.keys]
+                if np is not None:
+                    temp10 = np.array(temp10, dtype=np.int64)
+                    humidity = np.array(humidity, dtype=np.int64)
+                    counts = np.array(counts, dtype=np.uint64)
+                    hashes = np.array(hashes, dtype=np.uint64)
+                self.bases = (temp10, humidity, counts, hashes)
+        return self.bases
+
+    def generate(self, window):
+        """
+        The whole catalog's table for one window, in one vectorized batch.
+        Same integer arithmetic as sample(), on (cities, buckets) arrays.
+        """
+        temp10, humidity, counts, hashes = self.load_bases()
+        buckets = np.arange(window * WINDOW_BUCKETS, (window + 1) * WINDOW_BUCKETS, dtype=np.uint64)
+        keys = hashes[:, None] + (buckets * np.uint64(BUCKET_MULTIPLIER) + np.uint64(self.seed_term))[None, :]
+
+        def stream(i):
+            return splitmix64_array(keys ^ np.uint64(STREAMS[i]))
+
+        t10 = temp10[:, None] + (stream(0) % np.uint64(61)).astype(np.int64) - 30
+        hum = np.clip(humidity[:, None] + (stream(1) % np.uint64(17)).astype(np.int64) - 8, 10, 100)
+        condition = (stream(2) % counts[:, None]).astype(np.uint8)
+        h_wind = stream(3)
+        wind = sum(((h_wind >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.int64)
+                   for shift in (0, 16, 32, 48))
+        wind10 = np.abs(100 + (wind - WIND_MEAN) * 40 // WIND_SCALE)
+        feels10 = np.where(t10 >= 300, t10 + ((hum - 50) * 5 + 5) // 10,
+                           np.where(t10 < 100, t10 - ((50 - hum) * 2 + 5) // 10, t10))
+        return (t10.astype(np.int16), feels10.astype(np.int16), hum.astype(np.uint8),
+                wind10.astype(np.int16), condition)
+
+    def table(self, window):
+        table = self.tables.get(window)
+        if table is not None:
+            return table
+        self.load_bases()  # takes the lock itself
+        with self.lock:
+            table = self.tables.get(window)
+            if table is None:
+                table = self.store(window)
+        return table
+
+    def store(self, window):
+        # called with self.lock held, after load_bases()
+        started = time.time()
+        table = self.generate(window)
+        tables = dict(self.tables)
+        tables[window] = table
+        for old in sorted(tables)[:-WINDOWS_KEPT]:
+            del tables[old]
+        self.tables = tables  # one reference swap; readers never see a half-built dict
+        if self.catalog.path:
+            print(f"[*] Generated weather for {len(self.catalog.keys)} cities, window {window}, "
+                  f"in {time.time() - started:.2f}s")
+        return table
+
+    def prefetch(self, window):
+        """Generate a window's table in a background thread, if nobody has yet."""
+        if window in self.tables or window in self.generating:
+            return  # the common case, without waiting on a generation in progress
+        with self.lock:
+            if window in self.tables or window in self.generating:
+                return
+            self.generating.add(window)
+        threading.Thread(target=self.run_prefetch, args=(window,), daemon=True).start()
+
+    def run_prefetch(self, window):
+        try:
+            self.load_bases()
+            with self.lock:
+                if window not in self.tables:
+                    self.store(window)
+        finally:
+            self.generating.discard(window)
+
+    def preload(self):
+        """Load the catalog and generate the current window now rather than on first use."""
+        self.catalog.preload()
+        self.table(int(time.time()) // WINDOW_SECONDS)
+
+    def sample(self, row, bucket):
+        """
+        (temp10, feels10, humidity, wind10, condition) for one city and
+        bucket, computed directly. Temperatures and wind are in tenths.
+        """
+        temp10, humidity, counts, hashes = self.load_bases()
+        key = (int(hashes[row]) + bucket * BUCKET_MULTIPLIER + self.seed_term) & MASK
+        h_temp, h_humidity, h_condition, h_wind = (splitmix64(key ^ s) for s in STREAMS)
+        t10 = int(temp10[row]) + h_temp % 61 - 30                      # +-3.0 °C
+        hum = max(10, min(100, int(humidity[row]) + h_humidity % 17 - 8))  # +-8 %
+        wind = (h_wind & 0xFFFF) + (h_wind >> 16 & 0xFFFF) + (h_wind >> 32 & 0xFFFF) + (h_wind >> 48)
+        wind10 = abs(100 + (wind - WIND_MEAN) * 40 // WIND_SCALE)
+        # Compute a simple "feels like" (very rough), as the server always has
+        feels10 = t10
+        if t10 >= 300:
+            feels10 = t10 + ((hum - 50) * 5 + 5) // 10  # +0.05 °C per % over 50, rounded
+        elif t10 < 100:
+            feels10 = t10 - ((50 - hum) * 2 + 5) // 10  # -0.02 °C per % under 50
+        return t10, feels10, hum, wind10, h_condition % int(counts[row])
+
+    def weather(self, city, timestamp=None):
+        """
+        (city, temperature_c, feels_like_c, humidity_pct, condition, wind_kph,
+        timestamp) for a city name at a time (default: now), or None if the
+        city isn't in the catalog.
+        """
+        row = self.catalog.index(normalize_name(city))
+        if row < 0:
+            return None
+        timestamp = int(time.time()) if timestamp is None else int(timestamp)
+        bucket = timestamp // BUCKET_SECONDS
+        if np is None:
+            t10, f10, hum, w10, cond = self.sample(row, bucket)
+        else:
+            window, offset = divmod(bucket, WINDOW_BUCKETS)
+            t10, f10, hum, w10, cond = (a.item(row, offset) for a in self.table(window))
+            if offset == WINDOW_BUCKETS - 1:
+                self.prefetch(window + 1)
+        catalog = self.catalog
+        condition = catalog.condition_sets[catalog.condition_ids[row]][cond]
+        return (catalog.names[row], t10 / 10, f10 / 10, hum, condition, w10 / 10, timestamp)
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the simulated weather for some cities.")
+    parser.add_argument('cities', nargs='+')
+    parser.add_argument('--catalog', help="city catalog file (default: the weather server's built-in cities)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--at', type=int, help="unix timestamp (default: now)")
+    args = parser.parse_args()
+
+    if args.catalog:
+        catalog = CityCatalog(args.catalog)
+    else:
+        from weatherServer import DEFAULT_CATALOG as catalog
+    sim = WeatherSim(catalog, args.seed)
+    for city in args.cities:
+        weather = sim.weather(city, args.at)
+        if weather is None:
+            print(f"{city}: not in the catalog")
+        else:
+            name, temp, feels, humidity, condition, wind, _ = weather
+            print(f"{name}: {condition}, {temp} °C (feels like {feels}), {humidity} %, wind {wind} kph")
+
+if __name__ == '__main__':
+    main()